@@ -1,11 +1,27 @@
+import os
+import asyncio
 import logging
+import tempfile
+from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 from database import (
-    add_teacher, is_teacher, create_quiz, get_teacher_quizzes,
-    get_quiz_statistics, delete_quiz
+    add_teacher_async, is_teacher_async, create_quiz_async, get_teacher_quizzes_async,
+    get_quizzes_statistics_async, get_quiz_by_code_async, get_quiz_by_id_async, delete_quiz,
+    save_quiz_draft_async, load_quiz_draft_async, get_quiz_draft_version_async,
+    delete_quiz_draft_async, delete_expired_quiz_drafts_async
 )
+from export import export_quiz_results, EXPORT_FORMATS, MAX_DOCUMENT_BYTES
+from quiz_import import (
+    parse_questions_file, parse_questions_text, is_bulk_questions_text,
+    IMPORT_FORMATS, MAX_REPORTED_ERRORS
+)
+from regrade import regrade_quiz_async
+from analytics import get_item_analysis
+from quiz_render import answer_display
 from models import QuizBuilder, Question
+from sessions import SessionStore
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -18,25 +34,114 @@ logger = logging.getLogger(__name__)
     MCQ_OPTIONS,
     CORRECT_ANSWER,
     CONFIRM_QUESTION,
-    CONFIRM_QUIZ
-) = range(8)
+    CONFIRM_QUIZ,
+    RESUME_DRAFT
+) = range(9)
+
+# حذف المسودات المهجورة من قاعدة البيانات بعد N ثانية بدون تعديل
+QUIZ_DRAFT_TTL = int(os.getenv('QUIZ_DRAFT_TTL', str(7 * 24 * 3600)))
+QUIZ_DRAFT_SWEEP_INTERVAL = int(os.getenv('QUIZ_DRAFT_SWEEP_INTERVAL', '3600'))
+
+# أقصى عدد أسئلة في رسالة تحليل الأسئلة (حد طول رسالة تيليجرام)
+ANALYSIS_MAX_QUESTIONS = int(os.getenv('ANALYSIS_MAX_QUESTIONS', '40'))
+
+# أزرار خطوات إنشاء الكويز (تُستعاد بها المسودة إذا لم تكن هناك حالة محادثة)
+DRAFT_BUTTONS_PATTERN = r"^(draft_(resume|discard)|qtype_|answer_|mcq_answer_|quiz_(add_another|delete_last|finish)$)"
+
+# نسخ المسودات النشطة في الذاكرة (تُستعاد من قاعدة البيانات عند الحاجة)
+quiz_builders = SessionStore(
+    maxsize=int(os.getenv('QUIZ_DRAFT_CACHE_SIZE', '1000')),
+    idle_ttl=int(os.getenv('QUIZ_DRAFT_CACHE_TTL', '3600'))
+)
+metrics.register('quiz_drafts', quiz_builders.stats)
 
-# تخزين مؤقت لبناء الكويزات
-quiz_builders = {}
+async def _get_builder(user_id):
+    """مسودة المعلم: النسخة في الذاكرة إذا كانت بإصدار قاعدة البيانات، وإلا تُستعاد منها
+    
+    عامل آخر (أو ما قبل إعادة التشغيل) قد يكون عدّل المسودة أو حذفها منذ آخر خطوة هنا
+    """
+    builder = quiz_builders.get(user_id)
+    if builder is not None and builder.version == await get_quiz_draft_version_async(user_id):
+        return builder
+    
+    data = await load_quiz_draft_async(user_id)
+    if data is None:
+        quiz_builders.pop(user_id)
+        return None
+    builder = QuizBuilder()
+    builder.load_from_dict(data)
+    builder.pending = data['pending']
+    builder.version = data['version']
+    builder.mark_clean()
+    quiz_builders.set(user_id, builder)
+    logger.info(f"✅ تمت استعادة مسودة المعلم {user_id} ({len(builder.questions)} سؤال)")
+    return builder
+
+async def _save_draft(user_id, builder):
+    """حفظ ما تغيّر فقط من المسودة في قاعدة البيانات (بالمقارنة والتبديل على الإصدار)"""
+    header = None
+    if builder.header_dirty:
+        header = {
+            'title': builder.title,
+            'description': builder.description,
+            'pending': builder.pending
+        }
+    questions = [
+        builder.questions[num - 1].to_dict()
+        for num in sorted(builder.dirty_questions)
+        if num <= len(builder.questions)
+    ]
+    # المسودة الجديدة تستبدل أي أسئلة محفوظة سابقاً
+    question_count = len(builder.questions) if builder.truncated or builder.version is None else None
+    
+    if header is None and not questions and question_count is None:
+        return True
+    version = await save_quiz_draft_async(user_id, header, questions, question_count, builder.version)
+    if version is None:
+        # تعارض مع عامل آخر أو فشل: تُحذف النسخة المحلية وتُستعاد المحفوظة في الخطوة التالية
+        logger.warning(f"⚠️ لم تُحفظ خطوة مسودة المعلم {user_id}، سيتم استعادة النسخة المحفوظة")
+        quiz_builders.pop(user_id)
+        return False
+    builder.version = version
+    builder.mark_clean()
+    return True
+
+async def _discard_draft(user_id):
+    """حذف مسودة المعلم من الذاكرة وقاعدة البيانات"""
+    quiz_builders.pop(user_id)
+    await delete_quiz_draft_async(user_id)
+
+async def sweep_quiz_drafts_job(context):
+    """مهمة دورية في JobQueue لحذف المسودات المهجورة"""
+    quiz_builders.sweep()
+    deleted = await delete_expired_quiz_drafts_async(datetime.now() - timedelta(seconds=QUIZ_DRAFT_TTL))
+    if deleted:
+        logger.info(f"✅ تم حذف {deleted} مسودة كويز مهجورة")
+
+async def _reply(update: Update, text, **kwargs):
+    """الرد بتعديل رسالة الزر أو برسالة جديدة حسب نوع التحديث"""
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text, **kwargs)
+    else:
+        await update.message.reply_text(text, **kwargs)
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """لوحة تحكم المعلم"""
     user_id = update.effective_user.id
     
     # إضافة المعلم تلقائياً
-    add_teacher(
+    await add_teacher_async(
         user_id,
         update.effective_user.username,
         update.effective_user.first_name
     )
     
+    # مسودة غير مكتملة من جلسة سابقة: زر الإنشاء يعرض متابعتها أو حذفها
+    has_draft = await get_quiz_draft_version_async(user_id) is not None
+    create_label = "▶️ متابعة مسودة الكويز" if has_draft else "📝 إنشاء كويز جديد"
+    
     keyboard = [
-        [InlineKeyboardButton("📝 إنشاء كويز جديد", callback_data="admin_create_quiz")],
+        [InlineKeyboardButton(create_label, callback_data="admin_create_quiz")],
         [InlineKeyboardButton("📋 قائمة الكويزات", callback_data="admin_list_quizzes")],
         [InlineKeyboardButton("📊 إحصائيات", callback_data="admin_stats")],
         [InlineKeyboardButton("❓ المساعدة", callback_data="admin_help")]
@@ -58,7 +163,7 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     
     user_id = query.from_user.id
     
-    if not is_teacher(user_id):
+    if not await is_teacher_async(user_id):
         await query.edit_message_text("⛔ ليس لديك صلاحية للوصول إلى هذه الصفحة.")
         return
     
@@ -75,15 +180,40 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
     
     elif data == "admin_help":
         await show_admin_help(update, context)
+    
+    elif data.startswith("admin_analysis_"):
+        await show_item_analysis(update, context, int(data[len("admin_analysis_"):]))
 
 async def start_quiz_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """بدء إنشاء كويز جديد"""
-    query = update.callback_query
+    """بدء إنشاء كويز جديد (مع عرض متابعة المسودة المحفوظة إن وجدت)"""
+    user_id = update.effective_user.id
+    builder = await _get_builder(user_id)
     
-    user_id = query.from_user.id
-    quiz_builders[user_id] = QuizBuilder()
+    if builder and (builder.title or builder.questions):
+        keyboard = [
+            [InlineKeyboardButton("▶️ متابعة المسودة", callback_data="draft_resume")],
+            [InlineKeyboardButton("🗑 حذفها وبدء كويز جديد", callback_data="draft_discard")]
+        ]
+        await _reply(
+            update,
+            f"📝 **لديك مسودة كويز غير مكتملة**\n\n"
+            f"📌 العنوان: {builder.title or '—'}\n"
+            f"📊 عدد الأسئلة: {len(builder.questions)}\n\n"
+            f"هل تريد متابعتها؟",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        return RESUME_DRAFT
     
-    await query.edit_message_text(
+    return await _start_new_draft(update, user_id)
+
+async def _start_new_draft(update: Update, user_id):
+    """إنشاء مسودة فارغة (بدلاً من أي مسودة محفوظة) وطلب العنوان"""
+    await _discard_draft(user_id)
+    quiz_builders.set(user_id, QuizBuilder())
+    
+    await _reply(
+        update,
         "📝 **إنشاء كويز جديد**\n\n"
         "الخطوة 1/8: أدخل عنوان الكويز\n\n"
         "مثال: `اختبار الرياضيات - الفصل الأول`\n\n"
@@ -93,16 +223,107 @@ async def start_quiz_creation(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     return QUIZ_TITLE
 
+async def resume_draft_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """متابعة المسودة المحفوظة أو حذفها"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    
+    if query.data == "draft_discard":
+        return await _start_new_draft(update, user_id)
+    
+    builder = await _get_builder(user_id)
+    if builder is None:
+        return await _start_new_draft(update, user_id)
+    return await _resume_step(query, builder)
+
+async def _resume_step(query, builder):
+    """العودة إلى الخطوة التي توقف عندها المعلم في المسودة"""
+    if not builder.title:
+        await query.edit_message_text("الخطوة 1/8: أدخل عنوان الكويز:")
+        return QUIZ_TITLE
+    if not builder.description:
+        await query.edit_message_text("الخطوة 2/8: أدخل وصف الكويز:")
+        return QUIZ_DESCRIPTION
+    
+    pending = builder.pending
+    if pending.get('type') == 'mcq' and pending.get('options'):
+        keyboard = [
+            [InlineKeyboardButton(opt, callback_data=f"mcq_answer_{opt[0]}")]
+            for opt in pending['options']
+        ]
+        await query.edit_message_text(
+            f"📝 نص السؤال: {pending.get('text', '')}\n\n"
+            "الخطوة 6/8: اختر الإجابة الصحيحة:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return CORRECT_ANSWER
+    if pending.get('text'):
+        await query.edit_message_text(
+            f"📝 نص السؤال: {pending['text']}\n\n"
+            "الخطوة 4/8: اختر نوع السؤال:",
+            reply_markup=_question_type_keyboard()
+        )
+        return QUESTION_TYPE
+    
+    await query.edit_message_text(
+        f"✅ **تمت استعادة المسودة**\n\n"
+        f"📊 عدد الأسئلة الحالي: {len(builder.questions)}\n\n"
+        f"أدخل نص السؤال التالي، أو الصق عدة أسئلة بصيغة `Q:` / `TF:`",
+        parse_mode='Markdown'
+    )
+    return QUESTION_TEXT
+
+async def resume_draft_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """زر من خطوات إنشاء الكويز بدون حالة محادثة (بعد إعادة التشغيل أو من عامل آخر)
+    
+    يُنفذ الزر إذا كانت المسودة المحفوظة عند خطوته، وإلا تُعرض الخطوة الحالية
+    """
+    query = update.callback_query
+    user_id = query.from_user.id
+    data = query.data
+    
+    builder = await _get_builder(user_id)
+    if builder is None:
+        await query.answer()
+        await query.edit_message_text("❌ انتهت جلسة إنشاء الكويز. ابدأ من جديد بـ /create")
+        return ConversationHandler.END
+    
+    pending = builder.pending
+    if data.startswith('draft_'):
+        return await resume_draft_choice(update, context)
+    if data.startswith('qtype_') and pending.get('text') and not pending.get('type'):
+        return await receive_question_type(update, context)
+    if data.startswith('answer_') and pending.get('type') == 'tf':
+        return await receive_correct_answer(update, context)
+    if data.startswith('mcq_answer_') and pending.get('type') == 'mcq' and pending.get('options'):
+        return await receive_correct_answer(update, context)
+    if data.startswith('quiz_') and not pending and builder.questions:
+        return await quiz_confirmation_handler(update, context)
+    
+    await query.answer()
+    return await _resume_step(query, builder)
+
+def _question_type_keyboard():
+    """أزرار اختيار نوع السؤال"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("📝 صح/خطأ (True/False)", callback_data="qtype_tf")],
+        [InlineKeyboardButton("🔠 اختيار من متعدد (MCQ)", callback_data="qtype_mcq")]
+    ])
+
 async def receive_quiz_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """استلام عنوان الكويز"""
     user_id = update.effective_user.id
+    builder = await _get_builder(user_id)
     
-    if user_id not in quiz_builders:
+    if builder is None:
         await update.message.reply_text("❌ حدث خطأ. الرجاء البدء من جديد.")
         return ConversationHandler.END
     
     title = update.message.text.strip()
-    quiz_builders[user_id].title = title
+    builder.set_title(title)
+    await _save_draft(user_id, builder)
     
     await update.message.reply_text(
         f"✅ تم حفظ العنوان: **{title}**\n\n"
@@ -117,17 +338,22 @@ async def receive_quiz_title(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def receive_quiz_description(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """استلام وصف الكويز"""
     user_id = update.effective_user.id
+    builder = await _get_builder(user_id)
     
-    if user_id not in quiz_builders:
+    if builder is None:
         await update.message.reply_text("❌ حدث خطأ. الرجاء البدء من جديد.")
         return ConversationHandler.END
     
     description = update.message.text.strip()
-    quiz_builders[user_id].description = description
+    builder.set_description(description)
+    await _save_draft(user_id, builder)
     
     await update.message.reply_text(
         "✅ تم حفظ الوصف\n\n"
         "الخطوة 3/8: أدخل نص السؤال الأول\n\n"
+        "💡 أو الصق عدة أسئلة دفعة واحدة:\n"
+        "`Q: نص السؤال`\n`A) خيار`\n`*B) الخيار الصحيح`\n"
+        "`TF: نص العبارة = T`\n\n"
         "اكتب السؤال الآن:",
         parse_mode='Markdown'
     )
@@ -137,29 +363,66 @@ async def receive_quiz_description(update: Update, context: ContextTypes.DEFAULT
 async def receive_question_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """استلام نص السؤال"""
     user_id = update.effective_user.id
+    builder = await _get_builder(user_id)
     
-    if user_id not in quiz_builders:
+    if builder is None:
         await update.message.reply_text("❌ حدث خطأ. الرجاء البدء من جديد.")
         return ConversationHandler.END
     
     question_text = update.message.text.strip()
-    context.user_data['current_question_text'] = question_text
     
-    keyboard = [
-        [InlineKeyboardButton("📝 صح/خطأ (True/False)", callback_data="qtype_tf")],
-        [InlineKeyboardButton("🔠 اختيار من متعدد (MCQ)", callback_data="qtype_mcq")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if is_bulk_questions_text(question_text):
+        return await receive_bulk_questions(update, context, builder, question_text)
+    
+    builder.clear_pending()
+    builder.set_pending(text=question_text)
+    await _save_draft(user_id, builder)
     
     await update.message.reply_text(
         f"📝 نص السؤال: **{question_text}**\n\n"
         "الخطوة 4/8: اختر نوع السؤال:",
-        reply_markup=reply_markup,
+        reply_markup=_question_type_keyboard(),
         parse_mode='Markdown'
     )
     
     return QUESTION_TYPE
 
+async def receive_bulk_questions(update: Update, context: ContextTypes.DEFAULT_TYPE, builder: QuizBuilder, text: str):
+    """إضافة عدة أسئلة ملصوقة في رسالة واحدة"""
+    user_id = update.effective_user.id
+    
+    questions, errors = parse_questions_text(text, start_num=len(builder.questions) + 1)
+    
+    if errors:
+        shown = "\n".join(f"• {error}" for error in errors[:MAX_REPORTED_ERRORS])
+        more = f"\n… و{len(errors) - MAX_REPORTED_ERRORS} أخطاء أخرى" if len(errors) > MAX_REPORTED_ERRORS else ""
+        await update.message.reply_text(
+            f"❌ لم تتم إضافة أي سؤال، صحح الأخطاء التالية وأعد الإرسال:\n\n{shown}{more}"
+        )
+        return QUESTION_TEXT
+    
+    for question in questions:
+        builder.add_question(question)
+    builder.clear_pending()
+    await _save_draft(user_id, builder)
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ إضافة سؤال آخر", callback_data="quiz_add_another"),
+            InlineKeyboardButton("🏁 إنهاء الكويز", callback_data="quiz_finish")
+        ],
+        [InlineKeyboardButton("❌ حذف آخر سؤال", callback_data="quiz_delete_last")]
+    ]
+    
+    await update.message.reply_text(
+        f"✅ تمت إضافة {len(questions)} سؤال\n\n"
+        f"📊 عدد الأسئلة الحالي: {len(builder.questions)}\n\n"
+        f"ماذا تريد أن تفعل؟",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    
+    return CONFIRM_QUESTION
+
 async def receive_question_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """استلام نوع السؤال"""
     query = update.callback_query
@@ -168,7 +431,13 @@ async def receive_question_type(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = query.from_user.id
     q_type = query.data.replace("qtype_", "")
     
-    context.user_data['current_question_type'] = q_type
+    builder = await _get_builder(user_id)
+    if builder is None:
+        await query.edit_message_text("❌ حدث خطأ. الرجاء البدء من جديد.")
+        return ConversationHandler.END
+    
+    builder.set_pending(type=q_type, options=[])
+    await _save_draft(user_id, builder)
     
     if q_type == 'tf':
         keyboard = [
@@ -202,6 +471,11 @@ async def receive_question_type(update: Update, context: ContextTypes.DEFAULT_TY
 async def receive_mcq_options(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """استلام خيارات MCQ"""
     user_id = update.effective_user.id
+    builder = await _get_builder(user_id)
+    
+    if builder is None:
+        await update.message.reply_text("❌ حدث خطأ. الرجاء البدء من جديد.")
+        return ConversationHandler.END
     
     options_text = update.message.text.strip()
     options = [opt.strip() for opt in options_text.split('\n') if opt.strip()]
@@ -219,7 +493,8 @@ async def receive_mcq_options(update: Update, context: ContextTypes.DEFAULT_TYPE
         label = chr(97 + i)  # a, b, c, d
         labeled_options.append(f"{label}) {opt}")
     
-    context.user_data['current_options'] = labeled_options
+    builder.set_pending(options=labeled_options)
+    await _save_draft(user_id, builder)
     
     # إنشاء أزرار للاختيار
     keyboard = []
@@ -243,8 +518,9 @@ async def receive_correct_answer(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     
     user_id = query.from_user.id
+    builder = await _get_builder(user_id)
     
-    if user_id not in quiz_builders:
+    if builder is None:
         await query.edit_message_text("❌ حدث خطأ. الرجاء البدء من جديد.")
         return ConversationHandler.END
     
@@ -255,13 +531,13 @@ async def receive_correct_answer(update: Update, context: ContextTypes.DEFAULT_T
         answer = answer.replace('answer_', '')
     
     # إنشاء السؤال
-    question_num = len(quiz_builders[user_id].questions) + 1
-    question_text = context.user_data.get('current_question_text', '')
-    q_type = context.user_data.get('current_question_type', '')
+    question_num = len(builder.questions) + 1
+    question_text = builder.pending.get('text', '')
+    q_type = builder.pending.get('type', '')
     
     options = None
     if q_type == 'mcq':
-        options = context.user_data.get('current_options', [])
+        options = builder.pending.get('options', [])
     
     question = Question(
         question_num=question_num,
@@ -271,7 +547,9 @@ async def receive_correct_answer(update: Update, context: ContextTypes.DEFAULT_T
         options=options
     )
     
-    quiz_builders[user_id].add_question(question)
+    builder.add_question(question)
+    builder.clear_pending()
+    await _save_draft(user_id, builder)
     
     # عرض السؤال المضاف
     question_display = f"**السؤال {question_num}:** {question_text}\n"
@@ -295,7 +573,7 @@ async def receive_correct_answer(update: Update, context: ContextTypes.DEFAULT_T
     await query.edit_message_text(
         f"✅ **تم إضافة السؤال بنجاح!**\n\n"
         f"{question_display}\n"
-        f"📊 عدد الأسئلة الحالي: {len(quiz_builders[user_id].questions)}\n\n"
+        f"📊 عدد الأسئلة الحالي: {len(builder.questions)}\n\n"
         f"ماذا تريد أن تفعل؟",
         reply_markup=reply_markup,
         parse_mode='Markdown'
@@ -309,8 +587,9 @@ async def quiz_confirmation_handler(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
     
     user_id = query.from_user.id
+    builder = await _get_builder(user_id)
     
-    if user_id not in quiz_builders:
+    if builder is None:
         await query.edit_message_text("❌ حدث خطأ. الرجاء البدء من جديد.")
         return ConversationHandler.END
     
@@ -320,18 +599,19 @@ async def quiz_confirmation_handler(update: Update, context: ContextTypes.DEFAUL
         # إضافة سؤال آخر
         await query.edit_message_text(
             f"📝 **إضافة سؤال جديد**\n\n"
-            f"السؤال رقم: {len(quiz_builders[user_id].questions) + 1}\n\n"
-            f"أدخل نص السؤال:",
+            f"السؤال رقم: {len(builder.questions) + 1}\n\n"
+            f"أدخل نص السؤال، أو الصق عدة أسئلة بصيغة `Q:` / `TF:`",
             parse_mode='Markdown'
         )
         return QUESTION_TEXT
     
     elif action == "quiz_delete_last":
         # حذف آخر سؤال
-        quiz_builders[user_id].remove_question(len(quiz_builders[user_id].questions))
+        builder.remove_question(len(builder.questions))
+        await _save_draft(user_id, builder)
         await query.edit_message_text(
             f"✅ **تم حذف آخر سؤال**\n\n"
-            f"📊 عدد الأسئلة الحالي: {len(quiz_builders[user_id].questions)}\n\n"
+            f"📊 عدد الأسئلة الحالي: {len(builder.questions)}\n\n"
             f"ماذا تريد أن تفعل؟",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("✅ إضافة سؤال", callback_data="quiz_add_another"),
@@ -342,19 +622,29 @@ async def quiz_confirmation_handler(update: Update, context: ContextTypes.DEFAUL
     
     elif action == "quiz_finish":
         # إنهاء الكويز وحفظه
-        quiz_data = quiz_builders[user_id].get_questions_dict()
+        quiz_data = builder.get_questions_dict()
         
         # الحصول على ID المعلم
-        teacher = add_teacher(user_id, query.from_user.username, query.from_user.first_name)
+        teacher = await add_teacher_async(user_id, query.from_user.username, query.from_user.first_name)
         
         # حفظ الكويز في قاعدة البيانات
-        quiz = create_quiz(
+        quiz = await create_quiz_async(
             teacher_id=teacher.id,
             title=quiz_data['title'],
             description=quiz_data['description'],
             questions=quiz_data['questions']
         )
         
+        if not quiz:
+            # المسودة محفوظة ويمكن المحاولة مرة أخرى
+            await query.edit_message_text(
+                "❌ تعذر حفظ الكويز. حاول مرة أخرى بعد قليل.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🏁 إعادة المحاولة", callback_data="quiz_finish")]
+                ])
+            )
+            return CONFIRM_QUESTION
+        
         # عرض ملخص الكويز
         summary = (
             f"🎉 **تم إنشاء الكويز بنجاح!**\n\n"
@@ -368,8 +658,8 @@ async def quiz_confirmation_handler(update: Update, context: ContextTypes.DEFAUL
             f"`/join {quiz.quiz_code}`"
         )
         
-        # تنظيف البيانات المؤقتة
-        del quiz_builders[user_id]
+        # تنظيف المسودة
+        await _discard_draft(user_id)
         
         await query.edit_message_text(summary, parse_mode='Markdown')
         return ConversationHandler.END
@@ -379,9 +669,9 @@ async def list_teacher_quizzes(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     
     user_id = query.from_user.id
-    teacher = add_teacher(user_id, query.from_user.username, query.from_user.first_name)
+    teacher = await add_teacher_async(user_id, query.from_user.username, query.from_user.first_name)
     
-    quizzes = get_teacher_quizzes(teacher.id)
+    quizzes = await get_teacher_quizzes_async(teacher.id)
     
     if not quizzes:
         await query.edit_message_text(
@@ -393,8 +683,12 @@ async def list_teacher_quizzes(update: Update, context: ContextTypes.DEFAULT_TYP
     
     text = "📋 **قائمة الكويزات الخاصة بك:**\n\n"
     
-    for quiz in quizzes[:10]:  # عرض آخر 10 كويزات
-        stats = get_quiz_statistics(quiz.id)
+    recent_quizzes = quizzes[:10]  # عرض آخر 10 كويزات
+    # جلب إحصائيات جميع الكويزات المعروضة في استعلام واحد
+    all_stats = await get_quizzes_statistics_async([quiz.id for quiz in recent_quizzes])
+    
+    for quiz in recent_quizzes:
+        stats = all_stats.get(quiz.id)
         stats_text = f"👥 {quiz.total_students} طالب"
         if stats:
             stats_text += f" | 📊 {stats['avg_percentage']}%"
@@ -403,21 +697,89 @@ async def list_teacher_quizzes(update: Update, context: ContextTypes.DEFAULT_TYP
         text += f"🔑 كود: `{quiz.quiz_code}`\n"
         text += f"📅 {quiz.created_at.strftime('%Y-%m-%d')}\n"
         text += f"📊 {stats_text}\n"
-        text += f"🔹 {quiz.total_questions or len(quiz.questions)} سؤال\n\n"
+        text += f"🔹 {len(quiz.questions or [])} سؤال\n\n"
     
-    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_panel")]]
+    keyboard = [
+        [InlineKeyboardButton(f"🔬 تحليل: {quiz.title}", callback_data=f"admin_analysis_{quiz.id}")]
+        for quiz in recent_quizzes
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_panel")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+async def show_item_analysis(update: Update, context: ContextTypes.DEFAULT_TYPE, quiz_id):
+    """عرض تحليل أسئلة الكويز: نسبة الصحة والتمييز وتوزيع الخيارات"""
+    query = update.callback_query
+    
+    user_id = query.from_user.id
+    teacher = await add_teacher_async(user_id, query.from_user.username, query.from_user.first_name)
+    
+    quiz = await get_quiz_by_id_async(quiz_id)
+    if not quiz or quiz.teacher_id != teacher.id:
+        await query.edit_message_text("❌ الكويز غير موجود")
+        return
+    
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_list_quizzes")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    analysis = await get_item_analysis(quiz)
+    if analysis is None:
+        await query.edit_message_text("❌ حدث خطأ أثناء تحليل الأسئلة", reply_markup=reply_markup)
+        return
+    if not analysis['attempts']:
+        await query.edit_message_text(
+            f"🔬 **{quiz.title}**\n\nلا توجد محاولات منتهية بعد",
+            reply_markup=reply_markup,
+            parse_mode='Markdown'
+        )
+        return
+    
+    text = (
+        f"🔬 **تحليل أسئلة: {quiz.title}**\n"
+        f"👥 {analysis['attempts']} محاولة منتهية\n\n"
+    )
+    
+    for item, q_data in zip(analysis['questions'][:ANALYSIS_MAX_QUESTIONS], quiz.questions):
+        discrimination = item['discrimination']
+        # سؤال صعب جداً أو سهل جداً أو لا يميز بين الطلاب
+        flagged = (
+            item['p_value'] < 0.2 or item['p_value'] > 0.9
+            or (discrimination is not None and discrimination < 0.2)
+        )
+        letters = 'tf' if q_data.get('question_type') == 'tf' else 'abcd'
+        distribution = " ".join(
+            f"{answer_display(letter)}:{count}"
+            for letter, count in zip(letters, item['options'])
+        )
+        if item['unanswered']:
+            distribution += f" —:{item['unanswered']}"
+        
+        text += (
+            f"{'⚠️' if flagged else '•'} س{item['question_num']}: "
+            f"✅ {item['p_value'] * 100:.0f}% | "
+            f"تمييز {'—' if discrimination is None else f'{discrimination:.2f}'}\n"
+            f"   {distribution}\n"
+        )
+    
+    if len(analysis['questions']) > ANALYSIS_MAX_QUESTIONS:
+        text += f"\n… و{len(analysis['questions']) - ANALYSIS_MAX_QUESTIONS} سؤال آخر\n"
+    
+    text += (
+        "\n✅ نسبة الإجابات الصحيحة | التمييز: ارتباط السؤال بدرجة باقي الأسئلة\n"
+        "⚠️ سؤال سهل/صعب جداً أو تمييزه أقل من 0.2"
+    )
+    
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
 async def show_teacher_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض إحصائيات المعلم"""
     query = update.callback_query
     
     user_id = query.from_user.id
-    teacher = add_teacher(user_id, query.from_user.username, query.from_user.first_name)
+    teacher = await add_teacher_async(user_id, query.from_user.username, query.from_user.first_name)
     
-    quizzes = get_teacher_quizzes(teacher.id)
+    quizzes = await get_teacher_quizzes_async(teacher.id)
     
     total_quizzes = len(quizzes)
     total_students = sum(q.total_students for q in quizzes)
@@ -432,8 +794,9 @@ async def show_teacher_stats(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     if quizzes:
         text += "**آخر 3 كويزات:**\n"
+        all_stats = await get_quizzes_statistics_async([quiz.id for quiz in quizzes[:3]])
         for quiz in quizzes[:3]:
-            stats = get_quiz_statistics(quiz.id)
+            stats = all_stats.get(quiz.id)
             if stats:
                 text += f"• {quiz.title}: {stats['total_attempts']} محاولة، متوسط {stats['avg_percentage']}%\n"
             else:
@@ -444,6 +807,176 @@ async def show_teacher_stats(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+async def export_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تصدير نتائج كويز كملف: /export الكود [csv|jsonl]"""
+    user_id = update.effective_user.id
+    
+    if not await is_teacher_async(user_id):
+        await update.message.reply_text("⛔ ليس لديك صلاحية لاستخدام هذا الأمر.")
+        return
+    
+    args = context.args or []
+    fmt = args[1].lower() if len(args) > 1 else 'csv'
+    if not args or fmt not in EXPORT_FORMATS:
+        await update.message.reply_text(
+            "📤 **تصدير النتائج**\n\n"
+            "الاستخدام: `/export [الكود] [csv|jsonl]`\n\n"
+            "مثال: `/export ABC123`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    teacher = await add_teacher_async(user_id, update.effective_user.username, update.effective_user.first_name)
+    quiz = await get_quiz_by_code_async(args[0])
+    
+    if not quiz or quiz.teacher_id != teacher.id:
+        await update.message.reply_text("❌ لم يتم العثور على كويز بهذا الكود ضمن كويزاتك.")
+        return
+    
+    await update.message.reply_text("⏳ جاري تجهيز ملف النتائج...")
+    
+    # التصدير يعمل خارج حلقة الأحداث وخارج مجمع خيوط قاعدة البيانات حتى لا يعطل البوت
+    loop = asyncio.get_running_loop()
+    try:
+        path, count = await loop.run_in_executor(None, export_quiz_results, quiz.id, fmt)
+    except Exception as e:
+        logger.error(f"❌ خطأ في تصدير النتائج: {e}")
+        await update.message.reply_text("❌ حدث خطأ أثناء تصدير النتائج.")
+        return
+    
+    try:
+        if os.path.getsize(path) > MAX_DOCUMENT_BYTES:
+            await update.message.reply_text("❌ ملف النتائج أكبر من الحد المسموح في Telegram.")
+            return
+        
+        extension = fmt + ('.gz' if path.endswith('.gz') else '')
+        with open(path, 'rb') as document:
+            await update.message.reply_document(
+                document=document,
+                filename=f"{quiz.quiz_code}_results.{extension}",
+                caption=f"📤 نتائج الكويز: {quiz.title}\n👥 عدد المحاولات: {count}"
+            )
+    finally:
+        os.remove(path)
+
+async def fix_answer_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """تصحيح مفتاح إجابة سؤال وإعادة تصحيح المحاولات: /fixkey الكود رقم_السؤال الإجابة"""
+    user_id = update.effective_user.id
+    
+    if not await is_teacher_async(user_id):
+        await update.message.reply_text("⛔ ليس لديك صلاحية لاستخدام هذا الأمر.")
+        return
+    
+    args = context.args or []
+    if len(args) != 3 or not args[1].isdigit():
+        await update.message.reply_text(
+            "🔧 **تصحيح مفتاح الإجابة**\n\n"
+            "الاستخدام: `/fixkey [الكود] [رقم السؤال] [الإجابة]`\n\n"
+            "مثال: `/fixkey ABC123 3 b` أو `/fixkey ABC123 5 t`",
+            parse_mode='Markdown'
+        )
+        return
+    
+    teacher = await add_teacher_async(user_id, update.effective_user.username, update.effective_user.first_name)
+    quiz = await get_quiz_by_code_async(args[0])
+    
+    if not quiz or quiz.teacher_id != teacher.id:
+        await update.message.reply_text("❌ لم يتم العثور على كويز بهذا الكود ضمن كويزاتك.")
+        return
+    
+    question_num = int(args[1])
+    new_answer = args[2].lower()
+    if not 1 <= question_num <= len(quiz.questions or []):
+        await update.message.reply_text(f"❌ رقم السؤال يجب أن يكون بين 1 و {len(quiz.questions or [])}.")
+        return
+    
+    errors = Question.from_dict({**quiz.questions[question_num - 1], 'correct_answer': new_answer}).validate()
+    if errors:
+        await update.message.reply_text(f"❌ {'، '.join(errors)}")
+        return
+    
+    await update.message.reply_text("⏳ جاري إعادة تصحيح جميع المحاولات...")
+    
+    result = await regrade_quiz_async(quiz.id, teacher.id, question_num, new_answer)
+    if result is None:
+        await update.message.reply_text("❌ حدث خطأ أثناء إعادة التصحيح.")
+        return
+    
+    await update.message.reply_text(
+        f"✅ **تم تصحيح مفتاح الإجابة**\n\n"
+        f"📌 السؤال {question_num}: الإجابة الصحيحة الآن `{new_answer.upper()}`\n"
+        f"👥 المحاولات المصححة: {result['attempts']}\n"
+        f"🔄 المحاولات التي تغيرت درجتها: {result['changed']}",
+        parse_mode='Markdown'
+    )
+
+async def import_quiz_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إنشاء كويز من ملف أسئلة مرفوع (CSV / JSON / JSONL)"""
+    user_id = update.effective_user.id
+    
+    if not await is_teacher_async(user_id):
+        return
+    
+    document = update.message.document
+    file_name = document.file_name or 'quiz.csv'
+    stem, _, fmt = file_name.rpartition('.')
+    fmt = fmt.lower()
+    if fmt not in IMPORT_FORMATS:
+        await update.message.reply_text("❌ الصيغ المدعومة: CSV أو JSON أو JSONL")
+        return
+    
+    # العنوان والوصف من تعليق الملف: السطر الأول عنوان والباقي وصف
+    caption_lines = (update.message.caption or '').strip().split('\n', 1)
+    title = caption_lines[0].strip() or stem or file_name
+    description = caption_lines[1].strip() if len(caption_lines) > 1 else ''
+    
+    await update.message.reply_text("⏳ جاري قراءة ملف الأسئلة...")
+    
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        
+        # التحليل خارج حلقة الأحداث
+        loop = asyncio.get_running_loop()
+        questions, errors = await loop.run_in_executor(None, parse_questions_file, path, fmt)
+    except Exception as e:
+        logger.error(f"❌ خطأ في استيراد ملف الأسئلة: {e}")
+        await update.message.reply_text("❌ تعذر قراءة الملف.")
+        return
+    finally:
+        os.remove(path)
+    
+    if errors:
+        text = f"❌ **لم يتم إنشاء الكويز - {len(errors)} خطأ:**\n\n"
+        text += "\n".join(f"• {error}" for error in errors[:MAX_REPORTED_ERRORS])
+        if len(errors) > MAX_REPORTED_ERRORS:
+            text += f"\n... و {len(errors) - MAX_REPORTED_ERRORS} خطأ آخر"
+        await update.message.reply_text(text)
+        return
+    
+    teacher = await add_teacher_async(user_id, update.effective_user.username, update.effective_user.first_name)
+    quiz = await create_quiz_async(
+        teacher_id=teacher.id,
+        title=title,
+        description=description,
+        questions=questions
+    )
+    
+    if not quiz:
+        await update.message.reply_text("❌ حدث خطأ أثناء حفظ الكويز. الرجاء المحاولة مرة أخرى.")
+        return
+    
+    await update.message.reply_text(
+        f"🎉 **تم إنشاء الكويز من الملف بنجاح!**\n\n"
+        f"📌 **عنوان الكويز:** {quiz.title}\n"
+        f"📊 **عدد الأسئلة:** {len(questions)}\n"
+        f"🔑 **كود الكويز:** `{quiz.quiz_code}`\n\n"
+        f"اطلب من الطلاب إرسال: `/join {quiz.quiz_code}`",
+        parse_mode='Markdown'
+    )
+
 async def show_admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض مساعدة المعلم"""
     query = update.callback_query
@@ -452,7 +985,10 @@ async def show_admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "👨‍🏫 **مساعدة المعلم**\n\n"
         "**الأوامر المتاحة:**\n"
         "/admin - فتح لوحة التحكم\n"
-        "/create - إنشاء كويز جديد\n\n"
+        "/create - إنشاء كويز جديد\n"
+        "/export [الكود] - تصدير نتائج كويز كملف\n"
+        "/fixkey [الكود] [رقم السؤال] [الإجابة] - تصحيح مفتاح الإجابة وإعادة تصحيح المحاولات\n"
+        "🔬 تحليل الأسئلة (الصعوبة والتمييز وتوزيع الخيارات) من 'قائمة الكويزات' في لوحة التحكم\n\n"
         
         "**كيفية إنشاء كويز:**\n"
         "1. اختر 'إنشاء كويز جديد'\n"
@@ -464,6 +1000,17 @@ async def show_admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "7. كرر حتى تنتهي من جميع الأسئلة\n"
         "8. اضغط 'إنهاء الكويز' للحفظ\n\n"
         
+        "**لصق عدة أسئلة دفعة واحدة:**\n"
+        "• عند طلب نص السؤال، الصق الأسئلة بهذه الصيغة:\n"
+        "`Q: ما عاصمة مصر؟`\n`A) الإسكندرية`\n`*B) القاهرة`\n"
+        "`TF: الماء يغلي عند 100 درجة = T`\n"
+        "• النجمة `*` تحدد الخيار الصحيح\n\n"
+        
+        "**استيراد كويز من ملف:**\n"
+        "• أرسل ملف CSV أو JSON أو JSONL، واكتب العنوان في تعليق الملف\n"
+        "• أعمدة CSV: `question,type,answer,option_a,option_b,option_c,option_d`\n"
+        "• type: `tf` أو `mcq`، و answer: `t`/`f` أو حرف الخيار\n\n"
+        
         "**مشاركة الكويز:**\n"
         "• كل كويز يحصل على كود فريد\n"
         "• أرسل الكود للطلاب\n"
@@ -480,14 +1027,24 @@ async def show_admin_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
 
+async def cancel_quiz_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إلغاء إنشاء الكويز وحذف المسودة (/cancel)"""
+    await _discard_draft(update.effective_user.id)
+    await update.message.reply_text("❌ تم إلغاء إنشاء الكويز وحذف المسودة.")
+    return ConversationHandler.END
+
 def get_admin_conv_handler():
     """الحصول على معالج محادثة إنشاء الكويز"""
     return ConversationHandler(
         entry_points=[
             CommandHandler("create", start_quiz_creation),
-            CallbackQueryHandler(start_quiz_creation, pattern="^admin_create_quiz$")
+            CallbackQueryHandler(start_quiz_creation, pattern="^admin_create_quiz$"),
+            # أزرار المسودة بعد إعادة التشغيل أو من عامل آخر؛ الرسائل النصية لا تُلتقط هنا
+            # (المتابعة تُعرض عبر /create و/start) حتى لا تمر كل رسالة بهذا المعالج
+            CallbackQueryHandler(resume_draft_button, pattern=DRAFT_BUTTONS_PATTERN)
         ],
         states={
+            RESUME_DRAFT: [CallbackQueryHandler(resume_draft_choice, pattern="^draft_(resume|discard)$")],
             QUIZ_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_quiz_title)],
             QUIZ_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_quiz_description)],
             QUESTION_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_question_text)],
@@ -497,7 +1054,7 @@ def get_admin_conv_handler():
             CONFIRM_QUESTION: [CallbackQueryHandler(quiz_confirmation_handler, pattern="^(quiz_add_another|quiz_delete_last|quiz_finish)$")]
         },
         fallbacks=[
-            CommandHandler("cancel", lambda u,c: ConversationHandler.END),
+            CommandHandler("cancel", cancel_quiz_creation),
             CallbackQueryHandler(lambda u,c: ConversationHandler.END, pattern="^admin_panel$")
         ]
     )
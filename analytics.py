@@ -0,0 +1,171 @@
+import os
+import logging
+import numpy as np
+from cache import TTLCache
+from database import SessionLocal, _run_in_executor
+from regrade import load_completed_attempts, load_answer_matrix, answer_key_codes
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ذاكرة تحليل الأسئلة: معرف الكويز -> ItemStats (تُحدث تدريجياً مع كل محاولة منتهية)
+ANALYTICS_CACHE_SIZE = int(os.getenv('ANALYTICS_CACHE_SIZE', '64'))
+ANALYTICS_CACHE_TTL = int(os.getenv('ANALYTICS_CACHE_TTL', '3600'))
+
+analytics_cache = TTLCache(maxsize=ANALYTICS_CACHE_SIZE, ttl=ANALYTICS_CACHE_TTL)
+
+# المحاولات المنتهية أثناء تحميل تحليل كويز: معرف الكويز -> [(معرف المحاولة، الإجابات)]
+_pending_attempts = {}
+metrics.register('item_analytics', analytics_cache.stats)
+
+# أعمدة توزيع الخيارات: a/صح، b/خطأ، c، d، بدون إجابة
+OPTION_COLUMNS = 5
+UNANSWERED = OPTION_COLUMNS - 1
+_option_column = np.full(256, UNANSWERED, dtype=np.int64)
+for _column, _letters in enumerate(('at', 'bf', 'c', 'd')):
+    for _letter in _letters:
+        _option_column[ord(_letter)] = _column
+
+class ItemStats:
+    """إحصائيات كافية لتحليل أسئلة كويز تُحدث بإضافة محاولة واحدة دون إعادة الحساب
+    
+    تُحفظ المجاميع فقط (عدد الطلاب، مجموع الدرجات ومربعاتها، عدد الإجابات الصحيحة
+    لكل سؤال ومجموع درجات من أجابوه صحيحاً، وتوزيع الخيارات) ومنها يُشتق التقرير
+    """
+    
+    __slots__ = (
+        'key', 'attempt_ids', 'extra_ids', 'count', 'score_sum', 'score_sq_sum',
+        'correct', 'correct_score_sum', 'option_counts'
+    )
+    
+    def __init__(self, key, attempt_ids, matrix):
+        self.key = key
+        self.attempt_ids = attempt_ids  # مرتبة، للتحقق من عدم احتساب المحاولة مرتين
+        self.extra_ids = set()
+        question_count = len(key)
+        self.count = 0
+        self.score_sum = 0
+        self.score_sq_sum = 0
+        self.correct = np.zeros(question_count, dtype=np.int64)
+        self.correct_score_sum = np.zeros(question_count, dtype=np.int64)
+        self.option_counts = np.zeros((question_count, OPTION_COLUMNS), dtype=np.int64)
+        self._add(matrix)
+    
+    def _add(self, matrix):
+        """إضافة صفوف من مصفوفة الطلاب×الأسئلة إلى المجاميع"""
+        correct = matrix == self.key
+        scores = correct.sum(axis=1, dtype=np.int64)
+        self.count += len(matrix)
+        self.score_sum += int(scores.sum())
+        self.score_sq_sum += int((scores * scores).sum())
+        self.correct += correct.sum(axis=0, dtype=np.int64)
+        self.correct_score_sum += scores @ correct
+        
+        question_count = len(self.key)
+        cells = np.arange(question_count) * OPTION_COLUMNS + _option_column[matrix]
+        self.option_counts += np.bincount(
+            cells.ravel(), minlength=question_count * OPTION_COLUMNS
+        ).reshape(question_count, OPTION_COLUMNS)
+    
+    def add_attempt(self, attempt_id, choices):
+        """إضافة محاولة منتهية (حروف الإجابات كـ bytes بترتيب الأسئلة)"""
+        if len(choices) != len(self.key) or attempt_id in self.extra_ids:
+            return False
+        position = np.searchsorted(self.attempt_ids, attempt_id)
+        if position < len(self.attempt_ids) and self.attempt_ids[position] == attempt_id:
+            return False
+        self.extra_ids.add(attempt_id)
+        self._add(np.frombuffer(bytes(choices), dtype=np.uint8).reshape(1, -1))
+        return True
+    
+    def report(self):
+        """نسبة الصحة ومعامل التمييز وتوزيع الخيارات لكل سؤال
+        
+        التمييز هو معامل الارتباط النقطي الثنائي بين صحة السؤال ودرجة الطالب في
+        باقي الأسئلة (بدون السؤال نفسه)، ويكون None عندما لا يمكن حسابه
+        """
+        n = self.count
+        if n == 0:
+            return []
+        c = self.correct.astype(np.float64)
+        p = c / n
+        
+        # درجة الباقي R = الدرجة الكلية - درجة السؤال
+        rest_mean = (self.score_sum - c) / n
+        rest_sq_mean = (self.score_sq_sum - 2 * self.correct_score_sum + c) / n
+        rest_var = rest_sq_mean - rest_mean ** 2
+        covariance = (self.correct_score_sum - c) / n - p * rest_mean
+        denominator = np.sqrt(np.clip(p * (1 - p) * rest_var, 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discrimination = np.where(denominator > 1e-12, covariance / denominator, np.nan)
+        
+        return [
+            {
+                'question_num': q_index + 1,
+                'p_value': float(p[q_index]),
+                'discrimination': None if np.isnan(discrimination[q_index]) else float(discrimination[q_index]),
+                'options': self.option_counts[q_index, :UNANSWERED].tolist(),
+                'unanswered': int(self.option_counts[q_index, UNANSWERED])
+            }
+            for q_index in range(len(self.key))
+        ]
+
+def compute_item_stats(quiz_id, questions):
+    """حساب إحصائيات الأسئلة من جميع المحاولات المنتهية
+    
+    القراءة من القاعدة الأساسية لا نسخة القراءة: المحاولة التي انتهت قبل بدء
+    التحميل ولم تصل بعد إلى النسخة لن تُضاف لاحقاً
+    """
+    db = SessionLocal()
+    try:
+        attempt_ids, _, _, _ = load_completed_attempts(db, quiz_id)
+        matrix = load_answer_matrix(db, quiz_id, attempt_ids, len(questions))
+        return ItemStats(answer_key_codes(questions), attempt_ids, matrix)
+    except Exception as e:
+        logger.error(f"❌ خطأ في حساب تحليل الأسئلة: {e}")
+        return None
+    finally:
+        db.close()
+
+compute_item_stats_async = _run_in_executor(compute_item_stats)
+
+def _current_stats(quiz):
+    """الإحصائيات المخزنة إن كانت محسوبة بنفس مفتاح الإجابات الحالي"""
+    stats = analytics_cache.get(quiz.id)
+    if stats is not None and np.array_equal(stats.key, answer_key_codes(quiz.questions or [])):
+        return stats
+    return None
+
+async def get_item_analysis(quiz):
+    """تقرير تحليل أسئلة الكويز (يُحسب مرة واحدة ثم يُحدث تدريجياً)
+    
+    عند تغيير مفتاح الإجابات (/fixkey) يُعاد الحساب من قاعدة البيانات تلقائياً
+    """
+    stats = _current_stats(quiz)
+    if stats is None:
+        async def load():
+            # المحاولات التي تنتهي أثناء القراءة تُجمع وتُضاف بعدها (add_attempt يتجاهل المكرر)
+            pending = _pending_attempts.setdefault(quiz.id, [])
+            try:
+                loaded = await compute_item_stats_async(quiz.id, list(quiz.questions or []))
+            finally:
+                _pending_attempts.pop(quiz.id, None)
+            if loaded is not None:
+                for attempt_id, choices in pending:
+                    loaded.add_attempt(attempt_id, choices)
+                analytics_cache.set(quiz.id, loaded)
+            return loaded
+        
+        analytics_cache.pop(quiz.id)
+        stats = await analytics_cache.get_or_load(quiz.id, load)
+        if stats is None:
+            return None
+    return {'attempts': stats.count, 'questions': stats.report()}
+
+def record_completed_attempt(quiz, attempt_id, choices):
+    """تحديث تحليل الكويز المخزن بمحاولة انتهت للتو (لا شيء إن لم يكن محسوباً)"""
+    stats = _current_stats(quiz)
+    if stats is not None:
+        stats.add_attempt(attempt_id, choices)
+    elif quiz.id in _pending_attempts:
+        _pending_attempts[quiz.id].append((attempt_id, bytes(choices)))
@@ -0,0 +1,117 @@
+import os
+import asyncio
+import logging
+import time
+from datetime import datetime
+from database import save_answers_bulk_async
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# الإفراغ كل N مللي ثانية أو عند تجمع N إجابة
+ANSWER_FLUSH_INTERVAL_MS = int(os.getenv('ANSWER_FLUSH_INTERVAL_MS', '200'))
+ANSWER_FLUSH_MAX_ROWS = int(os.getenv('ANSWER_FLUSH_MAX_ROWS', '500'))
+
+class AnswerBuffer:
+    """طابور كتابة مؤجلة لإجابات الطلاب يُفرغ في قاعدة البيانات على دفعات"""
+    
+    def __init__(self, flush_interval_ms=ANSWER_FLUSH_INTERVAL_MS, max_rows=ANSWER_FLUSH_MAX_ROWS):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self._rows = []
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task = None
+        
+        # المؤشرات
+        self.flush_count = 0
+        self.rows_flushed = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+    
+    def add(self, attempt_id, question_num, answer, is_correct):
+        """إضافة إجابة إلى الطابور (لا تنتظر قاعدة البيانات)"""
+        self._rows.append({
+            'attempt_id': attempt_id,
+            'question_num': question_num,
+            'answer': answer,
+            'is_correct': is_correct,
+            'answered_at': datetime.now()
+        })
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if len(self._rows) >= self.max_rows:
+            self._full.set()
+    
+    async def _run(self):
+        """حلقة الإفراغ الدوري"""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ خطأ في إفراغ طابور الإجابات: {e}")
+    
+    async def flush(self):
+        """إفراغ جميع الإجابات المعلقة في إدراج واحد"""
+        async with self._lock:
+            if not self._rows:
+                return
+            rows, self._rows = self._rows, []
+            
+            start = time.perf_counter()
+            saved = await save_answers_bulk_async(rows)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            
+            if not saved:
+                self.failed_flushes += 1
+                # إعادة الإجابات للطابور لمحاولة لاحقة مع حد أقصى لحجمه
+                self._rows[:0] = rows
+                overflow = len(self._rows) - self.max_rows * 10
+                if overflow > 0:
+                    del self._rows[:overflow]
+                    self.dropped_rows += overflow
+                    logger.error(f"❌ تم إسقاط {overflow} إجابة بسبب امتلاء الطابور")
+                return
+            
+            self.flush_count += 1
+            self.rows_flushed += len(rows)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+    
+    async def close(self):
+        """إيقاف الإفراغ الدوري مع إفراغ نهائي مضمون"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._rows:
+            logger.error(f"❌ تعذر حفظ {len(self._rows)} إجابة عند الإيقاف")
+    
+    def stats(self):
+        """مؤشرات الطابور"""
+        return {
+            'queue_depth': len(self._rows),
+            'flushes': self.flush_count,
+            'rows_flushed': self.rows_flushed,
+            'failed_flushes': self.failed_flushes,
+            'dropped_rows': self.dropped_rows,
+            'last_flush_ms': self.last_flush_ms,
+            'max_flush_ms': self.max_flush_ms,
+            'avg_flush_ms': self.total_flush_ms / self.flush_count if self.flush_count else 0.0
+        }
+
+answer_buffer = AnswerBuffer()
+metrics.register('answer_buffer', answer_buffer.stats)
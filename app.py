@@ -23,13 +23,22 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # استيراد الملفات المحلية
-from database import add_teacher, is_teacher, get_db
-from admin import admin_panel, admin_callback_handler, get_admin_conv_handler
-from student import get_student_conv_handler, student_history
+from database import add_teacher, is_teacher_async, get_db, shutdown_db_executor, migrate, DB_MIGRATE_ON_START
+from admin import (
+    admin_panel, admin_callback_handler, get_admin_conv_handler, export_results, import_quiz_file,
+    fix_answer_key,
+    sweep_quiz_drafts_job, QUIZ_DRAFT_SWEEP_INTERVAL
+)
+from student import get_student_conv_handler, get_student_answer_handler, student_history
+from answer_buffer import answer_buffer
+from sessions import sweep_sessions_job, SESSION_SWEEP_INTERVAL
+from metrics import format_metrics
 
 # متغيرات
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 PORT = int(os.environ.get('PORT', 10000))
+# معرفات المشغلين المسموح لهم برؤية المؤشرات (مفصولة بفواصل)
+OPERATOR_IDS = {int(i) for i in os.getenv('OPERATOR_IDS', '').split(',') if i.strip()}
 
 async def start(update: Update, context):
     """معالج أمر /start"""
@@ -37,7 +46,7 @@ async def start(update: Update, context):
     username = update.effective_user.username or update.effective_user.first_name
     
     # التحقق مما إذا كان المستخدم معلم
-    if is_teacher(user_id):
+    if await is_teacher_async(user_id):
         # فتح لوحة تحكم المعلم
         await admin_panel(update, context)
     else:
@@ -61,24 +70,6 @@ async def admin_command(update: Update, context):
 
 async def history_command(update: Update, context):
     """معالج أمر /history"""
-    # إنشاء callback query وهمي لاستخدام الدالة
-    class MockQuery:
-        def __init__(self, user_id, chat_id):
-            self.from_user = type('User', (), {'id': user_id})()
-            self.message = type('Message', (), {'chat_id': chat_id})()
-        
-        async def answer(self):
-            pass
-        
-        async def edit_message_text(self, text, reply_markup=None, parse_mode=None):
-            return await context.bot.send_message(
-                chat_id=self.message.chat_id,
-                text=text,
-                reply_markup=reply_markup,
-                parse_mode=parse_mode
-            )
-    
-    mock_query = MockQuery(update.effective_user.id, update.effective_chat.id)
     await student_history(update, context)
 
 async def help_command(update: Update, context):
@@ -91,12 +82,20 @@ async def help_command(update: Update, context):
         "/start - الصفحة الرئيسية\n\n"
         "**👨‍🏫 أوامر المعلمين:**\n"
         "/admin - فتح لوحة التحكم\n"
-        "/create - إنشاء كويز جديد\n\n"
+        "/create - إنشاء كويز جديد\n"
+        "/export [الكود] - تصدير نتائج كويز\n"
+        "/fixkey [الكود] [رقم السؤال] [الإجابة] - تصحيح مفتاح الإجابة\n\n"
         "**❓ للمساعدة الإضافية:**\n"
         "تواصل مع الدعم الفني @AdminBot"
     )
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+async def metrics_command(update: Update, context):
+    """معالج أمر /metrics لعرض مؤشرات التشغيل"""
+    if update.effective_user.id not in OPERATOR_IDS:
+        return
+    await update.message.reply_text(f"📈 المؤشرات:\n\n{format_metrics()}")
+
 async def cancel(update: Update, context):
     """إلغاء المحادثة الحالية"""
     await update.message.reply_text(
@@ -105,6 +104,11 @@ async def cancel(update: Update, context):
     )
     return ConversationHandler.END
 
+async def on_shutdown(application):
+    """تنظيف الموارد عند إيقاف البوت"""
+    await answer_buffer.close()
+    shutdown_db_executor()
+
 def main():
     """الدالة الرئيسية لتشغيل البوت"""
     logger.info("🚀 بدء تشغيل بوت الكويزات...")
@@ -114,25 +118,56 @@ def main():
         logger.error("❌ TOKEN غير موجود!")
         return
     
+    # ترحيل المخطط (في PostgreSQL يُشغل كأمر ما قبل النشر: python database.py migrate)
+    if DB_MIGRATE_ON_START:
+        migrate()
+    
     # إنشاء التطبيق
-    application = Application.builder().token(TOKEN).build()
+    application = Application.builder().token(TOKEN).post_shutdown(on_shutdown).build()
+    
+    # إضافة معالج المحادثة للطالب وأزرار الإجابة (تعمل بعد إعادة التشغيل ومن أي عامل)
+    application.add_handler(get_student_conv_handler())
+    application.add_handler(get_student_answer_handler())
     
     # إضافة معالج المحادثة للمعلم
     application.add_handler(get_admin_conv_handler())
     
-    # إضافة معالج المحادثة للطالب
-    application.add_handler(get_student_conv_handler())
-    
     # إضافة الأوامر الرئيسية
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_command))
     application.add_handler(CommandHandler("history", history_command))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("export", export_results))
+    application.add_handler(CommandHandler("fixkey", fix_answer_key))
+    
+    # استيراد كويز من ملف أسئلة
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("csv")
+        | filters.Document.FileExtension("json")
+        | filters.Document.FileExtension("jsonl"),
+        import_quiz_file
+    ))
     application.add_handler(CommandHandler("cancel", cancel))
     
     # إضافة معالج callback للمعلم
     application.add_handler(CallbackQueryHandler(admin_callback_handler, pattern="^admin_"))
     
+    # إضافة معالج سجل محاولات الطالب
+    application.add_handler(CallbackQueryHandler(student_history, pattern="^student_history"))
+    
+    # حذف جلسات الطلاب الخاملة دورياً
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            sweep_sessions_job, interval=SESSION_SWEEP_INTERVAL, first=SESSION_SWEEP_INTERVAL
+        )
+        # حذف مسودات الكويزات المهجورة
+        application.job_queue.run_repeating(
+            sweep_quiz_drafts_job, interval=QUIZ_DRAFT_SWEEP_INTERVAL, first=QUIZ_DRAFT_SWEEP_INTERVAL
+        )
+    else:
+        logger.warning("⚠️ JobQueue غير متاح، لن يتم حذف الجلسات والمسودات الخاملة دورياً")
+    
     # التحقق مما إذا كان على Render
     is_render = os.getenv('RENDER', '').lower() in ['true', '1', 'yes']
     
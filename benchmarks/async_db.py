@@ -0,0 +1,56 @@
+"""قياس طبقة قاعدة البيانات غير المتزامنة: تحديثات/ثانية لطلاب متزامنين
+
+يُحاكى زمن رحلة قاعدة بيانات بعيدة بتأخير ثابت لكل استعلام، ويُقارن استدعاء
+الدوال المتزامنة داخل حلقة الأحداث (السلوك القديم) بنسخها *_async
+    
+    python benchmarks/async_db.py [--students 200] [--updates 5] [--latency-ms 5]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+# قاعدة بيانات مؤقتة (يجب ضبطها قبل استيراد database)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='quiz_bot_bench_'), 'bench.db')}"
+os.environ.pop('READ_DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+import database
+
+def inject_latency(latency_ms):
+    """تأخير كل استعلام بزمن رحلة ثابت"""
+    @event.listens_for(database.engine, 'before_cursor_execute')
+    def _sleep(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(latency_ms / 1000)
+
+async def run(students, updates, lookup):
+    """تشغيل الطلاب معاً وإرجاع عدد التحديثات في الثانية"""
+    async def student(student_id):
+        for _ in range(updates):
+            await lookup(student_id)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(student(100000 + i) for i in range(students)))
+    return students * updates / (time.perf_counter() - start)
+
+async def blocking_lookup(student_id):
+    database.get_student_attempts(student_id)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    args = parser.parse_args()
+    
+    inject_latency(args.latency_ms)
+    blocking = asyncio.run(run(args.students, args.updates, blocking_lookup))
+    executor = asyncio.run(run(args.students, args.updates, database.get_student_attempts_async))
+    print(f"blocking: {blocking:.0f} updates/s")
+    print(f"executor: {executor:.0f} updates/s (DB_MAX_WORKERS={database.DB_MAX_WORKERS})")
+
+if __name__ == '__main__':
+    main()
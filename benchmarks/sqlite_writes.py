@@ -0,0 +1,79 @@
+"""قياس وضع SQLite عالي الإنتاجية: إجابات/ثانية مقارنة بالإعدادات الافتراضية
+
+كل طالب يحفظ إجاباته دون تجميع (save_answer_async) مع قراءة إحصائيات بين كل
+إجابة وأخرى. الوضع القديم: اتصال جديد لكل جلسة بإعدادات SQLite الافتراضية
+والكتابة من أي خيط؛ الوضع الحالي: WAL وخيط كتابة واحد
+    
+    python benchmarks/sqlite_writes.py [--students 300] [--answers 10]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+_db_dir = tempfile.mkdtemp(prefix='quiz_bot_bench_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'tuned.db')}"
+os.environ.pop('READ_DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+import database
+
+QUESTIONS = [
+    {'question_num': 1, 'question_text': 'q', 'question_type': 'tf', 'correct_answer': 't', 'options': []}
+]
+
+def use_default_sqlite():
+    """إعادة توجيه الجلسات إلى محرك SQLite بالإعدادات الافتراضية (السلوك القديم)"""
+    default_engine = create_engine(
+        f"sqlite:///{os.path.join(_db_dir, 'default.db')}",
+        connect_args={'check_same_thread': False}
+    )
+    database.Base.metadata.create_all(bind=default_engine)
+    database.SessionLocal.configure(bind=default_engine)
+    database.ReadSessionLocal.configure(bind=default_engine)
+
+async def run(students, answers, save_answer, get_statistics):
+    """تشغيل الطلاب معاً وإرجاع (إجابات/ثانية، عدد الإجابات الفاشلة)"""
+    teacher = database.add_teacher(1, 'bench', 'Bench Teacher')
+    quiz = database.create_quiz(teacher.id, 'bench', '', QUESTIONS)
+    attempt_ids = [database.start_student_attempt(quiz.id, 100000 + i, 's') for i in range(students)]
+    
+    async def student(attempt_id):
+        failed = 0
+        for question_num in range(1, answers + 1):
+            if not await save_answer(attempt_id, question_num, 't', True):
+                failed += 1
+            await get_statistics(quiz.id)
+        return failed
+    
+    start = time.perf_counter()
+    failed = await asyncio.gather(*(student(attempt_id) for attempt_id in attempt_ids))
+    return students * answers / (time.perf_counter() - start), sum(failed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=300)
+    parser.add_argument('--answers', type=int, default=10)
+    args = parser.parse_args()
+    
+    tuned = asyncio.run(run(
+        args.students, args.answers, database.save_answer_async, database.get_quiz_statistics_async
+    ))
+    
+    # السلوك القديم: الكتابة عبر مجمع الخيوط العام وليس خيط الكتابة
+    use_default_sqlite()
+    database.quiz_cache.clear()
+    database.teacher_cache.clear()
+    default = asyncio.run(run(
+        args.students, args.answers,
+        database._run_in_executor(database.save_answer), database.get_quiz_statistics_async
+    ))
+    
+    print(f"default: {default[0]:.0f} answers/s ({default[1]} failed)")
+    print(f"tuned:   {tuned[0]:.0f} answers/s ({tuned[1]} failed)")
+
+if __name__ == '__main__':
+    main()
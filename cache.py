@@ -0,0 +1,132 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """ذاكرة تخزين مؤقت محدودة الحجم مع انتهاء صلاحية (LRU + TTL)"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # المفتاح -> (وقت الانتهاء، القيمة)
+        # القفل ضروري لأن الذاكرة تُستخدم من حلقة الأحداث ومن خيوط قاعدة البيانات
+        self._lock = threading.Lock()
+        self._inflight = {}
+        # المفاتيح قيد التحميل من المصدر: المفتاح -> [عداد الإبطال، عدد التحميلات الجارية]
+        self._loads = {}
+        
+        # المؤشرات
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_loads = 0
+    
+    def get(self, key, default=None):
+        """قراءة قيمة (مع تحديث ترتيب الاستخدام)"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def _set(self, key, value, ttl):
+        """تخزين قيمة (يُستدعى مع القفل)"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def set(self, key, value, ttl=None):
+        """تخزين قيمة (بمدة صلاحية خاصة اختيارياً) مع إخراج الأقدم استخداماً عند امتلاء الذاكرة"""
+        with self._lock:
+            self._set(key, value, ttl)
+    
+    def pop(self, key):
+        """حذف قيمة (الإبطال الصريح)؛ التحميلات الجارية لنفس المفتاح لن تُخزن نتيجتها"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            load = self._loads.get(key)
+            if load is not None:
+                load[0] += 1
+        return entry[1] if entry else None
+    
+    def begin_load(self, key):
+        """تسجيل بداية تحميل المفتاح من المصدر وإرجاع رقم الإبطال الحالي له"""
+        with self._lock:
+            load = self._loads.setdefault(key, [0, 0])
+            load[1] += 1
+            return load[0]
+    
+    def finish_load(self, key, generation, value=_MISSING, ttl=None):
+        """إنهاء التحميل وتخزين القيمة إلا إذا أُبطل المفتاح أثناءه
+        
+        قراءة بدأت قبل التعديل قد تنتهي بعد إبطاله، فتُهمل نتيجتها بدلاً من إعادة
+        القيمة القديمة إلى الذاكرة. يُرجع True إذا خُزنت القيمة
+        """
+        with self._lock:
+            load = self._loads[key]
+            load[1] -= 1
+            if not load[1]:
+                del self._loads[key]
+            if value is _MISSING:
+                return False
+            if load[0] != generation:
+                self.stale_loads += 1
+                return False
+            self._set(key, value, ttl)
+            return True
+    
+    def clear(self):
+        """حذف جميع القيم"""
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    async def get_or_load(self, key, loader):
+        """قراءة القيمة أو تحميلها مرة واحدة فقط مهما تعدد الطالبون المتزامنون
+        
+        دالة التحميل مسؤولة عن تخزين النتيجة في الذاكرة
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+    
+    def stats(self):
+        """مؤشرات الذاكرة المؤقتة"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'stale_loads': self.stale_loads
+        }
@@ -1,10 +1,25 @@
 import os
+import math
+import asyncio
+import functools
 import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, Index, null, func, and_, or_, case, text, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, aliased
 from sqlalchemy import JSON  # استيراد منفصل
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateIndex, CreateColumn
+from sqlalchemy.dialects import postgresql, sqlite
+from cache import TTLCache
+from quiz_codes import quiz_code_allocator
+import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,20 +35,167 @@ if not DATABASE_URL:
     DATABASE_URL = 'sqlite:///quiz_bot.db'
     logger.warning("⚠️ لم يتم العثور على DATABASE_URL، استخدام SQLite محلياً")
 
+# ============= مجمع الاتصالات =============
+
+class PoolMetrics:
+    """مؤشرات مجمع الاتصالات: الانتظار، التجاوز، انتهاء المهلة"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pool = None
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+    
+    def record_checkout(self, wait_seconds, overflow):
+        with self._lock:
+            wait_ms = wait_seconds * 1000
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if overflow:
+                self.overflow_checkouts += 1
+    
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+    
+    def stats(self):
+        """مؤشرات المجمع الحالية"""
+        values = {
+            'checkouts': self.checkouts,
+            'overflow_checkouts': self.overflow_checkouts,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': self.total_wait_ms / self.checkouts if self.checkouts else 0.0,
+            'max_wait_ms': self.max_wait_ms
+        }
+        if self.pool is not None:
+            values['checked_out'] = self.pool.checkedout()
+            values['pool_size'] = self.pool.size()
+            values['overflow'] = max(self.pool.overflow(), 0)
+        return values
+
+class InstrumentedQueuePool(QueuePool):
+    """مجمع اتصالات يقيس زمن انتظار الحصول على اتصال"""
+    
+    pool_metrics = None
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # لكل خيط: هل أنشأ طلب الاتصال الحالي اتصالاً يتجاوز pool_size؟
+        self._checkout_state = threading.local()
+        # قراءة _overflow بعد الزيادة مباشرة دون أن يغيره خيط آخر
+        self._overflow_metrics_lock = threading.Lock()
+    
+    def _inc_overflow(self):
+        with self._overflow_metrics_lock:
+            incremented = super()._inc_overflow()
+            if incremented:
+                # _overflow يبدأ من -pool_size، فالقيمة الموجبة تعني اتصالاً زائداً عن حجم المجمع
+                self._checkout_state.overflow = self._overflow > 0
+            return incremented
+    
+    def _dec_overflow(self):
+        with self._overflow_metrics_lock:
+            return super()._dec_overflow()
+    
+    def _do_get(self):
+        # المجمع قد يُعاد إنشاؤه بعد انقطاع الاتصال، فنربط المؤشرات بالمجمع الحالي دائماً
+        self.pool_metrics.pool = self
+        self._checkout_state.overflow = False
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.pool_metrics.record_timeout()
+            raise
+        self.pool_metrics.record_checkout(time.perf_counter() - start, self._checkout_state.overflow)
+        return connection
+
+def _instrumented_pool_class(metrics_name):
+    """صنف مجمع اتصالات بمؤشرات مستقلة تُنشر باسم metrics_name"""
+    pool_metrics = PoolMetrics()
+    metrics.register(metrics_name, pool_metrics.stats)
+    return type('InstrumentedQueuePool', (InstrumentedQueuePool,), {'pool_metrics': pool_metrics})
+
+# إعدادات SQLite للتشغيل المحلي أو على خادم واحد
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_CACHE_KB = int(os.getenv('SQLITE_CACHE_KB', '65536'))
+
+def _engine_options(url, metrics_name='db_pool'):
+    """إعدادات مجمع الاتصالات من متغيرات البيئة"""
+    options = {
+        'poolclass': _instrumented_pool_class(metrics_name),
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    }
+    if url.startswith('sqlite'):
+        # الاتصالات تُستخدم من خيوط مختلفة؛ والكتابة تمر عبر خيط واحد
+        options['connect_args'] = {
+            'check_same_thread': False,
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000
+        }
+        return options
+    options['pool_pre_ping'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ['true', '1', 'yes']
+    options['pool_recycle'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+    if url.startswith(('postgresql://', 'postgresql+psycopg2://')):
+        # تجميع UPDATE متعدد المعاملات في دفعات بدلاً من رحلة لكل صف
+        options['executemany_mode'] = 'values_plus_batch'
+    return options
+
+def _configure_sqlite(sqlite_engine):
+    """تفعيل وضع WAL وضبط إعدادات SQLite لكل اتصال جديد"""
+    @event.listens_for(sqlite_engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL: القراءة لا تحجب الكتابة والعكس
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # NORMAL آمن مع WAL ويتجنب fsync عند كل تأكيد
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
+
 # إنشاء الاتصال
 try:
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+    # expire_on_commit=False: الكائنات المُرجعة تُستخدم بعد إغلاق الجلسة وفي خيوط أخرى
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
     Base = declarative_base()
     logger.info(f"✅ تم الاتصال بقاعدة البيانات: {DATABASE_URL.split('@')[0] if '@' in DATABASE_URL else 'محلي'}")
 except Exception as e:
     logger.error(f"❌ فشل الاتصال بقاعدة البيانات: {e}")
     # استخدام SQLite كنسخة احتياطية
-    engine = create_engine('sqlite:///quiz_bot_backup.db')
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine = create_engine('sqlite:///quiz_bot_backup.db', **_engine_options('sqlite:///quiz_bot_backup.db'))
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
     Base = declarative_base()
     logger.warning("⚠️ استخدام SQLite كنسخة احتياطية")
 
+IS_SQLITE = engine.dialect.name == 'sqlite'
+# إدراج يتجاهل الصف الموجود (ON CONFLICT DO NOTHING) حسب المحرك
+_INSERT_IGNORE = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+if IS_SQLITE:
+    _configure_sqlite(engine)
+
+# نسخة القراءة (اختيارية): استعلامات لوحات التحكم والسجل تُوجَّه إليها
+READ_DATABASE_URL = os.getenv('READ_DATABASE_URL', '')
+if READ_DATABASE_URL.startswith('postgres://'):
+    READ_DATABASE_URL = READ_DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+
+if READ_DATABASE_URL:
+    read_engine = create_engine(READ_DATABASE_URL, **_engine_options(READ_DATABASE_URL, 'db_read_pool'))
+    if read_engine.dialect.name == 'sqlite':
+        _configure_sqlite(read_engine)
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=read_engine)
+    logger.info("✅ تم تفعيل نسخة القراءة لقاعدة البيانات")
+else:
+    read_engine = engine
+    ReadSessionLocal = SessionLocal
+
 # ============= نماذج قاعدة البيانات =============
 
 class Teacher(Base):
@@ -50,6 +212,10 @@ class Teacher(Base):
 class Quiz(Base):
     """جدول الكويزات"""
     __tablename__ = 'quizzes'
+    __table_args__ = (
+        # get_teacher_quizzes: teacher_id + is_active مرتبة حسب created_at
+        Index('ix_quizzes_teacher_active_created', 'teacher_id', 'is_active', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     teacher_id = Column(Integer, nullable=False)
@@ -60,28 +226,233 @@ class Quiz(Base):
     created_at = Column(DateTime, default=datetime.now)
     is_active = Column(Boolean, default=True)
     total_students = Column(Integer, default=0)
+    key_version = Column(Integer, default=0, server_default='0', nullable=False)  # يزيد مع كل تغيير لمفتاح الإجابات
 
 class StudentAttempt(Base):
     """جدول محاولات الطلاب"""
     __tablename__ = 'student_attempts'
+    __table_args__ = (
+        # get_student_attempts: student_telegram_id + is_completed مرتبة حسب completed_at
+        Index('ix_attempts_student_completed', 'student_telegram_id', 'is_completed', 'completed_at'),
+        # get_quiz_statistics: quiz_id + is_completed، مع score و percentage للقراءة من الفهرس فقط
+        Index('ix_attempts_quiz_completed', 'quiz_id', 'is_completed', 'score', 'percentage'),
+        # iter_quiz_results: ترقيم محاولات الكويز بالمفتاح حسب id
+        Index('ix_attempts_quiz_id', 'quiz_id', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     quiz_id = Column(Integer, nullable=False)
     student_telegram_id = Column(Integer, nullable=False)
     student_name = Column(String(200))
-    answers = Column(JSON)  # تخزين الإجابات كـ JSON
+    # الإجابات القديمة بصيغة JSON - تُنقل إلى جدول attempt_answers عند بدء التشغيل
+    legacy_answers = Column('answers', JSON(none_as_null=True))
     score = Column(Integer, default=0)
     total_questions = Column(Integer, default=0)
     percentage = Column(Integer, default=0)  # تخزين كنسبة مئوية * 100
     started_at = Column(DateTime, default=datetime.now)
     completed_at = Column(DateTime)
     is_completed = Column(Boolean, default=False)
+    # الإجابات تُقرأ عبر get_attempt_answers (الكائنات المُرجعة منفصلة عن الجلسة)
+
+class QuizStats(Base):
+    """جدول ملخص إحصائيات الكويز (يُحدّث مع كل محاولة منتهية)"""
+    __tablename__ = 'quiz_stats'
+    
+    quiz_id = Column(Integer, primary_key=True)
+    total_attempts = Column(Integer, default=0, nullable=False)
+    score_sum = Column(Integer, default=0, nullable=False)
+    score_sq_sum = Column(Integer, default=0, nullable=False)
+    percentage_sum = Column(Integer, default=0, nullable=False)
+    min_score = Column(Integer)
+    max_score = Column(Integer)
+    score_histogram = Column(JSON)  # {الدرجة: عدد المحاولات}
+    updated_at = Column(DateTime, default=datetime.now)
+
+class AttemptAnswer(Base):
+    """جدول إجابات الطلاب (إضافة فقط - صف لكل إجابة)"""
+    __tablename__ = 'attempt_answers'
+    
+    id = Column(Integer, primary_key=True)
+    attempt_id = Column(Integer, ForeignKey('student_attempts.id'), nullable=False, index=True)
+    question_num = Column(Integer, nullable=False)
+    answer = Column(String(20))
+    is_correct = Column(Boolean, default=False)
+    answered_at = Column(DateTime, default=datetime.now)
+
+class StudentSession(Base):
+    """جدول جلسات الطلاب الجارية (مشترك بين جميع العمال ويبقى بعد إعادة التشغيل)"""
+    __tablename__ = 'student_sessions'
+    
+    student_telegram_id = Column(Integer, primary_key=True)
+    data = Column(JSON, nullable=False)
+    version = Column(Integer, default=1, nullable=False)  # للكتابة بالمقارنة والتبديل
+    updated_at = Column(DateTime, default=datetime.now, index=True)
+
+class QuizDraft(Base):
+    """جدول مسودات الكويزات قيد الإنشاء (واحدة لكل معلم)"""
+    __tablename__ = 'quiz_drafts'
+    
+    teacher_telegram_id = Column(Integer, primary_key=True)
+    title = Column(String(200))
+    description = Column(Text)
+    pending = Column(JSON)  # السؤال الجاري إدخاله
+    version = Column(Integer, default=1, server_default='1', nullable=False)  # للكتابة بالمقارنة والتبديل
+    updated_at = Column(DateTime, default=datetime.now, index=True)
+
+class QuizDraftQuestion(Base):
+    """جدول أسئلة المسودات (صف لكل سؤال لحفظ السؤال المتغير فقط)"""
+    __tablename__ = 'quiz_draft_questions'
+    __table_args__ = (
+        Index('ix_draft_questions_teacher_num', 'teacher_telegram_id', 'question_num', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    teacher_telegram_id = Column(Integer, ForeignKey('quiz_drafts.teacher_telegram_id'), nullable=False)
+    question_num = Column(Integer, nullable=False)
+    data = Column(JSON, nullable=False)
 
 # إنشاء الجداول
 Base.metadata.create_all(bind=engine)
 
+def migrate_legacy_answers(batch_size=500):
+    """نقل الإجابات المخزنة كـ JSON إلى جدول attempt_answers (آمنة للتكرار ولعدة عمال معاً)
+    
+    كل دفعة تُحجز بتفريغ عمود answers قبل إدراج صفوفها في نفس المعاملة: إذا سبق
+    عامل آخر إلى بعض محاولات الدفعة يقل عدد الصفوف المحدثة فتُلغى الدفعة وتُقرأ من جديد
+    """
+    db = SessionLocal()
+    try:
+        migrated = 0
+        while True:
+            # SKIP LOCKED في PostgreSQL: كل عامل يأخذ دفعة مختلفة (يُتجاهل في SQLite)
+            attempts = db.query(StudentAttempt.id, StudentAttempt.legacy_answers).filter(
+                StudentAttempt.legacy_answers.isnot(None)
+            ).order_by(StudentAttempt.id).limit(batch_size).with_for_update(skip_locked=True).all()
+            if not attempts:
+                break
+            
+            claimed = db.query(StudentAttempt).filter(
+                StudentAttempt.id.in_([attempt_id for attempt_id, _ in attempts]),
+                StudentAttempt.legacy_answers.isnot(None)
+            ).update({StudentAttempt.legacy_answers: null()}, synchronize_session=False)
+            if claimed != len(attempts):
+                db.rollback()
+                continue
+            
+            rows = []
+            for attempt_id, answers in attempts:
+                if not isinstance(answers, dict):
+                    continue
+                for question_num, data in answers.items():
+                    rows.append({
+                        'attempt_id': attempt_id,
+                        'question_num': int(question_num),
+                        'answer': data.get('answer'),
+                        'is_correct': bool(data.get('is_correct'))
+                    })
+            if rows:
+                db.execute(AttemptAnswer.__table__.insert(), rows)
+            db.commit()
+            migrated += len(attempts)
+        
+        if migrated:
+            logger.info(f"✅ تم نقل إجابات {migrated} محاولة إلى جدول attempt_answers")
+    except Exception as e:
+        logger.error(f"❌ خطأ في نقل الإجابات القديمة: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+def _create_index_statement(index):
+    """أمر إنشاء الفهرس إن لم يكن موجوداً
+    
+    في PostgreSQL يُنشأ بـ CONCURRENTLY حتى لا تُحجب الكتابة على الجداول الكبيرة
+    """
+    statement = str(CreateIndex(index).compile(dialect=engine.dialect))
+    if engine.dialect.name == 'postgresql':
+        return statement.replace('INDEX ', 'INDEX CONCURRENTLY IF NOT EXISTS ', 1)
+    return statement.replace('INDEX ', 'INDEX IF NOT EXISTS ', 1)
+
+def ensure_indexes():
+    """إنشاء الفهارس الناقصة في قواعد البيانات الموجودة (create_all لا يضيفها لجداول قائمة)
+    
+    تُستدعى من خطوة الترحيل (migrate) لا عند الاستيراد. CONCURRENTLY لا يعمل داخل
+    معاملة لذلك يُنفذ كل أمر بتأكيد تلقائي؛ والفهرس الذي فشل بناؤه سابقاً (INVALID)
+    يُحذف ويُعاد بناؤه
+    """
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if engine.dialect.name == 'postgresql':
+                    invalid = connection.execute(text(
+                        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE c.relname = :name AND NOT i.indisvalid"
+                    ), {'name': index.name}).first()
+                    if invalid:
+                        logger.warning(f"⚠️ الفهرس {index.name} غير صالح، سيُعاد بناؤه")
+                        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index.name}'))
+                connection.execute(text(_create_index_statement(index)))
+
+def ensure_columns():
+    """إضافة الأعمدة الجديدة إلى الجداول الموجودة (create_all لا يضيفها لجداول قائمة)
+    
+    العمود الجديد NOT NULL يحتاج server_default حتى تأخذه الصفوف الموجودة
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                definition = CreateColumn(column).compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {definition}'))
+                logger.info(f"✅ تمت إضافة العمود {table.name}.{column.name}")
+
+# تشغيل الترحيل عند بدء البوت: افتراضياً مع SQLite فقط (خادم واحد بدون أمر ما قبل النشر)
+DB_MIGRATE_ON_START = os.getenv('DB_MIGRATE_ON_START', 'true' if IS_SQLITE else 'false').lower() in ['true', '1', 'yes']
+
+# معرف قفل الترحيل في PostgreSQL (pg_advisory_lock) حتى لا يتسابق عاملان على نفس الخطوة
+MIGRATION_LOCK_ID = 724301
+
+def migrate():
+    """خطوة ترحيل المخطط لقواعد البيانات الموجودة: python database.py migrate
+    
+    تُشغل مرة واحدة قبل بدء العمال (أمر ما قبل النشر)، وتلقائياً عند بدء التشغيل
+    مع SQLite (انظر DB_MIGRATE_ON_START)
+    """
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+        try:
+            ensure_columns()
+            ensure_indexes()
+            logger.info("✅ تم ترحيل مخطط قاعدة البيانات")
+        finally:
+            if engine.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+
 # ============= دوال إدارة قاعدة البيانات =============
 
+# بعد الكتابة تُقرأ بيانات نفس المستخدم من القاعدة الأساسية لفترة تغطي تأخر النسخ
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '30'))
+
+_recent_writers = TTLCache(maxsize=10000, ttl=READ_YOUR_WRITES_SECONDS)
+
+def _mark_recent_write(writer_key):
+    """تسجيل أن المستخدم كتب للتو (مثال: ('student', telegram_id))"""
+    if ReadSessionLocal is not SessionLocal:
+        _recent_writers.set(writer_key, True)
+
+def _read_session(writer_key=None):
+    """جلسة للقراءة: نسخة القراءة، أو القاعدة الأساسية لمن كتب للتو"""
+    if writer_key is not None and _recent_writers.get(writer_key):
+        return SessionLocal()
+    return ReadSessionLocal()
+
 def get_db():
     """الحصول على جلسة قاعدة البيانات"""
     db = SessionLocal()
@@ -92,8 +463,19 @@ def get_db():
 
 # ============= دوال المعلمين =============
 
+# ذاكرة مؤقتة لهوية المستخدمين: telegram_id -> المعلم، أو False لغير المعلمين
+TEACHER_CACHE_SIZE = int(os.getenv('TEACHER_CACHE_SIZE', '10000'))
+TEACHER_CACHE_TTL = int(os.getenv('TEACHER_CACHE_TTL', '600'))
+
+teacher_cache = TTLCache(maxsize=TEACHER_CACHE_SIZE, ttl=TEACHER_CACHE_TTL)
+metrics.register('teacher_cache', teacher_cache.stats)
+
 def add_teacher(telegram_id, username, full_name):
     """إضافة معلم جديد"""
+    cached = teacher_cache.get(telegram_id)
+    if cached:
+        return cached
+    
     db = SessionLocal()
     try:
         teacher = db.query(Teacher).filter(Teacher.telegram_id == telegram_id).first()
@@ -106,6 +488,7 @@ def add_teacher(telegram_id, username, full_name):
             db.add(teacher)
             db.commit()
             logger.info(f"✅ معلم جديد: {username}")
+        teacher_cache.set(telegram_id, teacher)
         return teacher
     except Exception as e:
         logger.error(f"❌ خطأ في إضافة المعلم: {e}")
@@ -114,50 +497,114 @@ def add_teacher(telegram_id, username, full_name):
     finally:
         db.close()
 
+def get_teacher(telegram_id):
+    """قراءة المعلم (أو None) وتخزين النتيجة في الذاكرة المؤقتة"""
+    db = SessionLocal()
+    try:
+        teacher = db.query(Teacher).filter(Teacher.telegram_id == telegram_id).first()
+        teacher_cache.set(telegram_id, teacher or False)
+        return teacher
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب المعلم: {e}")
+        return None
+    finally:
+        db.close()
+
 def is_teacher(telegram_id):
     """التحقق مما إذا كان المستخدم معلماً"""
+    cached = teacher_cache.get(telegram_id)
+    if cached is not None:
+        return cached is not False and cached.is_active
+    
     db = SessionLocal()
     try:
-        teacher = db.query(Teacher).filter(
-            Teacher.telegram_id == telegram_id,
-            Teacher.is_active == True
-        ).first()
-        return teacher is not None
+        teacher = db.query(Teacher).filter(Teacher.telegram_id == telegram_id).first()
+        # تخزين النتيجة السلبية أيضاً حتى لا يكلف الطلاب استعلاماً في كل /start
+        teacher_cache.set(telegram_id, teacher or False)
+        return teacher is not None and teacher.is_active
     except Exception as e:
         logger.error(f"❌ خطأ في التحقق من المعلم: {e}")
         return False
     finally:
         db.close()
 
+def set_teacher_active(telegram_id, is_active):
+    """تفعيل أو تعطيل معلم مع إبطال هويته في الذاكرة المؤقتة"""
+    db = SessionLocal()
+    try:
+        updated = db.query(Teacher).filter(Teacher.telegram_id == telegram_id).update(
+            {Teacher.is_active: is_active}, synchronize_session=False
+        )
+        db.commit()
+        return bool(updated)
+    except Exception as e:
+        logger.error(f"❌ خطأ في تحديث حالة المعلم: {e}")
+        db.rollback()
+        return False
+    finally:
+        teacher_cache.pop(telegram_id)
+        db.close()
+
 # ============= دوال الكويزات =============
 
-import random
-import string
+# ذاكرة مؤقتة للكويزات النشطة بمفتاحين: ('code', الكود) و ('id', المعرف)
+QUIZ_CACHE_SIZE = int(os.getenv('QUIZ_CACHE_SIZE', '512'))
+QUIZ_CACHE_TTL = int(os.getenv('QUIZ_CACHE_TTL', '300'))
+# الكود غير الموجود يُخزن كـ False لفترة قصيرة حتى لا يصل كل كود خاطئ إلى قاعدة البيانات
+QUIZ_NOT_FOUND_TTL = int(os.getenv('QUIZ_NOT_FOUND_TTL', '30'))
+
+quiz_cache = TTLCache(maxsize=QUIZ_CACHE_SIZE, ttl=QUIZ_CACHE_TTL)
+metrics.register('quiz_cache', quiz_cache.stats)
+
+def normalize_quiz_code(quiz_code):
+    """توحيد صيغة كود الكويز"""
+    return str(quiz_code).strip().upper()
 
-def generate_quiz_code():
-    """توليد كود عشوائي للكويز"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+def invalidate_quiz(quiz_id=None, quiz_code=None):
+    """إبطال الكويز في الذاكرة المؤقتة (بالمفتاحين معاً عند توفرهما)"""
+    if quiz_id is not None:
+        cached = quiz_cache.pop(('id', quiz_id))
+        if cached:
+            quiz_cache.pop(('code', cached.quiz_code))
+    if quiz_code is not None:
+        cached = quiz_cache.pop(('code', normalize_quiz_code(quiz_code)))
+        if cached:
+            quiz_cache.pop(('id', cached.id))
 
 def create_quiz(teacher_id, title, description, questions):
-    """إنشاء كويز جديد"""
+    """إنشاء كويز جديد (الكود مشتق من معرف الصف فلا يتعارض بين العمال)"""
     db = SessionLocal()
     try:
-        # توليد كود فريد
-        while True:
-            quiz_code = generate_quiz_code()
-            existing = db.query(Quiz).filter(Quiz.quiz_code == quiz_code).first()
-            if not existing:
-                break
-        
+        # كود مؤقت فريد حتى يُعرف معرف الصف، ثم الكود النهائي في نفس المعاملة
         quiz = Quiz(
             teacher_id=teacher_id,
-            quiz_code=quiz_code,
+            quiz_code=f"~{uuid.uuid4().hex}",
             title=title,
             description=description,
             questions=questions
         )
         db.add(quiz)
+        db.flush()
+        
+        # قيد التفرد يحسم أي تعارض نادر مع الأكواد العشوائية القديمة
+        for attempt in range(quiz_code_allocator.MAX_ATTEMPTS):
+            quiz_code = quiz_code_allocator.code_for(quiz.id, attempt)
+            try:
+                with db.begin_nested():
+                    quiz.quiz_code = quiz_code
+                    db.flush()
+                break
+            except IntegrityError:
+                logger.warning(f"⚠️ تعارض في كود الكويز {quiz_code}، إعادة المحاولة")
+        else:
+            logger.error("❌ تعذر توليد كود فريد للكويز")
+            db.rollback()
+            return None
+        
+        db.add(QuizStats(quiz_id=quiz.id, score_histogram={}))
         db.commit()
+        invalidate_quiz(quiz_code=quiz_code)
+        _mark_recent_write(('teacher', teacher_id))
         logger.info(f"✅ كويز جديد: {title} - الكود: {quiz_code}")
         return quiz
     except Exception as e:
@@ -167,23 +614,71 @@ def create_quiz(teacher_id, title, description, questions):
     finally:
         db.close()
 
-def get_quiz_by_code(quiz_code):
-    """الحصول على كويز بواسطة الكود"""
+def _load_quiz(cache_key, *criteria):
+    """تحميل كويز نشط من قاعدة البيانات وتخزينه في الذاكرة المؤقتة
+    
+    لا تُخزن النتيجة إذا أُبطل المفتاح أثناء التحميل، والكويز غير الموجود يُخزن
+    كـ False لمدة QUIZ_NOT_FOUND_TTL
+    """
+    generation = quiz_cache.begin_load(cache_key)
     db = SessionLocal()
     try:
-        return db.query(Quiz).filter(
-            Quiz.quiz_code == quiz_code.upper(),
-            Quiz.is_active == True
-        ).first()
+        quiz = db.query(Quiz).filter(*criteria, Quiz.is_active == True).first()
     except Exception as e:
+        quiz_cache.finish_load(cache_key, generation)
         logger.error(f"❌ خطأ في البحث عن الكويز: {e}")
         return None
     finally:
         db.close()
+    
+    if quiz is None:
+        quiz_cache.finish_load(cache_key, generation, False, ttl=QUIZ_NOT_FOUND_TTL)
+    elif quiz_cache.finish_load(cache_key, generation, quiz):
+        other_key = ('id', quiz.id) if cache_key[0] == 'code' else ('code', quiz.quiz_code)
+        quiz_cache.set(other_key, quiz)
+    return quiz
+
+def get_quiz_by_code(quiz_code):
+    """الحصول على كويز بواسطة الكود (مع ذاكرة مؤقتة)"""
+    quiz_code = normalize_quiz_code(quiz_code)
+    quiz = quiz_cache.get(('code', quiz_code))
+    if quiz is None:
+        quiz = _load_quiz(('code', quiz_code), Quiz.quiz_code == quiz_code)
+    return quiz or None
+
+def get_quiz_by_id(quiz_id):
+    """الحصول على كويز نشط بواسطة المعرف (مع ذاكرة مؤقتة)"""
+    quiz = quiz_cache.get(('id', quiz_id))
+    if quiz is None:
+        quiz = _load_quiz(('id', quiz_id), Quiz.id == quiz_id)
+    return quiz or None
+
+def delete_quiz(quiz_id, teacher_id):
+    """تعطيل كويز المعلم (حذف منطقي)"""
+    db = SessionLocal()
+    try:
+        quiz_code = db.query(Quiz.quiz_code).filter(Quiz.id == quiz_id).scalar()
+        updated = db.query(Quiz).filter(
+            Quiz.id == quiz_id,
+            Quiz.teacher_id == teacher_id
+        ).update({Quiz.is_active: False}, synchronize_session=False)
+        db.commit()
+        # بالمفتاحين: تحميل جارٍ بالكود قد لا يكون في الذاكرة بعد
+        invalidate_quiz(quiz_id=quiz_id, quiz_code=quiz_code)
+        _mark_recent_write(('teacher', teacher_id))
+        if updated:
+            logger.info(f"✅ تم تعطيل الكويز: {quiz_id}")
+        return bool(updated)
+    except Exception as e:
+        logger.error(f"❌ خطأ في تعطيل الكويز: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
 
 def get_teacher_quizzes(teacher_id):
     """الحصول على جميع كويزات المعلم"""
-    db = SessionLocal()
+    db = _read_session(('teacher', teacher_id))
     try:
         return db.query(Quiz).filter(
             Quiz.teacher_id == teacher_id,
@@ -195,55 +690,211 @@ def get_teacher_quizzes(teacher_id):
     finally:
         db.close()
 
+def _build_statistics(total_attempts, total_score, total_score_sq, total_percentage,
+                      max_score, min_score, median_score):
+    """حساب الإحصائيات النهائية من المجاميع (بدون الاعتماد على دقة دوال قاعدة البيانات)"""
+    avg_score = total_score / total_attempts
+    variance = max(total_score_sq / total_attempts - avg_score * avg_score, 0)
+    return {
+        'total_attempts': total_attempts,
+        'avg_score': round(avg_score, 1),
+        'avg_percentage': round(total_percentage / total_attempts, 1),
+        'max_score': max_score,
+        'min_score': min_score,
+        'median_score': median_score,
+        'stddev_score': round(math.sqrt(variance), 2)
+    }
+
+def _statistics_from_summary(stats):
+    """تحويل صف الملخص إلى قاموس الإحصائيات"""
+    histogram = sorted((int(score), count) for score, count in (stats.score_histogram or {}).items())
+    
+    # الوسيط من المدرج التكراري: متوسط القيمتين في الموضعين الأوسطين
+    positions = {(stats.total_attempts - 1) // 2, stats.total_attempts // 2}
+    middle = []
+    seen = 0
+    for score, count in histogram:
+        for position in sorted(positions):
+            if seen <= position < seen + count:
+                middle.append(score)
+        seen += count
+    median_score = sum(middle) / len(middle) if middle else None
+    
+    return _build_statistics(
+        stats.total_attempts, stats.score_sum, stats.score_sq_sum, stats.percentage_sum,
+        stats.max_score, stats.min_score, median_score
+    )
+
 def get_quiz_statistics(quiz_id):
-    """الحصول على إحصائيات الكويز"""
-    db = SessionLocal()
+    """الحصول على إحصائيات الكويز (قراءة صف الملخص بالمفتاح الأساسي)"""
+    db = _read_session()
     try:
-        attempts = db.query(StudentAttempt).filter(
-            StudentAttempt.quiz_id == quiz_id,
-            StudentAttempt.is_completed == True
+        stats = db.query(QuizStats).filter(QuizStats.quiz_id == quiz_id).first()
+        if not stats or not stats.total_attempts:
+            return None
+        return _statistics_from_summary(stats)
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب الإحصائيات: {e}")
+        return None
+    finally:
+        db.close()
+
+def get_quizzes_statistics(quiz_ids):
+    """الحصول على إحصائيات عدة كويزات في استعلام واحد {quiz_id: الإحصائيات}"""
+    quiz_ids = list(quiz_ids)
+    if not quiz_ids:
+        return {}
+    db = _read_session()
+    try:
+        summaries = db.query(QuizStats).filter(
+            QuizStats.quiz_id.in_(quiz_ids),
+            QuizStats.total_attempts > 0
         ).all()
+        return {stats.quiz_id: _statistics_from_summary(stats) for stats in summaries}
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب إحصائيات الكويزات: {e}")
+        return {}
+    finally:
+        db.close()
+
+def _ensure_quiz_stats_rows(db, quiz_ids):
+    """إنشاء صفوف الملخص الناقصة دون خطأ إذا أنشأها عامل آخر في نفس اللحظة
+    
+    INSERT ... ON CONFLICT DO NOTHING في PostgreSQL وSQLite، وإلا نقطة حفظ
+    يُتجاهل فيها IntegrityError
+    """
+    rows = [
+        {
+            'quiz_id': quiz_id, 'total_attempts': 0, 'score_sum': 0, 'score_sq_sum': 0,
+            'percentage_sum': 0, 'score_histogram': {}, 'updated_at': datetime.now()
+        }
+        for quiz_id in quiz_ids
+    ]
+    if not rows:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect in _INSERT_IGNORE:
+        db.execute(_INSERT_IGNORE[dialect](QuizStats.__table__).on_conflict_do_nothing(), rows)
+        return
+    for row in rows:
+        try:
+            with db.begin_nested():
+                db.execute(QuizStats.__table__.insert(), row)
+        except IntegrityError:
+            pass
+
+def _record_attempt_stats(db, quiz_id, score, percentage):
+    """تحديث ملخص إحصائيات الكويز ضمن نفس المعاملة"""
+    stats = db.query(QuizStats).filter(QuizStats.quiz_id == quiz_id).with_for_update().first()
+    if stats is None:
+        # كويز بدون ملخص: محاولتان تنتهيان معاً قد تُنشئان الصف في نفس اللحظة
+        _ensure_quiz_stats_rows(db, [quiz_id])
+        stats = db.query(QuizStats).filter(QuizStats.quiz_id == quiz_id).with_for_update().first()
+    
+    stats.total_attempts += 1
+    stats.score_sum += score
+    stats.score_sq_sum += score * score
+    stats.percentage_sum += percentage
+    stats.min_score = score if stats.min_score is None else min(stats.min_score, score)
+    stats.max_score = score if stats.max_score is None else max(stats.max_score, score)
+    # إسناد قاموس جديد حتى يتم اكتشاف التغيير في عمود JSON
+    histogram = dict(stats.score_histogram or {})
+    histogram[str(score)] = histogram.get(str(score), 0) + 1
+    stats.score_histogram = histogram
+    stats.updated_at = datetime.now()
+
+def rebuild_quiz_stats(quiz_id=None, missing_only=False):
+    """إعادة بناء ملخصات الإحصائيات من المحاولات الخام
+    
+    صفوف الملخص تُقفل (FOR UPDATE) قبل الجمع: المحاولة التي تنتهي أثناء إعادة البناء
+    إما أنها أُكدت قبل القفل فتدخل في المجموع، أو تنتظره ثم تضيف نفسها إلى الملخص الجديد
+    """
+    db = SessionLocal()
+    try:
+        quizzes = db.query(Quiz.id)
+        if quiz_id is not None:
+            quizzes = quizzes.filter(Quiz.id == quiz_id)
+        if missing_only:
+            quizzes = quizzes.filter(~Quiz.id.in_(db.query(QuizStats.quiz_id)))
+        quiz_ids = [row_id for (row_id,) in quizzes]
+        if not quiz_ids:
+            return 0
         
-        if not attempts:
-            return None
+        _ensure_quiz_stats_rows(db, quiz_ids)
+        summaries = {
+            stats.quiz_id: stats
+            for stats in db.query(QuizStats).filter(QuizStats.quiz_id.in_(quiz_ids)).with_for_update()
+        }
         
-        total_attempts = len(attempts)
-        total_score = sum(a.score for a in attempts)
-        total_percentage = sum(a.percentage for a in attempts)
+        filters = [StudentAttempt.is_completed == True]
+        if quiz_id is not None or missing_only:
+            filters.append(StudentAttempt.quiz_id.in_(quiz_ids))
         
-        return {
-            'total_attempts': total_attempts,
-            'avg_score': round(total_score / total_attempts, 1),
-            'avg_percentage': round(total_percentage / total_attempts, 1),
-            'max_score': max(a.score for a in attempts),
-            'min_score': min(a.score for a in attempts)
+        totals = {
+            row[0]: row[1:] for row in db.query(
+                StudentAttempt.quiz_id,
+                func.count(),
+                func.sum(StudentAttempt.score),
+                func.sum(StudentAttempt.score * StudentAttempt.score),
+                func.sum(StudentAttempt.percentage),
+                func.min(StudentAttempt.score),
+                func.max(StudentAttempt.score)
+            ).filter(*filters).group_by(StudentAttempt.quiz_id)
         }
+        
+        histograms = defaultdict(dict)
+        for stats_quiz_id, score, count in db.query(
+            StudentAttempt.quiz_id, StudentAttempt.score, func.count()
+        ).filter(*filters).group_by(StudentAttempt.quiz_id, StudentAttempt.score):
+            histograms[stats_quiz_id][str(score)] = count
+        
+        for stats_quiz_id in quiz_ids:
+            count, score_sum, score_sq_sum, percentage_sum, min_score, max_score = totals.get(
+                stats_quiz_id, (0, 0, 0, 0, None, None)
+            )
+            stats = summaries[stats_quiz_id]
+            stats.total_attempts = count
+            stats.score_sum = score_sum
+            stats.score_sq_sum = score_sq_sum
+            stats.percentage_sum = percentage_sum
+            stats.min_score = min_score
+            stats.max_score = max_score
+            stats.score_histogram = histograms[stats_quiz_id]
+            stats.updated_at = datetime.now()
+        db.commit()
+        
+        logger.info(f"✅ تمت إعادة بناء إحصائيات {len(quiz_ids)} كويز")
+        return len(quiz_ids)
     except Exception as e:
-        logger.error(f"❌ خطأ في جلب الإحصائيات: {e}")
-        return None
+        logger.error(f"❌ خطأ في إعادة بناء الإحصائيات: {e}")
+        db.rollback()
+        return 0
     finally:
         db.close()
 
 def start_student_attempt(quiz_id, student_telegram_id, student_name):
-    """بدء محاولة جديدة للطالب"""
+    """بدء محاولة جديدة للطالب (إدراج المحاولة وزيادة عدد الطلاب في معاملة واحدة)"""
     db = SessionLocal()
     try:
-        attempt = StudentAttempt(
+        insert_attempt = StudentAttempt.__table__.insert().values(
             quiz_id=quiz_id,
             student_telegram_id=student_telegram_id,
             student_name=student_name,
-            answers={}
+            started_at=datetime.now()
         )
-        db.add(attempt)
-        db.commit()
-        
-        # تحديث عدد الطلاب في الكويز
-        quiz = db.query(Quiz).filter(Quiz.id == quiz_id).first()
-        if quiz:
-            quiz.total_students += 1
-            db.commit()
+        # RETURNING حيث يدعمه المحرك (PostgreSQL) بدلاً من استعلام إضافي
+        if db.get_bind().dialect.implicit_returning:
+            attempt_id = db.execute(insert_attempt.returning(StudentAttempt.id)).scalar()
+        else:
+            attempt_id = db.execute(insert_attempt).inserted_primary_key[0]
         
-        return attempt
+        # زيادة ذرية داخل قاعدة البيانات لتجنب فقدان التحديثات عند التزامن
+        db.query(Quiz).filter(Quiz.id == quiz_id).update(
+            {Quiz.total_students: func.coalesce(Quiz.total_students, 0) + 1},
+            synchronize_session=False
+        )
+        db.commit()
+        return attempt_id
     except Exception as e:
         logger.error(f"❌ خطأ في بدء المحاولة: {e}")
         db.rollback()
@@ -251,19 +902,37 @@ def start_student_attempt(quiz_id, student_telegram_id, student_name):
     finally:
         db.close()
 
-def complete_attempt(attempt_id, score, total_questions):
-    """إنهاء محاولة الطالب"""
+def complete_attempt(attempt_id, score, total_questions, key_version=None):
+    """إنهاء محاولة الطالب وتحديث ملخص الإحصائيات في نفس المعاملة
+    
+    key_version: إصدار مفتاح الإجابات الذي صُححت به إجابات الجلسة. إذا طابق الإصدار
+    الحالي تُعتمد الدرجة وis_correct المحفوظة كما هي، وإلا (أو إذا كان None) تُعاد
+    تصحيح إجابات المحاولة بأمر UPDATE واحد وتُحسب الدرجة منها
+    """
     db = SessionLocal()
     try:
         attempt = db.query(StudentAttempt).filter(StudentAttempt.id == attempt_id).first()
         if attempt:
+            # قفل مشترك على صف الكويز: /fixkey (FOR UPDATE) لا يغير المفتاح قبل تأكيد
+            # هذه المحاولة، ولا يحجب زيادة total_students
+            current_version = db.query(Quiz.key_version).filter(
+                Quiz.id == attempt.quiz_id
+            ).with_for_update(read=True, key_share=True).scalar()
+            if key_version is None or key_version != current_version:
+                score = _regrade_attempt_answers(db, attempt)
+            
+            was_completed = attempt.is_completed
             attempt.score = score
             attempt.total_questions = total_questions
             percentage = (score / total_questions) * 100 if total_questions > 0 else 0
             attempt.percentage = int(percentage)  # تخزين كرقم صحيح
             attempt.completed_at = datetime.now()
             attempt.is_completed = True
+            # عدم احتساب المحاولة مرتين في الملخص
+            if not was_completed:
+                _record_attempt_stats(db, attempt.quiz_id, score, attempt.percentage)
             db.commit()
+            _mark_recent_write(('student', attempt.student_telegram_id))
             logger.info(f"✅ محاولة منتهية: {attempt_id}, النتيجة: {score}/{total_questions}")
         return attempt
     except Exception as e:
@@ -273,9 +942,36 @@ def complete_attempt(attempt_id, score, total_questions):
     finally:
         db.close()
 
+def _regrade_attempt_answers(db, attempt):
+    """تصحيح إجابات محاولة بمفتاح الإجابات الحالي وإرجاع درجتها (عند تغير المفتاح فقط)"""
+    questions = db.query(Quiz.questions).filter(Quiz.id == attempt.quiz_id).scalar() or []
+    key = {
+        q_num: str(q.get('correct_answer', '')).lower()
+        for q_num, q in enumerate(questions, start=1)
+    }
+    if not key:
+        return 0
+    
+    in_range = AttemptAnswer.question_num.between(1, len(key))
+    db.query(AttemptAnswer).filter(AttemptAnswer.attempt_id == attempt.id, in_range).update(
+        {AttemptAnswer.is_correct: func.lower(func.coalesce(AttemptAnswer.answer, '')) == case(
+            key, value=AttemptAnswer.question_num
+        )},
+        synchronize_session=False
+    )
+    
+    # عند تكرار الإجابة لنفس السؤال تُعتمد الأخيرة كما في get_attempt_answers
+    latest = aliased(AttemptAnswer)
+    latest_ids = db.query(func.max(latest.id)).filter(
+        latest.attempt_id == attempt.id
+    ).group_by(latest.question_num)
+    return db.query(func.count()).select_from(AttemptAnswer).filter(
+        AttemptAnswer.id.in_(latest_ids), in_range, AttemptAnswer.is_correct == True
+    ).scalar()
+
 def get_student_attempts(student_telegram_id):
     """الحصول على جميع محاولات الطالب"""
-    db = SessionLocal()
+    db = _read_session(('student', student_telegram_id))
     try:
         return db.query(StudentAttempt).filter(
             StudentAttempt.student_telegram_id == student_telegram_id,
@@ -287,24 +983,525 @@ def get_student_attempts(student_telegram_id):
     finally:
         db.close()
 
+def get_student_history(student_telegram_id, cursor=None, direction='older', limit=10):
+    """سجل محاولات الطالب مع عناوين الكويزات في استعلام واحد (ترقيم بمؤشر (completed_at, id))"""
+    db = _read_session(('student', student_telegram_id))
+    try:
+        query = db.query(
+            StudentAttempt.id,
+            Quiz.title.label('quiz_title'),
+            StudentAttempt.completed_at,
+            StudentAttempt.score,
+            StudentAttempt.total_questions,
+            StudentAttempt.percentage
+        ).outerjoin(Quiz, Quiz.id == StudentAttempt.quiz_id).filter(
+            StudentAttempt.student_telegram_id == student_telegram_id,
+            StudentAttempt.is_completed == True
+        )
+        
+        older = direction == 'older'
+        if cursor:
+            completed_at, attempt_id = cursor
+            if older:
+                query = query.filter(or_(
+                    StudentAttempt.completed_at < completed_at,
+                    and_(StudentAttempt.completed_at == completed_at, StudentAttempt.id < attempt_id)
+                ))
+            else:
+                query = query.filter(or_(
+                    StudentAttempt.completed_at > completed_at,
+                    and_(StudentAttempt.completed_at == completed_at, StudentAttempt.id > attempt_id)
+                ))
+        
+        if older:
+            query = query.order_by(StudentAttempt.completed_at.desc(), StudentAttempt.id.desc())
+        else:
+            query = query.order_by(StudentAttempt.completed_at.asc(), StudentAttempt.id.asc())
+        
+        # جلب صف إضافي لمعرفة وجود صفحة تالية
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not older:
+            rows.reverse()
+        
+        return {
+            'attempts': rows,
+            'has_older': has_more if older else cursor is not None,
+            'has_newer': cursor is not None if older else has_more
+        }
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب سجل الطالب: {e}")
+        return {'attempts': [], 'has_older': False, 'has_newer': False}
+    finally:
+        db.close()
+
+def iter_quiz_results(quiz_id, batch_size=1000):
+    """بث محاولات الكويز مع إجاباتها على دفعات (ذاكرة ثابتة مهما كان الحجم)
+    
+    تُرجع أزواج (المحاولة، قائمة الإجابات) مرتبة حسب معرف المحاولة.
+    """
+    db = _read_session()
+    try:
+        last_id = 0
+        while True:
+            # ترقيم بالمفتاح على (quiz_id, id) بدلاً من فرز جميع الصفوف دفعة واحدة
+            attempts = db.query(
+                StudentAttempt.id.label('attempt_id'),
+                StudentAttempt.student_telegram_id,
+                StudentAttempt.student_name,
+                StudentAttempt.started_at,
+                StudentAttempt.completed_at,
+                StudentAttempt.is_completed,
+                StudentAttempt.score,
+                StudentAttempt.total_questions,
+                StudentAttempt.percentage
+            ).filter(
+                StudentAttempt.quiz_id == quiz_id,
+                StudentAttempt.id > last_id
+            ).order_by(StudentAttempt.id).limit(batch_size).all()
+            if not attempts:
+                break
+            
+            answers = defaultdict(list)
+            for row in db.query(
+                AttemptAnswer.attempt_id,
+                AttemptAnswer.question_num,
+                AttemptAnswer.answer,
+                AttemptAnswer.is_correct
+            ).filter(
+                AttemptAnswer.attempt_id.in_([attempt.attempt_id for attempt in attempts])
+            ).order_by(AttemptAnswer.attempt_id, AttemptAnswer.id):
+                answers[row.attempt_id].append(row)
+            
+            for attempt in attempts:
+                yield attempt, answers[attempt.attempt_id]
+            last_id = attempts[-1].attempt_id
+    finally:
+        db.close()
+
 def save_answer(attempt_id, question_num, answer, is_correct):
-    """حفظ إجابة الطالب"""
+    """حفظ إجابة الطالب (إدراج صف واحد دون إعادة كتابة المحاولة)"""
     db = SessionLocal()
     try:
-        attempt = db.query(StudentAttempt).filter(StudentAttempt.id == attempt_id).first()
-        if attempt:
-            if not attempt.answers:
-                attempt.answers = {}
-            if isinstance(attempt.answers, dict):
-                attempt.answers[str(question_num)] = {
-                    'answer': answer,
-                    'is_correct': is_correct
-                }
-            db.commit()
-        return attempt
+        db.execute(AttemptAnswer.__table__.insert().values(
+            attempt_id=attempt_id,
+            question_num=question_num,
+            answer=answer,
+            is_correct=is_correct,
+            answered_at=datetime.now()
+        ))
+        db.commit()
+        return True
     except Exception as e:
         logger.error(f"❌ خطأ في حفظ الإجابة: {e}")
         db.rollback()
+        return False
+    finally:
+        db.close()
+
+def save_answers_bulk(rows):
+    """حفظ مجموعة إجابات دفعة واحدة (إدراج متعدد الصفوف وتأكيد واحد)"""
+    if not rows:
+        return True
+    db = SessionLocal()
+    try:
+        db.execute(AttemptAnswer.__table__.insert(), rows)
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"❌ خطأ في حفظ دفعة الإجابات ({len(rows)} إجابة): {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+def get_attempt_answers(attempt_id):
+    """الحصول على إجابات محاولة كقاموس {رقم السؤال: الإجابة}"""
+    db = SessionLocal()
+    try:
+        rows = db.query(AttemptAnswer).filter(
+            AttemptAnswer.attempt_id == attempt_id
+        ).order_by(AttemptAnswer.id).all()
+        # عند تكرار الإجابة لنفس السؤال تُعتمد الأخيرة
+        return {
+            str(row.question_num): {'answer': row.answer, 'is_correct': row.is_correct}
+            for row in rows
+        }
+    except Exception as e:
+        logger.error(f"❌ خطأ في جلب إجابات المحاولة: {e}")
+        return {}
+    finally:
+        db.close()
+
+# ============= جلسات الطلاب =============
+
+def load_student_session(student_telegram_id):
+    """قراءة جلسة الطالب من قاعدة البيانات الرئيسية كـ (البيانات، الإصدار، وقت التحديث)"""
+    db = SessionLocal()
+    try:
+        row = db.query(
+            StudentSession.data, StudentSession.version, StudentSession.updated_at
+        ).filter(StudentSession.student_telegram_id == student_telegram_id).first()
+        return tuple(row) if row else None
+    except Exception as e:
+        logger.error(f"❌ خطأ في قراءة جلسة الطالب: {e}")
         return None
     finally:
         db.close()
+
+def save_student_session(student_telegram_id, data, expected_version=None):
+    """حفظ جلسة الطالب بالمقارنة والتبديل وإرجاع الإصدار الجديد (None عند التعارض)
+    
+    بدون expected_version تُستبدل الجلسة الحالية (بداية كويز جديد)
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        if expected_version is None:
+            session_row = db.query(StudentSession).filter(
+                StudentSession.student_telegram_id == student_telegram_id
+            ).with_for_update().first()
+            if session_row:
+                session_row.data = data
+                session_row.version += 1
+                session_row.updated_at = now
+                new_version = session_row.version
+            else:
+                db.add(StudentSession(
+                    student_telegram_id=student_telegram_id,
+                    data=data,
+                    version=1,
+                    updated_at=now
+                ))
+                new_version = 1
+        else:
+            updated = db.query(StudentSession).filter(
+                StudentSession.student_telegram_id == student_telegram_id,
+                StudentSession.version == expected_version
+            ).update({
+                StudentSession.data: data,
+                StudentSession.version: StudentSession.version + 1,
+                StudentSession.updated_at: now
+            }, synchronize_session=False)
+            if not updated:
+                db.rollback()
+                return None
+            new_version = expected_version + 1
+        db.commit()
+        return new_version
+    except IntegrityError:
+        # عامل آخر أنشأ الجلسة في نفس اللحظة
+        db.rollback()
+        return None
+    except Exception as e:
+        logger.error(f"❌ خطأ في حفظ جلسة الطالب: {e}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+def delete_student_session(student_telegram_id):
+    """حذف جلسة الطالب"""
+    db = SessionLocal()
+    try:
+        db.query(StudentSession).filter(
+            StudentSession.student_telegram_id == student_telegram_id
+        ).delete(synchronize_session=False)
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"❌ خطأ في حذف جلسة الطالب: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+def delete_idle_student_sessions(cutoff):
+    """حذف الجلسات التي لم تُحدّث منذ cutoff وإرجاع عددها"""
+    db = SessionLocal()
+    try:
+        deleted = db.query(StudentSession).filter(
+            StudentSession.updated_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    except Exception as e:
+        logger.error(f"❌ خطأ في حذف الجلسات الخاملة: {e}")
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+# ============= مسودات الكويزات =============
+
+def save_quiz_draft(teacher_telegram_id, header=None, questions=None, question_count=None, expected_version=None):
+    """حفظ التغييرات فقط في مسودة المعلم بالمقارنة والتبديل وإرجاع الإصدار الجديد
+    
+    header: العنوان والوصف والسؤال الجاري عند تغيرها
+    questions: الأسئلة المتغيرة (تُدرج أو تُحدّث حسب رقمها)
+    question_count: عند حذف أسئلة تُحذف الصفوف بعد هذا العدد
+    expected_version: إصدار المسودة الذي بُنيت عليه التغييرات؛ إذا عدّلها عامل آخر
+    بعده يُرجع None دون حفظ. بدونه تُنشأ المسودة أو تُستبدل (بداية كويز جديد)
+    """
+    db = SessionLocal()
+    try:
+        values = {QuizDraft.version: QuizDraft.version + 1, QuizDraft.updated_at: datetime.now()}
+        if header is not None:
+            values[QuizDraft.title] = header.get('title')
+            values[QuizDraft.description] = header.get('description')
+            values[QuizDraft.pending] = header.get('pending') or None
+        
+        drafts = db.query(QuizDraft).filter(QuizDraft.teacher_telegram_id == teacher_telegram_id)
+        if expected_version is not None:
+            drafts = drafts.filter(QuizDraft.version == expected_version)
+        if drafts.update(values, synchronize_session=False):
+            new_version = db.query(QuizDraft.version).filter(
+                QuizDraft.teacher_telegram_id == teacher_telegram_id
+            ).scalar()
+        elif expected_version is not None:
+            db.rollback()
+            return None
+        else:
+            header = header or {}
+            db.add(QuizDraft(
+                teacher_telegram_id=teacher_telegram_id,
+                title=header.get('title'),
+                description=header.get('description'),
+                pending=header.get('pending') or None,
+                version=1,
+                updated_at=datetime.now()
+            ))
+            db.flush()
+            new_version = 1
+        
+        if question_count is not None:
+            db.query(QuizDraftQuestion).filter(
+                QuizDraftQuestion.teacher_telegram_id == teacher_telegram_id,
+                QuizDraftQuestion.question_num > question_count
+            ).delete(synchronize_session=False)
+        
+        if questions:
+            nums = [q['question_num'] for q in questions]
+            existing = {
+                row.question_num: row
+                for row in db.query(QuizDraftQuestion).filter(
+                    QuizDraftQuestion.teacher_telegram_id == teacher_telegram_id,
+                    QuizDraftQuestion.question_num.in_(nums)
+                )
+            }
+            for question in questions:
+                row = existing.get(question['question_num'])
+                if row:
+                    row.data = question
+                else:
+                    db.add(QuizDraftQuestion(
+                        teacher_telegram_id=teacher_telegram_id,
+                        question_num=question['question_num'],
+                        data=question
+                    ))
+        
+        db.commit()
+        return new_version
+    except IntegrityError:
+        # عامل آخر أنشأ المسودة في نفس اللحظة
+        db.rollback()
+        return None
+    except Exception as e:
+        logger.error(f"❌ خطأ في حفظ مسودة الكويز: {e}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+def get_quiz_draft_version(teacher_telegram_id):
+    """إصدار مسودة المعلم في قاعدة البيانات (None إذا لم توجد)"""
+    db = SessionLocal()
+    try:
+        return db.query(QuizDraft.version).filter(
+            QuizDraft.teacher_telegram_id == teacher_telegram_id
+        ).scalar()
+    except Exception as e:
+        logger.error(f"❌ خطأ في قراءة إصدار مسودة الكويز: {e}")
+        return None
+    finally:
+        db.close()
+
+def load_quiz_draft(teacher_telegram_id):
+    """قراءة مسودة المعلم كقاموس (أو None إذا لم توجد)"""
+    db = SessionLocal()
+    try:
+        draft = db.query(QuizDraft).filter(
+            QuizDraft.teacher_telegram_id == teacher_telegram_id
+        ).first()
+        if not draft:
+            return None
+        rows = db.query(QuizDraftQuestion.data).filter(
+            QuizDraftQuestion.teacher_telegram_id == teacher_telegram_id
+        ).order_by(QuizDraftQuestion.question_num).all()
+        return {
+            'title': draft.title or '',
+            'description': draft.description or '',
+            'pending': draft.pending or {},
+            'questions': [row.data for row in rows],
+            'version': draft.version,
+            'updated_at': draft.updated_at
+        }
+    except Exception as e:
+        logger.error(f"❌ خطأ في قراءة مسودة الكويز: {e}")
+        return None
+    finally:
+        db.close()
+
+def _delete_drafts(db, teacher_ids):
+    """حذف المسودات وأسئلتها داخل الجلسة الحالية"""
+    db.query(QuizDraftQuestion).filter(
+        QuizDraftQuestion.teacher_telegram_id.in_(teacher_ids)
+    ).delete(synchronize_session=False)
+    return db.query(QuizDraft).filter(
+        QuizDraft.teacher_telegram_id.in_(teacher_ids)
+    ).delete(synchronize_session=False)
+
+def delete_quiz_draft(teacher_telegram_id):
+    """حذف مسودة المعلم"""
+    db = SessionLocal()
+    try:
+        _delete_drafts(db, [teacher_telegram_id])
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"❌ خطأ في حذف مسودة الكويز: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+def delete_expired_quiz_drafts(cutoff):
+    """حذف المسودات التي لم تُعدّل منذ cutoff وإرجاع عددها"""
+    db = SessionLocal()
+    try:
+        teacher_ids = [
+            row.teacher_telegram_id
+            for row in db.query(QuizDraft.teacher_telegram_id).filter(QuizDraft.updated_at < cutoff)
+        ]
+        if not teacher_ids:
+            return 0
+        deleted = _delete_drafts(db, teacher_ids)
+        db.commit()
+        return deleted
+    except Exception as e:
+        logger.error(f"❌ خطأ في حذف المسودات المنتهية: {e}")
+        db.rollback()
+        return 0
+    finally:
+        db.close()
+
+# ============= تهيئة قاعدة البيانات =============
+
+migrate_legacy_answers()
+# إنشاء ملخصات الإحصائيات للكويزات القديمة التي لا تملك ملخصاً
+rebuild_quiz_stats(missing_only=True)
+
+# ============= الواجهة غير المتزامنة =============
+
+# عدد الخيوط المخصصة لاستعلامات قاعدة البيانات (يجب ألا يتجاوز حجم مجمع الاتصالات)
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', '8'))
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix='db')
+# SQLite يسمح بكاتب واحد فقط: جميع عمليات الكتابة تمر عبر خيط مخصص
+# بينما تعمل القراءات بالتوازي، بدلاً من التنافس على القفل وخطأ "database is locked"
+_db_write_executor = (
+    ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer') if IS_SQLITE else _db_executor
+)
+
+def _run_in_executor(func, write=False):
+    """تحويل دالة متزامنة إلى دالة قابلة للانتظار تعمل في مجمع خيوط محدود"""
+    executor = _db_write_executor if write else _db_executor
+    
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+_add_teacher_async = _run_in_executor(add_teacher, write=True)
+_get_teacher_async = _run_in_executor(get_teacher)
+_is_teacher_async = _run_in_executor(is_teacher)
+
+async def add_teacher_async(telegram_id, username, full_name):
+    """إضافة معلم؛ المعلم الموجود يُقرأ دون المرور بخيط الكتابة
+    
+    الحالة الشائعة (في الذاكرة المؤقتة) تُخدم من حلقة الأحداث مباشرة، وخيط
+    الكتابة يُستخدم فقط لإنشاء معلم جديد
+    """
+    teacher = teacher_cache.get(telegram_id)
+    if not teacher:
+        teacher = await _get_teacher_async(telegram_id)
+    if teacher:
+        return teacher
+    return await _add_teacher_async(telegram_id, username, full_name)
+
+async def is_teacher_async(telegram_id):
+    """التحقق مما إذا كان المستخدم معلماً (من الذاكرة المؤقتة دون خيط عند توفرها)"""
+    cached = teacher_cache.get(telegram_id)
+    if cached is not None:
+        return cached is not False and cached.is_active
+    return await _is_teacher_async(telegram_id)
+
+set_teacher_active_async = _run_in_executor(set_teacher_active, write=True)
+create_quiz_async = _run_in_executor(create_quiz, write=True)
+delete_quiz_async = _run_in_executor(delete_quiz, write=True)
+
+_load_quiz_async = _run_in_executor(_load_quiz)
+
+async def get_quiz_by_code_async(quiz_code):
+    """الحصول على كويز بالكود مع تحميل واحد فقط لكل كود عند تزامن الطلبات"""
+    quiz_code = normalize_quiz_code(quiz_code)
+    cache_key = ('code', quiz_code)
+    quiz = await quiz_cache.get_or_load(cache_key, lambda: _load_quiz_async(cache_key, Quiz.quiz_code == quiz_code))
+    return quiz or None
+
+async def get_quiz_by_id_async(quiz_id):
+    """الحصول على كويز بالمعرف مع تحميل واحد فقط لكل معرف عند تزامن الطلبات"""
+    cache_key = ('id', quiz_id)
+    quiz = await quiz_cache.get_or_load(cache_key, lambda: _load_quiz_async(cache_key, Quiz.id == quiz_id))
+    return quiz or None
+
+get_teacher_quizzes_async = _run_in_executor(get_teacher_quizzes)
+get_quiz_statistics_async = _run_in_executor(get_quiz_statistics)
+get_quizzes_statistics_async = _run_in_executor(get_quizzes_statistics)
+rebuild_quiz_stats_async = _run_in_executor(rebuild_quiz_stats, write=True)
+start_student_attempt_async = _run_in_executor(start_student_attempt, write=True)
+complete_attempt_async = _run_in_executor(complete_attempt, write=True)
+get_student_attempts_async = _run_in_executor(get_student_attempts)
+get_student_history_async = _run_in_executor(get_student_history)
+save_answer_async = _run_in_executor(save_answer, write=True)
+save_answers_bulk_async = _run_in_executor(save_answers_bulk, write=True)
+get_attempt_answers_async = _run_in_executor(get_attempt_answers)
+load_student_session_async = _run_in_executor(load_student_session)
+save_student_session_async = _run_in_executor(save_student_session, write=True)
+delete_student_session_async = _run_in_executor(delete_student_session, write=True)
+delete_idle_student_sessions_async = _run_in_executor(delete_idle_student_sessions, write=True)
+save_quiz_draft_async = _run_in_executor(save_quiz_draft, write=True)
+load_quiz_draft_async = _run_in_executor(load_quiz_draft)
+get_quiz_draft_version_async = _run_in_executor(get_quiz_draft_version)
+delete_quiz_draft_async = _run_in_executor(delete_quiz_draft, write=True)
+delete_expired_quiz_drafts_async = _run_in_executor(delete_expired_quiz_drafts, write=True)
+
+def shutdown_db_executor():
+    """إيقاف مجمع خيوط قاعدة البيانات بعد انتهاء المهام الجارية"""
+    _db_write_executor.shutdown(wait=True)
+    _db_executor.shutdown(wait=True)
+    logger.info("✅ تم إيقاف مجمع خيوط قاعدة البيانات")
+
+if __name__ == '__main__':
+    # ترحيل المخطط: python database.py migrate
+    # إعادة بناء الملخصات: python database.py rebuild-stats [quiz_id]
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        migrate()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'rebuild-stats':
+        count = rebuild_quiz_stats(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(f"✅ تمت إعادة بناء إحصائيات {count} كويز")
+    else:
+        print("الاستخدام: python database.py migrate | rebuild-stats [quiz_id]")
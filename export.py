@@ -0,0 +1,94 @@
+import os
+import csv
+import gzip
+import json
+import shutil
+import logging
+import tempfile
+from database import iter_quiz_results
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# حد حجم الملفات التي يرسلها البوت عبر Telegram
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+ATTEMPT_COLUMNS = [
+    'attempt_id', 'student_telegram_id', 'student_name', 'started_at', 'completed_at',
+    'is_completed', 'score', 'total_questions', 'percentage'
+]
+ANSWER_COLUMNS = ['question_num', 'answer', 'is_correct']
+
+def _format_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def _attempt_values(attempt):
+    return [_format_value(getattr(attempt, column)) for column in ATTEMPT_COLUMNS]
+
+def _write_csv(results, output):
+    """صف لكل إجابة مع تكرار بيانات المحاولة (أو صف واحد لمحاولة بلا إجابات)"""
+    writer = csv.writer(output)
+    writer.writerow(ATTEMPT_COLUMNS + ANSWER_COLUMNS)
+    count = 0
+    for attempt, answers in results:
+        attempt_values = _attempt_values(attempt)
+        if not answers:
+            writer.writerow(attempt_values + [None] * len(ANSWER_COLUMNS))
+        for answer in answers:
+            writer.writerow(attempt_values + [answer.question_num, answer.answer, answer.is_correct])
+        count += 1
+    return count
+
+def _write_jsonl(results, output):
+    """سطر لكل محاولة مع قائمة إجاباتها"""
+    count = 0
+    for attempt, answers in results:
+        record = dict(zip(ATTEMPT_COLUMNS, _attempt_values(attempt)))
+        record['answers'] = [
+            {'question_num': answer.question_num, 'answer': answer.answer, 'is_correct': answer.is_correct}
+            for answer in answers
+        ]
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+def _gzip_file(path):
+    """ضغط الملف في ملف مؤقت جديد وإرجاع مساره (يُحذف الملف الناقص عند الفشل)"""
+    fd, compressed_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1] + '.gz')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as target:
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, target)
+        return compressed_path
+    except Exception:
+        os.remove(compressed_path)
+        raise
+
+def export_quiz_results(quiz_id, fmt='csv'):
+    """تصدير نتائج الكويز إلى ملف مؤقت وإرجاع (المسار، عدد المحاولات)
+    
+    يُضغط الملف بـ gzip إذا تجاوز حد Telegram، والمستدعي مسؤول عن حذفه.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"صيغة غير مدعومة: {fmt}")
+    
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as output:
+            results = iter_quiz_results(quiz_id)
+            if fmt == 'csv':
+                count = _write_csv(results, output)
+            else:
+                count = _write_jsonl(results, output)
+        
+        if os.path.getsize(path) > MAX_DOCUMENT_BYTES:
+            path, source_path = _gzip_file(path), path
+            os.remove(source_path)
+        
+        logger.info(f"✅ تم تصدير {count} محاولة للكويز {quiz_id}")
+        return path, count
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
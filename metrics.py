@@ -0,0 +1,33 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# مصادر المؤشرات المسجلة: الاسم -> دالة تُرجع قاموس القيم الحالية
+_sources = {}
+
+def register(name, stats_func):
+    """تسجيل مصدر مؤشرات"""
+    _sources[name] = stats_func
+
+def snapshot():
+    """قراءة جميع المؤشرات الحالية كقاموس مسطح"""
+    values = {}
+    for name, stats_func in _sources.items():
+        try:
+            for key, value in stats_func().items():
+                values[f"{name}.{key}"] = value
+        except Exception as e:
+            logger.error(f"❌ خطأ في قراءة مؤشرات {name}: {e}")
+    return values
+
+def format_metrics():
+    """تنسيق المؤشرات كنص للعرض"""
+    values = snapshot()
+    if not values:
+        return "لا توجد مؤشرات مسجلة"
+    lines = []
+    for key, value in sorted(values.items()):
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines)
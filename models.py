@@ -1,16 +1,28 @@
 from typing import List, Dict, Any
+import sys
 import json
 
 class Question:
-    """نموذج السؤال"""
+    """نموذج السؤال (غير قابل للتعديل وبدون __dict__ لتقليل الذاكرة)"""
+    
+    __slots__ = ('question_num', 'question_text', 'question_type', 'correct_answer', 'options')
     
     def __init__(self, question_num: int, question_text: str, question_type: str, 
                  correct_answer: str, options: List[str] = None):
-        self.question_num = question_num
-        self.question_text = question_text
-        self.question_type = question_type  # 'tf' أو 'mcq'
-        self.correct_answer = correct_answer
-        self.options = options or []
+        set_field = object.__setattr__
+        set_field(self, 'question_num', question_num)
+        set_field(self, 'question_text', question_text)
+        set_field(self, 'question_type', sys.intern(question_type))  # 'tf' أو 'mcq'
+        set_field(self, 'correct_answer', sys.intern(correct_answer))
+        set_field(self, 'options', tuple(options or ()))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("السؤال غير قابل للتعديل، استخدم renumbered لإنشاء نسخة")
+    
+    def renumbered(self, question_num: int) -> 'Question':
+        """نسخة من السؤال برقم جديد"""
+        return Question(question_num, self.question_text, self.question_type,
+                        self.correct_answer, self.options)
     
     def to_dict(self) -> Dict[str, Any]:
         """تحويل السؤال إلى قاموس"""
@@ -19,7 +31,7 @@ class Question:
             'question_text': self.question_text,
             'question_type': self.question_type,
             'correct_answer': self.correct_answer,
-            'options': self.options
+            'options': list(self.options)
         }
     
     @classmethod
@@ -33,6 +45,26 @@ class Question:
             options=data.get('options', [])
         )
     
+    def validate(self) -> List[str]:
+        """التحقق من اكتمال بيانات السؤال وإرجاع قائمة الأخطاء"""
+        errors = []
+        if not self.question_text or not self.question_text.strip():
+            errors.append("نص السؤال فارغ")
+        
+        if self.question_type == 'tf':
+            if self.correct_answer not in ('t', 'f'):
+                errors.append("إجابة صح/خطأ يجب أن تكون t أو f")
+        elif self.question_type == 'mcq':
+            if not 2 <= len(self.options) <= 4:
+                errors.append("عدد الخيارات يجب أن يكون بين 2 و 4")
+            letters = [chr(97 + i) for i in range(len(self.options))]
+            if self.correct_answer not in letters:
+                errors.append(f"الإجابة الصحيحة يجب أن تكون أحد الحروف: {', '.join(letters)}")
+        else:
+            errors.append(f"نوع سؤال غير معروف: {self.question_type}")
+        
+        return errors
+    
     def validate_answer(self, answer: str) -> bool:
         """التحقق من صحة الإجابة"""
         if self.question_type == 'tf':
@@ -47,17 +79,56 @@ class QuizBuilder:
         self.questions = []
         self.title = ""
         self.description = ""
+        self.pending = {}  # السؤال الجاري إدخاله: النص والنوع والخيارات
+        
+        # تتبع التغييرات لحفظ ما تغيّر فقط في المسودة
+        self.header_dirty = False
+        self.dirty_questions = set()
+        self.truncated = False
+        self.version = None  # إصدار المسودة المحفوظة (None قبل أول حفظ)
+    
+    def set_title(self, title: str):
+        """تعيين العنوان"""
+        self.title = title
+        self.header_dirty = True
+    
+    def set_description(self, description: str):
+        """تعيين الوصف"""
+        self.description = description
+        self.header_dirty = True
+    
+    def set_pending(self, **fields):
+        """تحديث بيانات السؤال الجاري إدخاله"""
+        self.pending.update(fields)
+        self.header_dirty = True
+    
+    def clear_pending(self):
+        """مسح بيانات السؤال الجاري إدخاله"""
+        self.pending = {}
+        self.header_dirty = True
     
     def add_question(self, question: Question):
         """إضافة سؤال"""
         self.questions.append(question)
+        self.dirty_questions.add(question.question_num)
     
     def remove_question(self, question_num: int):
         """حذف سؤال"""
-        self.questions = [q for q in self.questions if q.question_num != question_num]
+        remaining = [q for q in self.questions if q.question_num != question_num]
         # إعادة ترقيم الأسئلة
-        for i, q in enumerate(self.questions, 1):
-            q.question_num = i
+        self.questions = []
+        for i, q in enumerate(remaining, 1):
+            if q.question_num != i:
+                q = q.renumbered(i)
+                self.dirty_questions.add(i)
+            self.questions.append(q)
+        self.truncated = True
+    
+    def mark_clean(self):
+        """اعتبار جميع التغييرات محفوظة"""
+        self.header_dirty = False
+        self.dirty_questions.clear()
+        self.truncated = False
     
     def get_questions_dict(self) -> Dict:
         """تحويل الأسئلة إلى قاموس للتخزين"""
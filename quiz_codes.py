@@ -0,0 +1,73 @@
+import os
+import hmac
+import hashlib
+import logging
+import string
+
+logger = logging.getLogger(__name__)
+
+# نفس أبجدية الأكواد السابقة: 6 رموز من الحروف الكبيرة والأرقام
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+CODE_SPACE = len(CODE_ALPHABET) ** CODE_LENGTH  # 2,176,782,336 (أقل من 2^32)
+
+class QuizCodeAllocator:
+    """توليد كود الكويز من معرف صفه عبر تبديل مفتاحي (بدون استعلام للتحقق)
+    
+    معرف الصف يُحوَّل بشبكة Feistel مفتاحية على 32 بت مع cycle walking
+    إلى رقم آخر داخل مجال الأكواد، فالمعرفات المختلفة تعطي دائماً أكواداً مختلفة
+    مهما تعدد العمال، ولا يمكن تخمين الكود التالي دون معرفة المفتاح.
+    """
+    
+    ROUNDS = 4
+    # محاولات تجنب التعارض النادر مع الأكواد العشوائية القديمة
+    MAX_ATTEMPTS = 5
+    
+    def __init__(self, secret: bytes):
+        self._secret = secret
+    
+    def _round(self, value: int, round_num: int) -> int:
+        digest = hmac.new(self._secret, f"{round_num}:{value}".encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:2], 'big')
+    
+    def _permute32(self, value: int) -> int:
+        left, right = value >> 16, value & 0xFFFF
+        for round_num in range(self.ROUNDS):
+            left, right = right, left ^ self._round(right, round_num)
+        return (left << 16) | right
+    
+    def permute(self, number: int) -> int:
+        """تبديل تقابلي على المجال [0, CODE_SPACE)"""
+        value = number % CODE_SPACE
+        while True:
+            value = self._permute32(value)
+            if value < CODE_SPACE:
+                return value
+    
+    @staticmethod
+    def encode(value: int) -> str:
+        """تحويل رقم إلى كود من 6 رموز"""
+        chars = []
+        for _ in range(CODE_LENGTH):
+            value, index = divmod(value, len(CODE_ALPHABET))
+            chars.append(CODE_ALPHABET[index])
+        return ''.join(reversed(chars))
+    
+    def code_for(self, number: int, attempt: int = 0) -> str:
+        """كود المعرف number (المحاولات التالية تأخذ أرقاماً من أعلى المجال)
+        
+        أرقام المحاولات التالية لا تتداخل مع المعرفات ما دامت أقل من
+        CODE_SPACE / (MAX_ATTEMPTS + 1) (حوالي 360 مليون كويز)
+        """
+        if attempt:
+            number = CODE_SPACE - (number * self.MAX_ATTEMPTS + attempt)
+        return self.encode(self.permute(number))
+
+def _load_secret() -> bytes:
+    secret = os.getenv('QUIZ_CODE_SECRET', '')
+    if not secret:
+        logger.warning("⚠️ لم يتم العثور على QUIZ_CODE_SECRET، استخدام مفتاح عشوائي لهذه العملية")
+        return os.urandom(32)
+    return secret.encode()
+
+quiz_code_allocator = QuizCodeAllocator(_load_secret())
@@ -0,0 +1,187 @@
+import re
+import csv
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Tuple
+from models import Question
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'json', 'jsonl')
+MAX_IMPORT_QUESTIONS = 10000
+MAX_REPORTED_ERRORS = 20
+
+# أعمدة ملف CSV: question,type,answer,option_a,option_b,option_c,option_d
+OPTION_COLUMNS = ['option_a', 'option_b', 'option_c', 'option_d']
+
+_TYPE_ALIASES = {
+    'tf': 'tf', 'truefalse': 'tf', 'true_false': 'tf', 'صح/خطأ': 'tf',
+    'mcq': 'mcq', 'choice': 'mcq', 'اختيار': 'mcq'
+}
+_TF_ALIASES = {
+    't': 't', 'true': 't', 'صح': 't', '1': 't',
+    'f': 'f', 'false': 'f', 'خطأ': 'f', '0': 'f'
+}
+
+def _iter_rows(path: str, fmt: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """قراءة الصفوف واحداً تلو الآخر (CSV و JSONL دون تحميل الملف كاملاً)"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            for line_num, row in enumerate(csv.DictReader(f), start=2):
+                yield line_num, row
+        elif fmt == 'jsonl':
+            for line_num, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError:
+                    # سطر غير صالح لا يوقف قراءة بقية الملف
+                    yield line_num, None
+        else:
+            data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('questions', [])
+            for index, row in enumerate(data, start=1):
+                yield index, row
+
+def _field(row: Dict[str, Any], *names: str) -> str:
+    """أول قيمة غير فارغة من أسماء العمود البديلة كنص (false و 0 قيم صالحة)"""
+    for name in names:
+        value = row.get(name)
+        if value is not None and str(value).strip():
+            return str(value)
+    return ''
+
+def _build_question(row: Dict[str, Any], question_num: int) -> Question:
+    """تحويل صف خام إلى سؤال بالصيغة المخزنة"""
+    raw_type = _field(row, 'type', 'question_type')
+    question_type = _TYPE_ALIASES.get(raw_type.strip().lower(), '')
+    answer = _field(row, 'answer', 'correct_answer').strip().lower()
+    
+    options = row.get('options')
+    if options is None:
+        options = [row.get(column) for column in OPTION_COLUMNS]
+    options = [str(opt).strip() for opt in options if opt is not None and str(opt).strip()]
+    
+    if question_type == 'tf':
+        answer = _TF_ALIASES.get(answer, answer)
+        options = []
+    elif question_type == 'mcq':
+        # نفس صيغة الخيارات في المحادثة: "a) نص الخيار"
+        options = [f"{chr(97 + i)}) {opt}" for i, opt in enumerate(options)]
+    
+    return Question(
+        question_num=question_num,
+        question_text=_field(row, 'question', 'question_text').strip(),
+        question_type=question_type or raw_type,
+        correct_answer=answer,
+        options=options
+    )
+
+def parse_questions_file(path: str, fmt: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """تحليل ملف الأسئلة والتحقق منه وإرجاع (الأسئلة، الأخطاء)"""
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"صيغة غير مدعومة: {fmt}")
+    
+    questions = []
+    errors = []
+    try:
+        for line_num, row in _iter_rows(path, fmt):
+            if len(questions) >= MAX_IMPORT_QUESTIONS:
+                errors.append(f"الحد الأقصى {MAX_IMPORT_QUESTIONS} سؤال")
+                break
+            if not isinstance(row, dict):
+                errors.append(f"سطر {line_num}: صيغة غير صحيحة")
+                continue
+            if row.get('options') is not None and not isinstance(row['options'], list):
+                # النص لا يُقسم إلى حروف كخيارات منفصلة
+                errors.append(f"سطر {line_num}: الخيارات يجب أن تكون قائمة، مثال: [\"خيار 1\", \"خيار 2\"]")
+                continue
+            
+            question = _build_question(row, len(questions) + 1)
+            row_errors = question.validate()
+            if row_errors:
+                errors.append(f"سطر {line_num}: {'، '.join(row_errors)}")
+            else:
+                questions.append(question.to_dict())
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        errors.append(f"تعذر قراءة الملف: {e}")
+    
+    if not questions and not errors:
+        errors.append("الملف لا يحتوي على أسئلة")
+    return questions, errors
+
+# صيغة اللصق السريع لعدة أسئلة في رسالة واحدة:
+#   Q: نص سؤال الاختيار من متعدد
+#   A) خيار
+#   *B) الخيار الصحيح
+#   TF: نص عبارة صح/خطأ = T
+_BULK_START = re.compile(r'^\s*(Q|TF)\s*:', re.IGNORECASE)
+_MCQ_LINE = re.compile(r'^\s*Q\s*:\s*(.*)$', re.IGNORECASE)
+_OPTION_LINE = re.compile(r'^\s*(\*?)\s*([A-Da-d])\s*\)\s*(.*)$')
+_TF_LINE = re.compile(r'^\s*TF\s*:\s*(.*?)\s*=\s*(\S+)\s*$', re.IGNORECASE)
+
+def is_bulk_questions_text(text: str) -> bool:
+    """هل الرسالة مكتوبة بصيغة اللصق السريع؟"""
+    return bool(_BULK_START.match(text))
+
+def parse_questions_text(text: str, start_num: int = 1) -> Tuple[List[Question], List[str]]:
+    """تحليل عدة أسئلة من رسالة واحدة وإرجاع (الأسئلة، الأخطاء)"""
+    questions = []
+    errors = []
+    current = None  # (رقم السطر، نص السؤال، الخيارات، الإجابة الصحيحة)
+    
+    def close_mcq():
+        if current is None:
+            return
+        line_num, question_text, options, correct = current
+        question = Question(
+            question_num=start_num + len(questions),
+            question_text=question_text,
+            question_type='mcq',
+            correct_answer=correct,
+            options=options
+        )
+        question_errors = question.validate()
+        if question_errors:
+            errors.append(f"سطر {line_num}: {'، '.join(question_errors)}")
+        else:
+            questions.append(question)
+    
+    for line_num, line in enumerate(text.split('\n'), start=1):
+        if not line.strip():
+            continue
+        
+        tf_match = _TF_LINE.match(line)
+        mcq_match = _MCQ_LINE.match(line)
+        option_match = _OPTION_LINE.match(line)
+        
+        if tf_match:
+            close_mcq()
+            current = None
+            question = Question(
+                question_num=start_num + len(questions),
+                question_text=tf_match.group(1),
+                question_type='tf',
+                correct_answer=_TF_ALIASES.get(tf_match.group(2).lower(), tf_match.group(2).lower())
+            )
+            question_errors = question.validate()
+            if question_errors:
+                errors.append(f"سطر {line_num}: {'، '.join(question_errors)}")
+            else:
+                questions.append(question)
+        elif mcq_match:
+            close_mcq()
+            current = (line_num, mcq_match.group(1).strip(), [], '')
+        elif option_match and current is not None:
+            _, _, options, correct = current
+            label = chr(97 + len(options))
+            options.append(f"{label}) {option_match.group(3).strip()}")
+            if option_match.group(1):
+                current = current[:3] + (label,)
+        else:
+            errors.append(f"سطر {line_num}: سطر غير مفهوم")
+    
+    close_mcq()
+    return questions, errors
@@ -0,0 +1,102 @@
+import os
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from cache import TTLCache
+from models import Question
+import metrics
+
+# ذاكرة الأسئلة المجهزة للعرض: معرف الكويز -> (كائن الكويز، الأسئلة المجهزة)
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '512'))
+RENDER_CACHE_TTL = int(os.getenv('RENDER_CACHE_TTL', '3600'))
+
+render_cache = TTLCache(maxsize=RENDER_CACHE_SIZE, ttl=RENDER_CACHE_TTL)
+metrics.register('render_cache', render_cache.stats)
+
+class RenderedQuestion(NamedTuple):
+    """سؤال مجهز للعرض (غير قابل للتعديل ومشترك بين جميع جلسات الكويز)"""
+    question_num: int
+    text: str
+    reply_markup: InlineKeyboardMarkup
+    correct_answer: str
+    correct_display: str
+    answer_displays: Mapping[str, str]  # الإجابة -> نص العرض
+    feedback: Mapping[str, str]  # الإجابة -> رسالة النتيجة بعد الضغط
+
+def answer_display(answer: str) -> str:
+    """نص عرض الإجابة (صح/خطأ أو حرف الخيار)"""
+    return "صح" if answer == 't' else "خطأ" if answer == 'f' else answer.upper()
+
+def _render_question(question: Question, q_index: int, total: int) -> RenderedQuestion:
+    """تجهيز نص السؤال وأزراره ورسائل النتيجة مرة واحدة"""
+    question_num = q_index + 1
+    
+    # بناء نص السؤال
+    text = f"**السؤال {question_num}/{total}**\n\n"
+    text += f"{question.question_text}\n\n"
+    
+    if question.question_type == 'tf':
+        text += "اختر الإجابة الصحيحة:"
+        answers = ['t', 'f']
+        keyboard = [
+            [
+                InlineKeyboardButton("✅ صح", callback_data=f"student_answer_t_{q_index}"),
+                InlineKeyboardButton("❌ خطأ", callback_data=f"student_answer_f_{q_index}")
+            ]
+        ]
+    else:
+        text += "اختر الإجابة الصحيحة من الخيارات التالية:\n"
+        answers = []
+        keyboard = []
+        
+        for option in question.options[:4]:
+            # استخراج الحرف من بداية الخيار
+            opt_letter = option[0] if option else 'a'
+            opt_text = option[3:] if len(option) > 3 else option
+            answers.append(opt_letter)
+            keyboard.append([
+                InlineKeyboardButton(f"{opt_letter}) {opt_text}",
+                                    callback_data=f"student_answer_{opt_letter}_{q_index}")
+            ])
+    
+    correct_answer = question.correct_answer.lower()
+    correct_display = answer_display(correct_answer)
+    answer_displays = {answer: answer_display(answer) for answer in answers}
+    
+    feedback = {}
+    for answer, display in answer_displays.items():
+        is_correct = answer == correct_answer
+        feedback[answer] = (
+            f"{'✅' if is_correct else '❌'} **السؤال {question_num}**\n\n"
+            f"إجابتك: {display}\n"
+            f"{'✓ إجابة صحيحة' if is_correct else f'✗ الإجابة الصحيحة: {correct_display}'}\n\n"
+            f"⏳ جاري تحميل السؤال التالي..."
+        )
+    
+    return RenderedQuestion(
+        question_num=question_num,
+        text=text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        correct_answer=correct_answer,
+        correct_display=correct_display,
+        answer_displays=MappingProxyType(answer_displays),
+        feedback=MappingProxyType(feedback)
+    )
+
+def get_rendered_questions(quiz) -> Tuple[RenderedQuestion, ...]:
+    """أسئلة الكويز مجهزة للعرض، تُجهز مرة واحدة لكل نسخة محملة من الكويز
+    
+    عند إبطال الكويز أو إعادة تحميله يتغير كائنه فتُعاد التهيئة تلقائياً
+    """
+    cached = render_cache.get(quiz.id)
+    if cached is not None and cached[0] is quiz:
+        return cached[1]
+    
+    questions = quiz.questions or []
+    total = len(questions)
+    rendered = tuple(
+        _render_question(Question.from_dict(q_data), q_index, total)
+        for q_index, q_data in enumerate(questions)
+    )
+    render_cache.set(quiz.id, (quiz, rendered))
+    return rendered
@@ -0,0 +1,263 @@
+import os
+import logging
+import numpy as np
+from sqlalchemy import select, bindparam, func
+from database import (
+    SessionLocal, Quiz, StudentAttempt, AttemptAnswer,
+    invalidate_quiz, rebuild_quiz_stats, rebuild_quiz_stats_async, _run_in_executor
+)
+from models import Question
+
+logger = logging.getLogger(__name__)
+
+# عدد الصفوف المقروءة من قاعدة البيانات في كل دفعة
+REGRADE_FETCH_SIZE = int(os.getenv('REGRADE_FETCH_SIZE', '100000'))
+
+_attempts = StudentAttempt.__table__
+_answers = AttemptAnswer.__table__
+
+def _fetch_columns(db, statement, dtypes):
+    """قراءة نتيجة استعلام عموداً عموداً في مصفوفات NumPy على دفعات
+    
+    القراءة عبر مؤشر DBAPI مباشرة لتجنب إنشاء كائن Row لكل صف
+    """
+    connection = db.connection()
+    compiled = statement.compile(dialect=connection.dialect)
+    if connection.dialect.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    
+    chunks = [[] for _ in dtypes]
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(str(compiled), params)
+        while True:
+            rows = cursor.fetchmany(REGRADE_FETCH_SIZE)
+            if not rows:
+                break
+            for chunk, column, dtype in zip(chunks, zip(*rows), dtypes):
+                chunk.append(np.array(column, dtype=dtype))
+    finally:
+        cursor.close()
+    return [
+        np.concatenate(chunk) if chunk else np.empty(0, dtype=dtype)
+        for chunk, dtype in zip(chunks, dtypes)
+    ]
+
+def load_completed_attempts(db, quiz_id):
+    """المحاولات المنتهية للكويز كمصفوفات مرتبة بالمعرف: (المعرفات، عدد الأسئلة، الدرجات، النسب)"""
+    attempt_ids, totals, scores, percentages = _fetch_columns(db, select(
+        _attempts.c.id,
+        func.coalesce(_attempts.c.total_questions, 0),
+        func.coalesce(_attempts.c.score, 0),
+        func.coalesce(_attempts.c.percentage, 0)
+    ).where(
+        _attempts.c.quiz_id == quiz_id,
+        _attempts.c.is_completed == True
+    ), (np.int64, np.int64, np.int64, np.int64))
+    
+    order = np.argsort(attempt_ids)
+    return attempt_ids[order], totals[order], scores[order], percentages[order]
+
+def load_answer_matrix(db, quiz_id, attempt_ids, question_count):
+    """مصفوفة الطلاب×الأسئلة لإجابات المحاولات المنتهية
+    
+    كل خلية رمز حرف الإجابة (0 = بدون إجابة). عند تكرار الإجابة لنفس السؤال
+    تُعتمد الأخيرة كما في get_attempt_answers
+    """
+    answer_ids, answer_attempts, answer_nums, answer_values = _fetch_columns(db, select(
+        _answers.c.id,
+        _answers.c.attempt_id,
+        _answers.c.question_num,
+        func.lower(func.coalesce(_answers.c.answer, ''))
+    ).select_from(
+        _answers.join(_attempts, _attempts.c.id == _answers.c.attempt_id)
+    ).where(
+        _attempts.c.quiz_id == quiz_id,
+        _attempts.c.is_completed == True
+    ), (np.int64, np.int64, np.int64, 'S1'))
+    
+    # ترتيب الإجابات زمنياً ثم أخذ آخر إجابة لكل (محاولة، سؤال)
+    order = np.argsort(answer_ids, kind='stable')
+    attempt_index = np.searchsorted(attempt_ids, answer_attempts[order])
+    nums = answer_nums[order]
+    values = answer_values[order].view(np.uint8)
+    
+    # تجاهل إجابات محاولات انتهت بعد قراءة قائمة المحاولات أو أسئلة خارج النطاق
+    valid = (nums >= 1) & (nums <= question_count) & (attempt_index < len(attempt_ids))
+    valid[valid] &= attempt_ids[attempt_index[valid]] == answer_attempts[order][valid]
+    attempt_index, nums, values = attempt_index[valid], nums[valid], values[valid]
+    
+    pairs = attempt_index * (question_count + 1) + nums
+    _, last_reversed = np.unique(pairs[::-1], return_index=True)
+    last = len(pairs) - 1 - last_reversed
+    
+    matrix = np.zeros((len(attempt_ids), question_count), dtype=np.uint8)
+    matrix[attempt_index[last], nums[last] - 1] = values[last]
+    return matrix
+
+def answer_key_codes(questions):
+    """مفتاح الإجابات كمصفوفة رموز الحروف بترتيب الأسئلة"""
+    return np.array([ord(q['correct_answer'].lower()[:1] or ' ') for q in questions], dtype=np.uint8)
+
+def grade_answer_matrix(matrix, key_codes, totals):
+    """حساب الدرجات والنسب لجميع المحاولات في تمرير واحد"""
+    scores = (matrix == key_codes).sum(axis=1, dtype=np.int64)
+    
+    # نفس حساب complete_attempt: int((score / total) * 100)
+    safe_totals = np.where(totals > 0, totals, 1)
+    percentages = np.where(totals > 0, (scores / safe_totals * 100).astype(np.int64), 0)
+    return scores, percentages
+
+def change_answer_key(quiz_id, teacher_id, question_num, new_answer):
+    """تغيير مفتاح إجابة سؤال (سريعة، على خيط الكتابة)
+    
+    يُرجع (أسئلة الكويز الجديدة، كود الكويز) أو None عند الفشل. يزيد key_version
+    فالمحاولات التي تنتهي بعدها تُصحح بالمفتاح الجديد في complete_attempt
+    """
+    db = SessionLocal()
+    try:
+        quiz = db.query(Quiz).filter(
+            Quiz.id == quiz_id, Quiz.teacher_id == teacher_id
+        ).with_for_update().first()
+        if not quiz or not 1 <= question_num <= len(quiz.questions or []):
+            return None
+        
+        questions = list(quiz.questions)
+        updated = Question.from_dict({**questions[question_num - 1], 'correct_answer': new_answer.lower()})
+        if updated.validate():
+            return None
+        questions[question_num - 1] = updated.to_dict()
+        quiz.questions = questions
+        # المحاولات التي صُححت بإصدار أقدم يُعاد تصحيحها عند إنهائها
+        quiz.key_version = (quiz.key_version or 0) + 1
+        quiz_code = quiz.quiz_code
+        db.commit()
+        return questions, quiz_code
+    except Exception as e:
+        logger.error(f"❌ خطأ في تغيير مفتاح الإجابة: {e}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+def grade_completed_attempts(quiz_id, questions):
+    """إعادة تصحيح جميع المحاولات المنتهية بالمفتاح المعطى (قراءة فقط، خارج خيط الكتابة)
+    
+    يُرجع قاموس {'attempts', 'answers', 'changed'} حيث changed صفوف
+    {'b_id', 'b_score', 'b_percentage'} للمحاولات التي تغيرت درجتها، أو None عند الفشل
+    """
+    # القاعدة الأساسية لا نسخة القراءة: يجب أن تظهر كل محاولة انتهت قبل تغيير المفتاح
+    db = SessionLocal()
+    try:
+        attempt_ids, totals, old_scores, old_percentages = load_completed_attempts(db, quiz_id)
+        matrix = load_answer_matrix(db, quiz_id, attempt_ids, len(questions))
+    except Exception as e:
+        logger.error(f"❌ خطأ في قراءة محاولات الكويز لإعادة التصحيح: {e}")
+        return None
+    finally:
+        db.close()
+    
+    scores, percentages = grade_answer_matrix(matrix, answer_key_codes(questions), totals)
+    changed = np.nonzero((scores != old_scores) | (percentages != old_percentages))[0]
+    return {
+        'attempts': len(attempt_ids),
+        'answers': int(np.count_nonzero(matrix)),
+        'changed': [
+            {'b_id': attempt_id, 'b_score': score, 'b_percentage': percentage}
+            for attempt_id, score, percentage in zip(
+                attempt_ids[changed].tolist(),
+                scores[changed].tolist(),
+                percentages[changed].tolist()
+            )
+        ]
+    }
+
+def apply_regrade(quiz_id, questions, question_num, changed):
+    """كتابة نتائج إعادة التصحيح (على خيط الكتابة: أوامر UPDATE فقط)
+    
+    إذا تغير مفتاح الإجابات مرة أخرى منذ التصحيح تُتجاهل النتائج (True دون كتابة)
+    لأن إعادة التصحيح اللاحقة تغطيها
+    """
+    db = SessionLocal()
+    try:
+        current = db.query(Quiz.questions).filter(Quiz.id == quiz_id).with_for_update().scalar()
+        if not np.array_equal(answer_key_codes(current or []), answer_key_codes(questions)):
+            logger.info(f"✅ تم تجاوز نتائج إعادة تصحيح قديمة للكويز {quiz_id}")
+            db.rollback()
+            return True
+        
+        # تحديث المحاولات التي تغيرت درجتها فقط بأمر UPDATE واحد متعدد المعاملات
+        if changed:
+            db.execute(
+                _attempts.update().where(_attempts.c.id == bindparam('b_id')).values(
+                    score=bindparam('b_score'), percentage=bindparam('b_percentage')
+                ),
+                changed
+            )
+        
+        # تحديث صحة إجابات هذا السؤال في جميع محاولات الكويز
+        new_answer = questions[question_num - 1]['correct_answer']
+        db.execute(
+            _answers.update().where(
+                _answers.c.question_num == question_num,
+                _answers.c.attempt_id.in_(select(_attempts.c.id).where(_attempts.c.quiz_id == quiz_id))
+            ).values(is_correct=func.lower(_answers.c.answer) == new_answer)
+        )
+        db.commit()
+        return True
+    except Exception as e:
+        logger.error(f"❌ خطأ في حفظ نتائج إعادة التصحيح: {e}")
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+def _finish_regrade(quiz_id, question_num, graded):
+    """تسجيل النتيجة وإرجاع ملخص إعادة التصحيح"""
+    logger.info(
+        f"✅ إعادة تصحيح الكويز {quiz_id} (السؤال {question_num}): {graded['attempts']} محاولة، "
+        f"{len(graded['changed'])} تغيرت، {graded['answers']} إجابة"
+    )
+    return {'attempts': graded['attempts'], 'changed': len(graded['changed']), 'answers': graded['answers']}
+
+def regrade_quiz(quiz_id, teacher_id, question_num, new_answer):
+    """تصحيح مفتاح إجابة سؤال وإعادة تصحيح جميع المحاولات المنتهية دفعة واحدة
+    
+    يُرجع قاموس {'attempts', 'changed', 'answers'} أو None عند الفشل. إعادة
+    التنفيذ بنفس الإجابة آمنة وتكمل أي إعادة تصحيح لم تكتمل
+    """
+    changed_key = change_answer_key(quiz_id, teacher_id, question_num, new_answer)
+    if changed_key is None:
+        return None
+    questions, quiz_code = changed_key
+    invalidate_quiz(quiz_id=quiz_id, quiz_code=quiz_code)
+    
+    graded = grade_completed_attempts(quiz_id, questions)
+    if graded is None or not apply_regrade(quiz_id, questions, question_num, graded['changed']):
+        return None
+    rebuild_quiz_stats(quiz_id)
+    return _finish_regrade(quiz_id, question_num, graded)
+
+_change_answer_key_async = _run_in_executor(change_answer_key, write=True)
+_grade_completed_attempts_async = _run_in_executor(grade_completed_attempts)
+_apply_regrade_async = _run_in_executor(apply_regrade, write=True)
+
+async def regrade_quiz_async(quiz_id, teacher_id, question_num, new_answer):
+    """نسخة غير متزامنة من regrade_quiz: القراءة والتصحيح بـ NumPy خارج خيط الكتابة
+    
+    خيط الكتابة (في SQLite) يُشغل فقط لتغيير المفتاح ولأوامر UPDATE النهائية
+    فلا تنتظر خلفه كتابة الإجابات وبدء المحاولات طوال إعادة التصحيح
+    """
+    changed_key = await _change_answer_key_async(quiz_id, teacher_id, question_num, new_answer)
+    if changed_key is None:
+        return None
+    questions, quiz_code = changed_key
+    invalidate_quiz(quiz_id=quiz_id, quiz_code=quiz_code)
+    
+    graded = await _grade_completed_attempts_async(quiz_id, questions)
+    if graded is None or not await _apply_regrade_async(quiz_id, questions, question_num, graded['changed']):
+        return None
+    await rebuild_quiz_stats_async(quiz_id)
+    return _finish_regrade(quiz_id, question_num, graded)
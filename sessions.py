@@ -0,0 +1,311 @@
+import os
+import sys
+import time
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from database import (
+    load_student_session_async, save_student_session_async,
+    delete_student_session_async, delete_idle_student_sessions_async
+)
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# إنهاء الجلسة بعد N ثانية من الخمول، وحد أقصى لعدد الجلسات في الذاكرة
+SESSION_IDLE_TTL = int(os.getenv('SESSION_IDLE_TTL', '1800'))
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', '10000'))
+SESSION_SWEEP_INTERVAL = int(os.getenv('SESSION_SWEEP_INTERVAL', '60'))
+# مكان تخزين الجلسات: memory (عامل واحد) أو database (مشتركة وتبقى بعد إعادة التشغيل)
+# database تضيف كتابة مؤكدة في قاعدة البيانات مع كل ضغطة إجابة (save_student_session)
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()
+
+def _deep_sizeof(obj, seen):
+    """تقدير تقريبي لحجم الكائن وما يحتويه بالبايت"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _deep_sizeof(obj.__dict__, seen)
+    elif hasattr(obj, '__slots__'):
+        size += sum(_deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+class QuizSession:
+    """جلسة طالب مضغوطة: حرف الإجابة لكل سؤال في bytearray وصحتها في bitset
+    
+    الأسئلة نفسها لا تُخزن في الجلسة بل تُقرأ من نسخة الكويز المشتركة بمعرفه
+    """
+    
+    __slots__ = (
+        'quiz_id', 'quiz_code', 'quiz_title', 'attempt_id',
+        'current_question', 'total_questions', 'choices', 'correct', 'key_version', 'version'
+    )
+    
+    def __init__(self, quiz_id, quiz_code, quiz_title, attempt_id, total_questions,
+                 current_question=0, choices=None, correct=None, key_version=None, version=None):
+        self.quiz_id = quiz_id
+        self.quiz_code = quiz_code
+        self.quiz_title = quiz_title
+        self.attempt_id = attempt_id
+        self.total_questions = total_questions
+        self.current_question = current_question
+        # 0 = لم يُجب بعد، وإلا رمز حرف الإجابة
+        self.choices = choices if choices is not None else bytearray(total_questions)
+        self.correct = correct if correct is not None else bytearray((total_questions + 7) // 8)
+        # إصدار مفتاح الإجابات الذي صُححت به كل الإجابات (None = غير معروف أو مختلط)
+        self.key_version = key_version
+        self.version = version  # للكتابة بالمقارنة والتبديل في قاعدة البيانات
+    
+    def record_answer(self, q_index, answer, is_correct):
+        """تسجيل إجابة سؤال والانتقال للسؤال التالي"""
+        self.choices[q_index] = ord(answer)
+        mask = 1 << (q_index & 7)
+        if is_correct:
+            self.correct[q_index >> 3] |= mask
+        else:
+            self.correct[q_index >> 3] &= ~mask & 0xFF
+        self.current_question = q_index + 1
+    
+    def is_correct(self, q_index):
+        """هل إجابة السؤال صحيحة؟"""
+        return bool(self.correct[q_index >> 3] >> (q_index & 7) & 1)
+    
+    @property
+    def score(self):
+        """عدد الإجابات الصحيحة"""
+        return sum(bin(byte).count('1') for byte in self.correct)
+    
+    def answers(self):
+        """الإجابات المسجلة كـ (رقم السؤال، الإجابة، صحيحة؟)"""
+        for q_index, choice in enumerate(self.choices):
+            if choice:
+                yield q_index + 1, chr(choice), self.is_correct(q_index)
+    
+    def to_dict(self):
+        """تحويل الجلسة إلى قاموس JSON للتخزين"""
+        return {
+            'quiz_id': self.quiz_id,
+            'quiz_code': self.quiz_code,
+            'quiz_title': self.quiz_title,
+            'attempt_id': self.attempt_id,
+            'total_questions': self.total_questions,
+            'current_question': self.current_question,
+            'choices': self.choices.hex(),
+            'correct': self.correct.hex(),
+            'key_version': self.key_version
+        }
+    
+    @classmethod
+    def from_dict(cls, data, version=None):
+        """إنشاء جلسة من قاموس مخزن"""
+        return cls(
+            quiz_id=data['quiz_id'],
+            quiz_code=data['quiz_code'],
+            quiz_title=data['quiz_title'],
+            attempt_id=data['attempt_id'],
+            total_questions=data['total_questions'],
+            current_question=data['current_question'],
+            choices=bytearray.fromhex(data['choices']),
+            correct=bytearray.fromhex(data['correct']),
+            key_version=data.get('key_version'),
+            version=version
+        )
+
+class SessionStore:
+    """مخزن جلسات الطلاب محدود الحجم مع انتهاء الصلاحية عند الخمول (LRU + TTL)
+    
+    يُستخدم من حلقة الأحداث فقط لذلك لا يحتاج إلى قفل
+    """
+    
+    def __init__(self, maxsize=SESSION_MAX_COUNT, idle_ttl=SESSION_IDLE_TTL):
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self._data = OrderedDict()  # المستخدم -> (آخر استخدام، الجلسة)
+        
+        # المؤشرات
+        self.evictions = 0
+        self.expirations = 0
+        self.approx_bytes = 0
+    
+    def get(self, user_id):
+        """قراءة جلسة المستخدم وتجديد وقت خمولها"""
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        last_access, session = entry
+        now = time.monotonic()
+        if now - last_access > self.idle_ttl:
+            del self._data[user_id]
+            self.expirations += 1
+            return None
+        self._data[user_id] = (now, session)
+        self._data.move_to_end(user_id)
+        return session
+    
+    def set(self, user_id, session):
+        """تخزين جلسة مع إخراج الأقدم استخداماً عند امتلاء المخزن"""
+        self._data[user_id] = (time.monotonic(), session)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def pop(self, user_id):
+        """حذف جلسة المستخدم"""
+        entry = self._data.pop(user_id, None)
+        return entry[1] if entry else None
+    
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def sweep(self):
+        """حذف الجلسات الخاملة وتحديث تقدير الذاكرة المستخدمة"""
+        cutoff = time.monotonic() - self.idle_ttl
+        # الترتيب من الأقدم استخداماً، لذلك نتوقف عند أول جلسة نشطة
+        expired = []
+        for user_id, (last_access, _) in self._data.items():
+            if last_access > cutoff:
+                break
+            expired.append(user_id)
+        for user_id in expired:
+            del self._data[user_id]
+        self.expirations += len(expired)
+        
+        # الأسئلة المشتركة بين عدة جلسات تُحسب مرة واحدة
+        seen = set()
+        self.approx_bytes = sum(_deep_sizeof(session, seen) for _, session in self._data.values())
+        
+        if expired:
+            logger.info(f"✅ تم حذف {len(expired)} جلسة خاملة")
+        return len(expired)
+    
+    def stats(self):
+        """مؤشرات مخزن الجلسات"""
+        return {
+            'live': len(self._data),
+            'max_size': self.maxsize,
+            'evicted': self.evictions,
+            'expired': self.expirations,
+            'approx_bytes': self.approx_bytes
+        }
+
+class MemorySessionBackend:
+    """جلسات الطلاب في ذاكرة العملية فقط (تضيع عند إعادة التشغيل)"""
+    
+    def __init__(self, store=None):
+        self.store = store or SessionStore()
+    
+    async def load(self, user_id, fresh=False):
+        """قراءة جلسة الطالب"""
+        return self.store.get(user_id)
+    
+    async def save(self, user_id, session):
+        """حفظ جلسة الطالب"""
+        self.store.set(user_id, session)
+        return True
+    
+    async def delete(self, user_id):
+        """حذف جلسة الطالب"""
+        self.store.pop(user_id)
+    
+    async def sweep(self):
+        """حذف الجلسات الخاملة"""
+        return self.store.sweep()
+    
+    def stats(self):
+        """مؤشرات الجلسات"""
+        return self.store.stats()
+
+class DatabaseSessionBackend:
+    """جلسات الطلاب في قاعدة البيانات مع ذاكرة محلية للقراءات المتكررة
+    
+    الكتابة بالمقارنة والتبديل على رقم الإصدار، فإذا عدّل عامل آخر الجلسة
+    تفشل الكتابة وتُحذف النسخة المحلية ليعيد المعالج القراءة من قاعدة البيانات
+    """
+    
+    def __init__(self, cache=None):
+        self.cache = cache or SessionStore()
+        self.conflicts = 0
+        self.db_loads = 0
+    
+    async def load(self, user_id, fresh=False):
+        """قراءة جلسة الطالب من الذاكرة المحلية أو من قاعدة البيانات"""
+        if not fresh:
+            session = self.cache.get(user_id)
+            if session is not None:
+                return session
+        
+        self.db_loads += 1
+        row = await load_student_session_async(user_id)
+        if row is None:
+            self.cache.pop(user_id)
+            return None
+        data, version, updated_at = row
+        if updated_at and updated_at < datetime.now() - timedelta(seconds=self.cache.idle_ttl):
+            self.cache.pop(user_id)
+            return None
+        try:
+            session = QuizSession.from_dict(data, version)
+        except (KeyError, ValueError):
+            # جلسة بصيغة قديمة: تُعتبر منتهية
+            logger.warning(f"⚠️ جلسة الطالب {user_id} بصيغة غير معروفة، سيتم تجاهلها")
+            return None
+        self.cache.set(user_id, session)
+        return session
+    
+    async def save(self, user_id, session):
+        """حفظ جلسة الطالب (False عند تعارض الإصدار)"""
+        version = await save_student_session_async(user_id, session.to_dict(), session.version)
+        if version is None:
+            self.conflicts += 1
+            self.cache.pop(user_id)
+            return False
+        session.version = version
+        self.cache.set(user_id, session)
+        return True
+    
+    async def delete(self, user_id):
+        """حذف جلسة الطالب"""
+        self.cache.pop(user_id)
+        await delete_student_session_async(user_id)
+    
+    async def sweep(self):
+        """حذف الجلسات الخاملة من الذاكرة المحلية ومن قاعدة البيانات"""
+        self.cache.sweep()
+        cutoff = datetime.now() - timedelta(seconds=self.cache.idle_ttl)
+        deleted = await delete_idle_student_sessions_async(cutoff)
+        if deleted:
+            logger.info(f"✅ تم حذف {deleted} جلسة خاملة من قاعدة البيانات")
+        return deleted
+    
+    def stats(self):
+        """مؤشرات الجلسات"""
+        stats = self.cache.stats()
+        stats['conflicts'] = self.conflicts
+        stats['db_loads'] = self.db_loads
+        return stats
+
+def _create_session_backend(name):
+    """إنشاء مخزن الجلسات حسب الإعداد"""
+    if name == 'database':
+        return DatabaseSessionBackend()
+    if name != 'memory':
+        logger.warning(f"⚠️ SESSION_BACKEND غير معروف ({name})، سيتم استخدام الذاكرة")
+    return MemorySessionBackend()
+
+# مخزن جلسات الطلاب
+student_sessions = _create_session_backend(SESSION_BACKEND)
+metrics.register('student_sessions', student_sessions.stats)
+
+async def sweep_sessions_job(context):
+    """مهمة دورية في JobQueue لحذف الجلسات الخاملة"""
+    await student_sessions.sweep()
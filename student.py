@@ -1,19 +1,27 @@
 import logging
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes, ConversationHandler
+from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 from database import (
-    get_quiz_by_code, start_student_attempt, save_answer,
-    complete_attempt, get_student_attempts
+    get_quiz_by_code_async, get_quiz_by_id_async, start_student_attempt_async,
+    complete_attempt_async, get_student_history_async, invalidate_quiz
 )
-from models import Question
+from answer_buffer import answer_buffer
+from sessions import student_sessions, QuizSession
+from quiz_render import get_rendered_questions
+from analytics import record_completed_attempt
 
 logger = logging.getLogger(__name__)
 
 # حالات المحادثة للطالب
 ENTER_QUIZ_CODE, ANSWER_QUESTION, SHOW_RESULTS = range(3)
 
-# تخزين مؤقت لمحاولات الطلاب
-student_sessions = {}
+# عدد مرات إعادة المحاولة عند تعارض إصدار الجلسة
+SESSION_SAVE_RETRIES = 3
+
+# عدد المحاولات في كل صفحة من السجل
+HISTORY_PAGE_SIZE = 10
+_CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
 
 async def join_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """الانضمام إلى كويز باستخدام الكود"""
@@ -44,7 +52,7 @@ async def start_quiz_with_code(update: Update, context: ContextTypes.DEFAULT_TYP
     username = update.effective_user.username or update.effective_user.first_name
     
     # البحث عن الكويز
-    quiz = get_quiz_by_code(quiz_code)
+    quiz = await get_quiz_by_code_async(quiz_code)
     
     if not quiz:
         await update.message.reply_text(
@@ -64,24 +72,37 @@ async def start_quiz_with_code(update: Update, context: ContextTypes.DEFAULT_TYP
         return ConversationHandler.END
     
     # إنشاء محاولة جديدة
-    attempt = start_student_attempt(
+    attempt_id = await start_student_attempt_async(
         quiz_id=quiz.id,
         student_telegram_id=user_id,
         student_name=username
     )
     
-    # تخزين جلسة الطالب
-    student_sessions[user_id] = {
-        'quiz_id': quiz.id,
-        'quiz_code': quiz.quiz_code,
-        'quiz_title': quiz.title,
-        'attempt_id': attempt.id,
-        'current_question': 0,
-        'questions': quiz.questions,
-        'total_questions': len(quiz.questions),
-        'score': 0,
-        'answers': []
-    }
+    if attempt_id is None:
+        await update.message.reply_text(
+            "❌ **تعذر بدء الاختبار**\n\n"
+            "الرجاء المحاولة مرة أخرى بعد قليل.",
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
+    
+    # تخزين جلسة الطالب (الأسئلة تُقرأ من ذاكرة الكويزات عند الحاجة)
+    saved = await student_sessions.save(user_id, QuizSession(
+        quiz_id=quiz.id,
+        quiz_code=quiz.quiz_code,
+        quiz_title=quiz.title,
+        attempt_id=attempt_id,
+        total_questions=len(quiz.questions),
+        key_version=quiz.key_version
+    ))
+    
+    if not saved:
+        await update.message.reply_text(
+            "❌ **تعذر بدء الاختبار**\n\n"
+            "الرجاء المحاولة مرة أخرى بعد قليل.",
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
     
     # عرض معلومات الكويز
     await update.message.reply_text(
@@ -93,53 +114,32 @@ async def start_quiz_with_code(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode='Markdown'
     )
     
-    # إرسال أول سؤال
+    # إرسال أول سؤال؛ حالة الاختبار في مخزن الجلسات لا في المحادثة، فأزرار
+    # الإجابة تُعالج بمعالج مستقل يعمل بعد إعادة التشغيل ومن أي عامل
     await send_student_question(update, context, user_id)
-    return ANSWER_QUESTION
+    return ConversationHandler.END
 
 async def send_student_question(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """إرسال سؤال للطالب"""
-    session = student_sessions[user_id]
-    q_index = session['current_question']
+    session = await student_sessions.load(user_id)
+    if session is None:
+        return
+    q_index = session.current_question
     
-    if q_index >= session['total_questions']:
+    if q_index >= session.total_questions:
         await finish_student_quiz(update, context, user_id)
         return
     
-    question_data = session['questions'][q_index]
-    question = Question.from_dict(question_data)
-    question_num = q_index + 1
-    
-    # بناء نص السؤال
-    text = f"**السؤال {question_num}/{session['total_questions']}**\n\n"
-    text += f"{question.question_text}\n\n"
-    
-    if question.question_type == 'tf':
-        text += "اختر الإجابة الصحيحة:"
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ صح", callback_data=f"student_answer_t_{q_index}"),
-                InlineKeyboardButton("❌ خطأ", callback_data=f"student_answer_f_{q_index}")
-            ]
-        ]
-    else:
-        text += "اختر الإجابة الصحيحة من الخيارات التالية:\n"
-        keyboard = []
-        
-        for option in question.options[:4]:
-            # استخراج الحرف من بداية الخيار
-            opt_letter = option[0] if option else 'a'
-            opt_text = option[3:] if len(option) > 3 else option
-            keyboard.append([
-                InlineKeyboardButton(f"{opt_letter}) {opt_text}", 
-                                    callback_data=f"student_answer_{opt_letter}_{q_index}")
-            ])
+    quiz = await get_quiz_by_id_async(session.quiz_id)
+    if not quiz:
+        await update.effective_message.reply_text("❌ تعذر تحميل أسئلة الكويز. حاول مرة أخرى بعد قليل.")
+        return
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    rendered = get_rendered_questions(quiz)[q_index]
     
-    await update.message.reply_text(
-        text,
-        reply_markup=reply_markup,
+    await update.effective_message.reply_text(
+        rendered.text,
+        reply_markup=rendered.reply_markup,
         parse_mode='Markdown'
     )
 
@@ -150,12 +150,6 @@ async def handle_student_answer(update: Update, context: ContextTypes.DEFAULT_TY
     
     user_id = query.from_user.id
     
-    if user_id not in student_sessions:
-        await query.edit_message_text("❌ جلسة الاختبار منتهية. ابدأ من جديد بـ /join")
-        return
-    
-    session = student_sessions[user_id]
-    
     # استخراج البيانات
     data = query.data
     parts = data.split('_')
@@ -166,60 +160,81 @@ async def handle_student_answer(update: Update, context: ContextTypes.DEFAULT_TY
     answer = parts[2]
     q_index = int(parts[3])
     
-    # الحصول على السؤال
-    question_data = session['questions'][q_index]
-    question = Question.from_dict(question_data)
-    
-    # التحقق من الإجابة
-    is_correct = question.validate_answer(answer)
-    
-    if is_correct:
-        session['score'] += 1
-    
-    # حفظ الإجابة
-    session['answers'].append({
-        'question_num': q_index + 1,
-        'user_answer': answer,
-        'correct_answer': question.correct_answer,
-        'is_correct': is_correct
-    })
+    fresh = False
+    for _ in range(SESSION_SAVE_RETRIES):
+        session = await student_sessions.load(user_id, fresh=fresh)
+        if session is None:
+            await query.edit_message_text("❌ جلسة الاختبار منتهية. ابدأ من جديد بـ /join")
+            return
+        
+        if session.current_question != q_index:
+            # النسخة المحلية قد تكون قديمة إذا خدم عامل آخر هذا الطالب
+            if not fresh:
+                fresh = True
+                continue
+            # السؤال أُجيب عليه مسبقاً (ضغط مكرر)
+            return
+        
+        # الحصول على السؤال
+        quiz = await get_quiz_by_id_async(session.quiz_id)
+        if not quiz:
+            await query.edit_message_text("❌ تعذر تحميل أسئلة الكويز. حاول مرة أخرى بعد قليل.")
+            return
+        rendered = get_rendered_questions(quiz)[q_index]
+        if answer not in rendered.feedback:
+            return
+        
+        # التحقق من الإجابة
+        is_correct = answer == rendered.correct_answer
+        if quiz.key_version != session.key_version:
+            # نسخة الكويز تغيرت أثناء المحاولة: الإجابات صُححت بأكثر من مفتاح
+            session.key_version = None
+        
+        # حفظ الإجابة والانتقال للسؤال التالي
+        session.record_answer(q_index, answer, is_correct)
+        
+        if await student_sessions.save(user_id, session):
+            break
+        # تعارض: عامل آخر عدّل الجلسة، نعيد القراءة من قاعدة البيانات
+        fresh = True
+    else:
+        logger.warning(f"⚠️ تعذر حفظ جلسة الطالب {user_id} بعد {SESSION_SAVE_RETRIES} محاولات")
+        return
     
-    # حفظ في قاعدة البيانات
-    save_answer(
-        attempt_id=session['attempt_id'],
+    # حفظ في قاعدة البيانات (كتابة مؤجلة على دفعات)
+    answer_buffer.add(
+        attempt_id=session.attempt_id,
         question_num=q_index + 1,
         answer=answer,
         is_correct=is_correct
     )
     
     # عرض نتيجة الإجابة
-    emoji = "✅" if is_correct else "❌"
-    correct_display = "صح" if question.correct_answer == 't' else "خطأ" if question.correct_answer == 'f' else question.correct_answer.upper()
-    answer_display = "صح" if answer == 't' else "خطأ" if answer == 'f' else answer.upper()
-    
-    await query.edit_message_text(
-        f"{emoji} **السؤال {q_index + 1}**\n\n"
-        f"إجابتك: {answer_display}\n"
-        f"{'✓ إجابة صحيحة' if is_correct else f'✗ الإجابة الصحيحة: {correct_display}'}\n\n"
-        f"⏳ جاري تحميل السؤال التالي...",
-        parse_mode='Markdown'
-    )
-    
-    # الانتقال للسؤال التالي
-    session['current_question'] += 1
+    await query.edit_message_text(rendered.feedback[answer], parse_mode='Markdown')
     
+    # إرسال السؤال التالي
     await send_student_question(update, context, user_id)
 
 async def finish_student_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """إنهاء الكويز وعرض النتيجة"""
-    session = student_sessions[user_id]
+    session = await student_sessions.load(user_id)
+    if session is None:
+        return
     
-    score = session['score']
-    total = session['total_questions']
-    percentage = (score / total) * 100 if total > 0 else 0
+    total = session.total_questions
     
-    # تحديث قاعدة البيانات
-    complete_attempt(session['attempt_id'], score, total)
+    # تحديث قاعدة البيانات بعد حفظ جميع الإجابات المعلقة؛ تُعاد الدرجة هناك إذا تغير المفتاح
+    await answer_buffer.flush()
+    attempt = await complete_attempt_async(session.attempt_id, session.score, total, session.key_version)
+    score = attempt.score if attempt else session.score
+    percentage = (score / total) * 100 if total > 0 else 0
+    if attempt and score != session.score:
+        # تغير مفتاح الإجابات أثناء المحاولة: نسخة الكويز في هذا العامل قديمة
+        invalidate_quiz(quiz_id=session.quiz_id)
+    quiz = await get_quiz_by_id_async(session.quiz_id)
+    if attempt and quiz:
+        record_completed_attempt(quiz, session.attempt_id, session.choices)
+    rendered_questions = get_rendered_questions(quiz) if quiz else ()
     
     # تحديد المستوى
     if percentage >= 90:
@@ -234,7 +249,7 @@ async def finish_student_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE
     # بناء رسالة النتيجة
     result_text = (
         f"🎉 **تم الانتهاء من الاختبار!**\n\n"
-        f"📚 **الكويز:** {session['quiz_title']}\n"
+        f"📚 **الكويز:** {session.quiz_title}\n"
         f"📊 **نتيجتك:**\n"
         f"• الإجابات الصحيحة: {score}/{total}\n"
         f"• النسبة المئوية: {percentage:.1f}%\n"
@@ -242,7 +257,7 @@ async def finish_student_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     
     # عرض تفاصيل الإجابات (اختصاراً)
-    correct_count = sum(1 for a in session['answers'] if a['is_correct'])
+    correct_count = score
     wrong_count = total - correct_count
     
     result_text += (
@@ -251,14 +266,17 @@ async def finish_student_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"❌ خطأ: {wrong_count}\n\n"
     )
     
-    # عرض أول 3 أخطاء إن وجدت
-    wrong_answers = [a for a in session['answers'] if not a['is_correct']][:3]
+    # عرض أول 3 أخطاء إن وجدت (حسب مفتاح الإجابات الحالي)
+    wrong_answers = [
+        (question_num, answer) for question_num, answer, _ in session.answers()
+        if question_num <= len(rendered_questions) and answer != rendered_questions[question_num - 1].correct_answer
+    ][:3]
     if wrong_answers:
         result_text += "**⚠️ أسئلة تحتاج مراجعة:**\n"
-        for a in wrong_answers:
-            user_display = "صح" if a['user_answer'] == 't' else "خطأ" if a['user_answer'] == 'f' else a['user_answer'].upper()
-            correct_display = "صح" if a['correct_answer'] == 't' else "خطأ" if a['correct_answer'] == 'f' else a['correct_answer'].upper()
-            result_text += f"• سؤال {a['question_num']}: إجابتك ({user_display}) | الصحيحة ({correct_display})\n"
+        for question_num, answer in wrong_answers:
+            rendered = rendered_questions[question_num - 1]
+            user_display = rendered.answer_displays.get(answer, answer.upper())
+            result_text += f"• سؤال {question_num}: إجابتك ({user_display}) | الصحيحة ({rendered.correct_display})\n"
     
     keyboard = [
         [InlineKeyboardButton("📊 سجل المحاولات", callback_data="student_history")]
@@ -273,39 +291,76 @@ async def finish_student_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     
     # تنظيف الجلسة
-    del student_sessions[user_id]
+    await student_sessions.delete(user_id)
+
+def _encode_history_cursor(attempt):
+    """ترميز موضع المحاولة (completed_at, id) لاستخدامه في بيانات الزر"""
+    return f"{attempt.completed_at.strftime(_CURSOR_FORMAT)}_{attempt.id}"
+
+def _decode_history_cursor(value):
+    """فك ترميز موضع المحاولة"""
+    completed_at, attempt_id = value.split('_')
+    return datetime.strptime(completed_at, _CURSOR_FORMAT), int(attempt_id)
 
 async def student_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """عرض سجل محاولات الطالب"""
+    """عرض سجل محاولات الطالب مع التنقل بين الصفحات"""
     query = update.callback_query
-    await query.answer()
+    if query:
+        await query.answer()
     
-    user_id = query.from_user.id
+    user_id = update.effective_user.id
+    
+    # student_history_older_<cursor> أو student_history_newer_<cursor>
+    cursor = None
+    direction = 'older'
+    if query and query.data.startswith(('student_history_older_', 'student_history_newer_')):
+        parts = query.data.split('_', 3)
+        direction = parts[2]
+        cursor = _decode_history_cursor(parts[3])
     
-    attempts = get_student_attempts(user_id)
+    page = await get_student_history_async(user_id, cursor, direction, HISTORY_PAGE_SIZE)
+    attempts = page['attempts']
     
     if not attempts:
-        await query.edit_message_text(
+        text = (
             "📊 **لا توجد محاولات سابقة**\n\n"
-            "ابدأ بحل كويز جديد باستخدام /join",
-            parse_mode='Markdown'
+            "ابدأ بحل كويز جديد باستخدام /join"
         )
+        if query:
+            await query.edit_message_text(text, parse_mode='Markdown')
+        else:
+            await update.message.reply_text(text, parse_mode='Markdown')
         return
     
     text = "📊 **سجل المحاولات:**\n\n"
     
-    for attempt in attempts[:10]:  # آخر 10 محاولات
-        quiz = get_quiz_by_code(attempt.quiz_id)  # تحتاج دالة للحصول على الكويز
-        quiz_title = quiz.title if quiz else "كويز"
+    for attempt in attempts:
+        quiz_title = attempt.quiz_title or "كويز"
         
         text += f"**{quiz_title}**\n"
         text += f"📅 {attempt.completed_at.strftime('%Y-%m-%d %H:%M')}\n"
         text += f"✅ {attempt.score}/{attempt.total_questions} | {attempt.percentage:.1f}%\n\n"
     
-    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")]]
+    navigation = []
+    if page['has_newer']:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ الأحدث", callback_data=f"student_history_newer_{_encode_history_cursor(attempts[0])}"
+        ))
+    if page['has_older']:
+        navigation.append(InlineKeyboardButton(
+            "الأقدم ➡️", callback_data=f"student_history_older_{_encode_history_cursor(attempts[-1])}"
+        ))
+    
+    keyboard = []
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    if query:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
 def get_student_conv_handler():
     """الحصول على معالج محادثة الطالب"""
@@ -315,10 +370,13 @@ def get_student_conv_handler():
             MessageHandler(filters.Regex(r'^/join'), join_quiz)
         ],
         states={
-            ENTER_QUIZ_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_quiz_code)],
-            ANSWER_QUESTION: [CallbackQueryHandler(handle_student_answer, pattern="^student_answer_")]
+            ENTER_QUIZ_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_quiz_code)]
         },
         fallbacks=[
             CommandHandler("cancel", lambda u,c: ConversationHandler.END)
         ]
     )
+
+def get_student_answer_handler():
+    """معالج أزرار الإجابة خارج المحادثة (الحالة تُقرأ من مخزن الجلسات)"""
+    return CallbackQueryHandler(handle_student_answer, pattern="^student_answer_")
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# قاعدة بيانات SQLite مؤقتة لكل تشغيل للاختبارات (يجب ضبطها قبل استيراد database)
+_db_dir = tempfile.mkdtemp(prefix='quiz_bot_tests_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.pop('READ_DATABASE_URL', None)
+os.environ.setdefault('QUIZ_CODE_SECRET', 'tests')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
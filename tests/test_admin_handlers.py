@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+import pytest
+from telegram import CallbackQuery, Chat, Message, Update, User
+import admin
+import database
+from admin import get_admin_conv_handler
+from models import QuizBuilder, Question
+
+TEACHER = User(id=5, first_name='teacher', is_bot=False)
+CHAT = Chat(id=5, type='private')
+
+def _message(text):
+    return Message(message_id=1, date=datetime.datetime.now(), chat=CHAT, from_user=TEACHER, text=text)
+
+def _button(data):
+    return Update(update_id=1, callback_query=CallbackQuery(
+        id='1', from_user=TEACHER, chat_instance='chat', data=data, message=_message('x')
+    ))
+
+@pytest.mark.parametrize('data', [
+    'draft_resume', 'qtype_tf', 'answer_t', 'mcq_answer_b',
+    'quiz_add_another', 'quiz_delete_last', 'quiz_finish'
+])
+def test_draft_buttons_reach_conversation_without_state(data):
+    # بعد إعادة التشغيل لا توجد حالة محادثة؛ يجب أن تصل أزرار المسودة إلى معالج الاستعادة
+    assert get_admin_conv_handler().check_update(_button(data))
+
+@pytest.mark.parametrize('data', ['student_answer_a_0', 'admin_list_quizzes', 'student_history'])
+def test_other_buttons_are_not_taken(data):
+    assert not get_admin_conv_handler().check_update(_button(data))
+
+def test_text_without_state_is_not_taken():
+    # النص خارج المحادثة لا يمر بمعالج المعلم؛ متابعة المسودة تُعرض عبر /create و/start
+    assert not get_admin_conv_handler().check_update(Update(update_id=1, message=_message('hello')))
+
+def _question(num, text):
+    return Question(question_num=num, question_text=text, question_type='tf', correct_answer='t', options=[])
+
+def test_stale_local_draft_is_reloaded_not_overwritten():
+    teacher_id = 7901
+    
+    async def scenario():
+        # العامل A ينشئ المسودة بسؤالين ويحتفظ بنسختها في الذاكرة
+        builder = QuizBuilder()
+        admin.quiz_builders.set(teacher_id, builder)
+        builder.set_title('t')
+        builder.set_description('d')
+        builder.add_question(_question(1, 'a?'))
+        builder.add_question(_question(2, 's'))
+        assert await admin._save_draft(teacher_id, builder)
+        stale_version = builder.version
+        
+        # العامل B يضيف السؤال 3 إلى المسودة المحفوظة
+        other = QuizBuilder()
+        data = database.load_quiz_draft(teacher_id)
+        other.load_from_dict(data)
+        other.version = data['version']
+        other.mark_clean()
+        other.add_question(_question(3, 'b-only'))
+        assert database.save_quiz_draft(
+            teacher_id, questions=[other.questions[2].to_dict()], expected_version=other.version
+        )
+        
+        # كتابة مبنية على الإصدار القديم تُرفض
+        assert database.save_quiz_draft(
+            teacher_id, questions=[_question(3, 'lost').to_dict()], expected_version=stale_version
+        ) is None
+        
+        # الخطوة التالية في A تستعيد نسخة B بدلاً من استبدال سؤالها
+        builder = await admin._get_builder(teacher_id)
+        builder.add_question(_question(len(builder.questions) + 1, 'a-only question'))
+        assert await admin._save_draft(teacher_id, builder)
+    
+    asyncio.run(scenario())
+    texts = [question['question_text'] for question in database.load_quiz_draft(teacher_id)['questions']]
+    assert texts == ['a?', 's', 'b-only', 'a-only question']
+
+def test_cancel_discards_the_draft():
+    teacher_id = 7902
+    assert database.save_quiz_draft(teacher_id, header={'title': 't', 'description': '', 'pending': {}})
+    replies = []
+    
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+    
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=teacher_id),
+        message=SimpleNamespace(reply_text=reply_text)
+    )
+    state = asyncio.run(admin.cancel_quiz_creation(update, None))
+    
+    assert state == admin.ConversationHandler.END
+    assert database.load_quiz_draft(teacher_id) is None
+    assert replies
@@ -0,0 +1,36 @@
+import asyncio
+import analytics
+import database
+
+QUESTIONS = [
+    {'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []},
+    {'question_num': 2, 'question_text': 'q2', 'question_type': 'tf', 'correct_answer': 't', 'options': []},
+]
+
+def _complete(quiz, student_id, choices):
+    attempt_id = database.start_student_attempt(quiz.id, student_id, 'student')
+    for q_index, choice in enumerate(choices.decode()):
+        database.save_answer(attempt_id, q_index + 1, choice, choice == 't')
+    database.complete_attempt(attempt_id, choices.count(b't'), len(QUESTIONS), quiz.key_version)
+    return attempt_id
+
+def test_attempt_completed_during_first_load_is_counted(monkeypatch):
+    teacher = database.add_teacher(7401, 'analytics', 'Analytics Teacher')
+    quiz = database.create_quiz(teacher.id, 'analytics', '', QUESTIONS)
+    _complete(quiz, 40001, b'tt')
+    
+    compute = analytics.compute_item_stats_async
+    
+    async def compute_then_complete(quiz_id, questions):
+        # محاولة تنتهي بعد قراءة قاعدة البيانات وقبل تخزين التحليل
+        loaded = await compute(quiz_id, questions)
+        attempt_id = _complete(quiz, 40002, b'tf')
+        analytics.record_completed_attempt(quiz, attempt_id, b'tf')
+        return loaded
+    
+    monkeypatch.setattr(analytics, 'compute_item_stats_async', compute_then_complete)
+    report = asyncio.run(analytics.get_item_analysis(quiz))
+    
+    assert report['attempts'] == 2
+    assert [question['p_value'] for question in report['questions']] == [1.0, 0.5]
+    assert not analytics._pending_attempts
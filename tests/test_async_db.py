@@ -0,0 +1,48 @@
+import time
+import asyncio
+from contextlib import contextmanager
+from sqlalchemy import event
+import database
+
+LATENCY_SECONDS = 0.02
+CONCURRENT_CALLS = 32
+
+@contextmanager
+def statement_latency(engine, seconds):
+    """تأخير كل استعلام لمحاكاة زمن رحلة قاعدة بيانات بعيدة"""
+    def sleep(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(seconds)
+    event.listen(engine, 'before_cursor_execute', sleep)
+    try:
+        yield
+    finally:
+        event.remove(engine, 'before_cursor_execute', sleep)
+
+def test_async_calls_overlap_database_latency():
+    async def lookups():
+        loop = asyncio.get_running_loop()
+        ticks = 0
+        
+        async def ticker():
+            # حلقة الأحداث يجب أن تبقى حرة أثناء انتظار قاعدة البيانات
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(LATENCY_SECONDS / 4)
+                ticks += 1
+        
+        ticking = asyncio.create_task(ticker())
+        start = loop.time()
+        results = await asyncio.gather(*(
+            database.get_student_attempts_async(50000 + i) for i in range(CONCURRENT_CALLS)
+        ))
+        elapsed = loop.time() - start
+        ticking.cancel()
+        return results, elapsed, ticks
+    
+    with statement_latency(database.engine, LATENCY_SECONDS):
+        results, elapsed, ticks = asyncio.run(lookups())
+    
+    assert results == [[]] * CONCURRENT_CALLS
+    serial = CONCURRENT_CALLS * LATENCY_SECONDS
+    assert elapsed < serial / 2
+    assert ticks > 0
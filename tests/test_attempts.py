@@ -0,0 +1,41 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+QUESTIONS = [{'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []}]
+PARALLEL_JOINS = 300
+
+def _total_students(quiz_id):
+    database.invalidate_quiz(quiz_id=quiz_id)
+    return database.get_quiz_by_id(quiz_id).total_students
+
+def test_parallel_joins_count_exactly():
+    teacher = database.add_teacher(7201, 'joins', 'Joins Teacher')
+    quiz = database.create_quiz(teacher.id, 'parallel joins', '', QUESTIONS)
+    
+    async def join_all():
+        return await asyncio.gather(*(
+            database.start_student_attempt_async(quiz.id, 10000 + i, f'student {i}')
+            for i in range(PARALLEL_JOINS)
+        ))
+    
+    attempt_ids = asyncio.run(join_all())
+    
+    assert None not in attempt_ids
+    assert len(set(attempt_ids)) == PARALLEL_JOINS
+    assert _total_students(quiz.id) == PARALLEL_JOINS
+
+def test_parallel_joins_from_threads_count_exactly():
+    # بدون خيط الكتابة الموحد: الزيادة الذرية في قاعدة البيانات وحدها تضمن الدقة
+    teacher = database.add_teacher(7202, 'threads', 'Threads Teacher')
+    quiz = database.create_quiz(teacher.id, 'threaded joins', '', QUESTIONS)
+    
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        attempt_ids = list(pool.map(
+            lambda i: database.start_student_attempt(quiz.id, 20000 + i, f'student {i}'),
+            range(PARALLEL_JOINS)
+        ))
+    
+    assert None not in attempt_ids
+    assert len(set(attempt_ids)) == PARALLEL_JOINS
+    assert _total_students(quiz.id) == PARALLEL_JOINS
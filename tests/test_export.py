@@ -0,0 +1,44 @@
+import gzip
+import tempfile
+import pytest
+import database
+import export
+
+QUESTIONS = [{'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []}]
+
+@pytest.fixture
+def export_dir(tmp_path, monkeypatch):
+    # ملفات التصدير المؤقتة في مجلد الاختبار للتحقق من عدم بقاء ملفات ناقصة
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def quiz():
+    teacher = database.add_teacher(7801, 'export', 'Export Teacher')
+    quiz = database.create_quiz(teacher.id, 'export', '', QUESTIONS)
+    attempt_id = database.start_student_attempt(quiz.id, 80001, 'student')
+    database.save_answer(attempt_id, 1, 't', True)
+    database.complete_attempt(attempt_id, 1, len(QUESTIONS), quiz.key_version)
+    return quiz
+
+def test_large_export_is_gzipped(export_dir, quiz, monkeypatch):
+    monkeypatch.setattr(export, 'MAX_DOCUMENT_BYTES', 0)
+    path, count = export.export_quiz_results(quiz.id, 'jsonl')
+    
+    assert count == 1
+    assert path.endswith('.jsonl.gz')
+    assert [str(p) for p in export_dir.iterdir()] == [path]
+    with gzip.open(path, 'rt', encoding='utf-8') as output:
+        assert '"student_name": "student"' in output.read()
+
+def test_failed_compression_leaves_no_files(export_dir, quiz, monkeypatch):
+    def fail_midway(source, target):
+        target.write(source.read(10))
+        raise OSError('No space left on device')
+    
+    monkeypatch.setattr(export, 'MAX_DOCUMENT_BYTES', 0)
+    monkeypatch.setattr(export.shutil, 'copyfileobj', fail_midway)
+    with pytest.raises(OSError):
+        export.export_quiz_results(quiz.id, 'csv')
+    
+    assert list(export_dir.iterdir()) == []
@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from sqlalchemy import event, inspect
+import database
+
+@contextmanager
+def captured_selects(engine):
+    """جمع استعلامات SELECT المنفذة مع معاملاتها"""
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+def query_plans(call):
+    """خطط EXPLAIN QUERY PLAN لكل استعلام SELECT تنفذه الدالة"""
+    with captured_selects(database.engine) as statements:
+        call()
+    with database.engine.connect() as connection:
+        return [
+            ' | '.join(row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters))
+            for statement, parameters in statements
+        ]
+
+def _populate():
+    teacher = database.add_teacher(7501, 'plans', 'Plans Teacher')
+    questions = [{'question_num': 1, 'question_text': 'q', 'question_type': 'tf', 'correct_answer': 't', 'options': []}]
+    quizzes = [database.create_quiz(teacher.id, f'plans {i}', '', questions) for i in range(20)]
+    rows = [
+        {
+            'quiz_id': quizzes[i % len(quizzes)].id, 'student_telegram_id': 60000 + i % 500,
+            'student_name': 's', 'is_completed': i % 3 != 0, 'score': i % 2,
+            'total_questions': 1, 'percentage': (i % 2) * 100
+        }
+        for i in range(5000)
+    ]
+    with database.engine.begin() as connection:
+        connection.execute(database.StudentAttempt.__table__.insert(), rows)
+        connection.exec_driver_sql('ANALYZE')
+    return teacher, quizzes[0]
+
+def test_hot_queries_use_index_range_plans():
+    teacher, quiz = _populate()
+    expected = {
+        'ix_quizzes_teacher_active_created': lambda: database.get_teacher_quizzes(teacher.id),
+        'ix_attempts_student_completed': lambda: database.get_student_history(60001),
+        'ix_attempts_quiz_completed': lambda: database.rebuild_quiz_stats(quiz.id),
+    }
+    for index_name, call in expected.items():
+        plans = [plan for plan in query_plans(call) if index_name in plan]
+        assert plans, f'{index_name} not used'
+        for plan in plans:
+            assert plan.startswith('SEARCH'), plan
+            assert 'TEMP B-TREE' not in plan, plan
+    
+    # get_student_attempts مرتبة حسب completed_at من الفهرس نفسه
+    plans = query_plans(lambda: database.get_student_attempts(60001))
+    assert plans == ['SEARCH student_attempts USING INDEX ix_attempts_student_completed (student_telegram_id=? AND is_completed=?)']
+
+def test_migrate_restores_missing_indexes():
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql('DROP INDEX ix_attempts_quiz_completed')
+    database.migrate()
+    database.migrate()
+    
+    index_names = {index['name'] for index in inspect(database.engine).get_indexes('student_attempts')}
+    assert 'ix_attempts_quiz_completed' in index_names
@@ -0,0 +1,72 @@
+import asyncio
+from contextlib import contextmanager
+from sqlalchemy import event
+import database
+from cache import TTLCache
+
+QUESTIONS = [{'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []}]
+
+def _quiz_selects(statements):
+    return [statement for statement in statements if statement.startswith('SELECT') and 'FROM quizzes' in statement]
+
+@contextmanager
+def captured_statements(engine):
+    """جمع أوامر SQL المنفذة على المحرك"""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def test_load_invalidated_midway_is_not_cached():
+    teacher = database.add_teacher(7601, 'cache', 'Cache Teacher')
+    quiz = database.create_quiz(teacher.id, 'cached', '', QUESTIONS)
+    database.invalidate_quiz(quiz_id=quiz.id, quiz_code=quiz.quiz_code)
+    
+    def invalidate_during_read(conn, cursor, statement, parameters, context, executemany):
+        # تعديل من عامل آخر يُؤكد ويُبطل الكويز بينما القراءة جارية
+        if statement.startswith('SELECT') and 'FROM quizzes' in statement:
+            database.invalidate_quiz(quiz_id=quiz.id, quiz_code=quiz.quiz_code)
+    
+    stale_loads = database.quiz_cache.stale_loads
+    event.listen(database.engine, 'before_cursor_execute', invalidate_during_read)
+    try:
+        loaded = asyncio.run(database.get_quiz_by_code_async(quiz.quiz_code))
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', invalidate_during_read)
+    
+    assert loaded.id == quiz.id
+    assert database.quiz_cache.get(('code', quiz.quiz_code)) is None
+    assert database.quiz_cache.get(('id', quiz.id)) is None
+    assert database.quiz_cache.stale_loads == stale_loads + 1
+    
+    # تحميل بدون إبطال يُخزن كالمعتاد
+    database.get_quiz_by_code(quiz.quiz_code)
+    assert database.quiz_cache.get(('id', quiz.id)).id == quiz.id
+
+def test_unknown_code_is_cached_briefly():
+    with captured_statements(database.engine) as statements:
+        assert database.get_quiz_by_code('NOPE42') is None
+        assert asyncio.run(database.get_quiz_by_code_async('nope42')) is None
+        assert len(_quiz_selects(statements)) == 1
+        
+        database.invalidate_quiz(quiz_code='NOPE42')
+        assert database.get_quiz_by_code('NOPE42') is None
+        assert len(_quiz_selects(statements)) == 2
+
+def test_finish_load_drops_result_after_pop():
+    cache = TTLCache(maxsize=4, ttl=60)
+    generation = cache.begin_load('key')
+    cache.pop('key')
+    assert not cache.finish_load('key', generation, 'old value')
+    assert cache.get('key') is None
+    
+    generation = cache.begin_load('key')
+    assert cache.finish_load('key', generation, 'new value')
+    assert cache.get('key') == 'new value'
+    assert not cache._loads
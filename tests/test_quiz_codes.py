@@ -0,0 +1,42 @@
+import database
+from database import SessionLocal, Quiz
+from quiz_codes import quiz_code_allocator, CODE_ALPHABET, CODE_LENGTH
+
+def test_codes_are_distinct_for_distinct_ids():
+    codes = {quiz_code_allocator.code_for(number) for number in range(1, 20001)}
+    assert len(codes) == 20000
+    assert all(len(code) == CODE_LENGTH and set(code) <= set(CODE_ALPHABET) for code in codes)
+
+def test_fallback_codes_do_not_overlap_primary_codes():
+    primary = {quiz_code_allocator.code_for(number) for number in range(1, 5001)}
+    fallback = {
+        quiz_code_allocator.code_for(number, attempt)
+        for number in range(1, 5001)
+        for attempt in range(1, quiz_code_allocator.MAX_ATTEMPTS)
+    }
+    assert not primary & fallback
+
+def test_create_quiz_derives_code_from_row_id():
+    teacher = database.add_teacher(7101, 'codes', 'Codes Teacher')
+    quiz = database.create_quiz(teacher.id, 'derived', '', [])
+    assert quiz.quiz_code == quiz_code_allocator.code_for(quiz.id)
+    assert database.get_quiz_by_code(quiz.quiz_code).id == quiz.id
+
+def test_create_quiz_skips_code_taken_by_legacy_quiz():
+    teacher = database.add_teacher(7102, 'legacy', 'Legacy Teacher')
+    
+    # كويز قديم بكود عشوائي يصادف الكود المشتق من المعرف التالي
+    db = SessionLocal()
+    try:
+        legacy = Quiz(teacher_id=teacher.id, quiz_code='LEGACY', title='legacy', questions=[])
+        db.add(legacy)
+        db.flush()
+        legacy.quiz_code = quiz_code_allocator.code_for(legacy.id + 1)
+        db.commit()
+    finally:
+        db.close()
+    
+    quiz = database.create_quiz(teacher.id, 'after legacy', '', [])
+    assert quiz is not None
+    assert quiz.id == legacy.id + 1
+    assert quiz.quiz_code == quiz_code_allocator.code_for(quiz.id, 1)
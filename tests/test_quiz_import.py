@@ -0,0 +1,44 @@
+import json
+import pytest
+from quiz_import import parse_questions_file
+
+def _write_json(tmp_path, rows):
+    path = tmp_path / 'questions.json'
+    path.write_text(json.dumps(rows), encoding='utf-8')
+    return str(path)
+
+@pytest.mark.parametrize('answer, expected', [
+    (False, 'f'), (0, 'f'), ('false', 'f'),
+    (True, 't'), (1, 't'), ('T', 't'),
+])
+def test_tf_answers_accept_json_booleans_and_numbers(tmp_path, answer, expected):
+    path = _write_json(tmp_path, [{'question': 'stmt', 'type': 'tf', 'answer': answer}])
+    questions, errors = parse_questions_file(path, 'json')
+    assert errors == []
+    assert questions[0]['correct_answer'] == expected
+
+def test_alias_columns_fall_back_when_primary_missing(tmp_path):
+    path = _write_json(tmp_path, [{
+        'question_text': 'pick', 'question_type': 'mcq', 'correct_answer': 'B',
+        'options': ['one', 'two']
+    }])
+    questions, errors = parse_questions_file(path, 'json')
+    assert errors == []
+    assert questions[0]['correct_answer'] == 'b'
+    assert questions[0]['options'] == ['a) one', 'b) two']
+
+def test_missing_answer_is_reported(tmp_path):
+    path = _write_json(tmp_path, [{'question': 'stmt', 'type': 'tf'}])
+    questions, errors = parse_questions_file(path, 'json')
+    assert questions == []
+    assert len(errors) == 1
+
+@pytest.mark.parametrize('options', ['abcd', {'a': 'one'}, 3])
+def test_options_must_be_a_list(tmp_path, options):
+    path = _write_json(tmp_path, [
+        {'question': 'pick', 'type': 'mcq', 'answer': 'a', 'options': options},
+        {'question': 'pick', 'type': 'mcq', 'answer': 'a', 'options': ['one', 'two']},
+    ])
+    questions, errors = parse_questions_file(path, 'json')
+    assert len(questions) == 1
+    assert errors == ['سطر 1: الخيارات يجب أن تكون قائمة، مثال: ["خيار 1", "خيار 2"]']
@@ -0,0 +1,37 @@
+import asyncio
+import database
+import regrade
+
+QUESTIONS = [
+    {'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []},
+    {'question_num': 2, 'question_text': 'q2', 'question_type': 'tf', 'correct_answer': 't', 'options': []},
+]
+
+def _attempt(attempt_id):
+    db = database.SessionLocal()
+    try:
+        return db.query(database.StudentAttempt).get(attempt_id)
+    finally:
+        db.close()
+
+def test_regrade_covers_completed_and_in_progress_attempts():
+    teacher = database.add_teacher(7301, 'regrade', 'Regrade Teacher')
+    quiz = database.create_quiz(teacher.id, 'regrade', '', QUESTIONS)
+    
+    # محاولة منتهية قبل تصحيح المفتاح وأخرى بدأت قبله وتنتهي بعده
+    finished = database.start_student_attempt(quiz.id, 30001, 'finished')
+    database.save_answer(finished, 1, 't', True)
+    database.save_answer(finished, 2, 'f', False)
+    database.complete_attempt(finished, 1, len(QUESTIONS), quiz.key_version)
+    in_progress = database.start_student_attempt(quiz.id, 30002, 'in progress')
+    database.save_answer(in_progress, 1, 't', True)
+    database.save_answer(in_progress, 2, 'f', False)
+    
+    result = asyncio.run(regrade.regrade_quiz_async(quiz.id, teacher.id, 2, 'f'))
+    assert result == {'attempts': 1, 'changed': 1, 'answers': 2}
+    assert _attempt(finished).score == 2
+    
+    # نقاط الجلسة حُسبت بالمفتاح القديم (1)، لكن الدرجة النهائية بالمفتاح الحالي
+    database.complete_attempt(in_progress, 1, len(QUESTIONS), quiz.key_version)
+    assert _attempt(in_progress).score == 2
+    assert all(answer['is_correct'] for answer in database.get_attempt_answers(in_progress).values())
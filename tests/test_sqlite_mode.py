@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from sqlalchemy import event
+import database
+
+QUESTIONS = [{'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []}]
+
+def test_sqlite_connections_use_wal_and_busy_timeout():
+    with database.engine.connect() as connection:
+        pragma = lambda name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1  # NORMAL
+        assert pragma('busy_timeout') == database.SQLITE_BUSY_TIMEOUT_MS
+
+def test_concurrent_writes_run_on_the_single_writer_thread():
+    teacher = database.add_teacher(7701, 'writer', 'Writer Teacher')
+    quiz = database.create_quiz(teacher.id, 'writer', '', QUESTIONS)
+    attempt_ids = [database.start_student_attempt(quiz.id, 70000 + i, 's') for i in range(50)]
+    
+    writer_threads = set()
+    
+    def record_thread(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO attempt_answers'):
+            writer_threads.add(threading.current_thread().name)
+    
+    async def answer_all():
+        return await asyncio.gather(*(
+            database.save_answer_async(attempt_id, question_num, 't', True)
+            for attempt_id in attempt_ids for question_num in range(1, 5)
+        ), *(database.get_quiz_statistics_async(quiz.id) for _ in range(50)))
+    
+    event.listen(database.engine, 'before_cursor_execute', record_thread)
+    try:
+        results = asyncio.run(answer_all())
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', record_thread)
+    
+    assert all(results[:200])
+    assert len(writer_threads) == 1 and writer_threads.pop().startswith('db-writer')
+
+def test_cached_teacher_does_not_queue_on_the_writer(monkeypatch):
+    database.add_teacher(7702, 'cached', 'Cached Teacher')
+    submitted = []
+    submit = database._db_write_executor.submit
+    
+    def recording_submit(*args, **kwargs):
+        submitted.append(args)
+        return submit(*args, **kwargs)
+    
+    monkeypatch.setattr(database._db_write_executor, 'submit', recording_submit)
+    
+    async def clicks():
+        for _ in range(20):
+            assert await database.add_teacher_async(7702, 'cached', 'Cached Teacher')
+    
+    asyncio.run(clicks())
+    assert submitted == []
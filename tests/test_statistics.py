@@ -0,0 +1,136 @@
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+import database
+
+QUESTIONS = [
+    {'question_num': 1, 'question_text': 'q1', 'question_type': 'tf', 'correct_answer': 't', 'options': []},
+    {'question_num': 2, 'question_text': 'q2', 'question_type': 'tf', 'correct_answer': 'f', 'options': []},
+]
+
+@contextmanager
+def count_statements(engine):
+    """عد أوامر SQL المنفذة على المحرك"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+def test_quizzes_statistics_single_query():
+    teacher = database.add_teacher(7001, 'stats', 'Stats Teacher')
+    quiz_ids = [database.create_quiz(teacher.id, f'quiz {i}', '', QUESTIONS).id for i in range(200)]
+    
+    # محاولات منتهية لبعض الكويزات فقط؛ الباقي بدون ملخص
+    for quiz_id, score in zip(quiz_ids[:5], [0, 1, 2, 1, 2]):
+        attempt_id = database.start_student_attempt(quiz_id, 9000 + quiz_id, 'student')
+        database.complete_attempt(attempt_id, score, len(QUESTIONS), 0)
+    
+    with count_statements(database.read_engine) as statements:
+        all_stats = database.get_quizzes_statistics(quiz_ids)
+    
+    assert len(statements) == 1
+    assert set(all_stats) == set(quiz_ids[:5])
+    assert all_stats[quiz_ids[2]]['max_score'] == 2
+    assert all_stats[quiz_ids[0]] == database.get_quiz_statistics(quiz_ids[0])
+
+def test_quizzes_statistics_empty_ids_no_query():
+    with count_statements(database.read_engine) as statements:
+        assert database.get_quizzes_statistics([]) == {}
+    assert statements == []
+
+def test_completion_survives_concurrent_stats_row_insert():
+    teacher = database.add_teacher(7002, 'race', 'Race Teacher')
+    quiz = database.create_quiz(teacher.id, 'stats race', '', QUESTIONS)
+    with database.engine.begin() as connection:
+        connection.execute(database.QuizStats.__table__.delete().where(database.QuizStats.quiz_id == quiz.id))
+    attempt_id = database.start_student_attempt(quiz.id, 9500, 'student')
+    
+    inserted = []
+    
+    def competing_insert(conn, cursor, statement, parameters, context, executemany):
+        # محاولة أخرى تنتهي وتُنشئ صف الملخص قبل إدراج هذه المحاولة مباشرة
+        if statement.startswith('INSERT INTO quiz_stats') and not inserted:
+            inserted.append(True)
+            with database.engine.begin() as other:
+                other.execute(database.QuizStats.__table__.insert(), {
+                    'quiz_id': quiz.id, 'total_attempts': 1, 'score_sum': 2, 'score_sq_sum': 4,
+                    'percentage_sum': 100, 'min_score': 2, 'max_score': 2, 'score_histogram': {'2': 1}
+                })
+    
+    event.listen(database.engine, 'before_cursor_execute', competing_insert)
+    try:
+        attempt = database.complete_attempt(attempt_id, 0, len(QUESTIONS), quiz.key_version)
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', competing_insert)
+    
+    assert inserted
+    assert attempt is not None and attempt.is_completed
+    stats = database.get_quiz_statistics(quiz.id)
+    assert stats['total_attempts'] == 2
+    assert stats['min_score'] == 0 and stats['max_score'] == 2
+
+def test_rebuild_keeps_attempt_completed_during_aggregation():
+    teacher = database.add_teacher(7003, 'rebuild', 'Rebuild Teacher')
+    quiz = database.create_quiz(teacher.id, 'rebuild race', '', QUESTIONS)
+    first = database.start_student_attempt(quiz.id, 9600, 'student')
+    database.complete_attempt(first, 2, len(QUESTIONS), quiz.key_version)
+    second = database.start_student_attempt(quiz.id, 9601, 'student')
+    
+    workers = []
+    
+    def complete_during_rebuild(conn, cursor, statement, parameters, context, executemany):
+        # محاولة تنتهي بين جمع المجاميع وكتابة الملخص الجديد
+        if 'GROUP BY student_attempts.quiz_id, student_attempts.score' in statement and not workers:
+            worker = threading.Thread(
+                target=database.complete_attempt, args=(second, 0, len(QUESTIONS), quiz.key_version)
+            )
+            workers.append(worker)
+            worker.start()
+            worker.join(0.3)
+    
+    event.listen(database.engine, 'before_cursor_execute', complete_during_rebuild)
+    try:
+        assert database.rebuild_quiz_stats(quiz.id) == 1
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', complete_during_rebuild)
+    workers[0].join()
+    
+    stats = database.get_quiz_statistics(quiz.id)
+    assert stats['total_attempts'] == 2
+    assert stats['min_score'] == 0 and stats['max_score'] == 2
+
+def test_completion_with_current_key_trusts_session_score():
+    teacher = database.add_teacher(7004, 'hot', 'Hot Path Teacher')
+    quiz = database.create_quiz(teacher.id, 'hot path', '', QUESTIONS)
+    attempt_id = database.start_student_attempt(quiz.id, 9700, 'student')
+    database.save_answer(attempt_id, 1, 't', True)
+    database.save_answer(attempt_id, 2, 'f', True)
+    
+    with count_statements(database.engine) as statements:
+        attempt = database.complete_attempt(attempt_id, 2, len(QUESTIONS), quiz.key_version)
+    
+    assert attempt.score == 2
+    # لا قراءة للأسئلة ولا لصفوف الإجابات في المسار المعتاد
+    assert not any('attempt_answers' in statement for statement in statements)
+    assert not any('quizzes.questions' in statement for statement in statements)
+
+def test_completion_with_stale_key_regrades_latest_answers():
+    teacher = database.add_teacher(7005, 'stale', 'Stale Key Teacher')
+    quiz = database.create_quiz(teacher.id, 'stale key', '', QUESTIONS)
+    attempt_id = database.start_student_attempt(quiz.id, 9800, 'student')
+    database.save_answer(attempt_id, 1, 'T', False)
+    database.save_answer(attempt_id, 2, 'f', False)
+    # إجابة مكررة للسؤال الثاني: تُعتمد الأخيرة
+    database.save_answer(attempt_id, 2, 't', False)
+    
+    attempt = database.complete_attempt(attempt_id, 0, len(QUESTIONS), quiz.key_version - 1)
+    
+    assert attempt.score == 1 and attempt.percentage == 50
+    answers = database.get_attempt_answers(attempt_id)
+    assert answers['1']['is_correct'] and not answers['2']['is_correct']
@@ -0,0 +1,21 @@
+import datetime
+from telegram import CallbackQuery, Chat, Message, Update, User
+from student import get_student_answer_handler, get_student_conv_handler
+
+STUDENT = User(id=42, first_name='student', is_bot=False)
+CHAT = Chat(id=42, type='private')
+
+def _answer_update(data):
+    message = Message(message_id=1, date=datetime.datetime.now(), chat=CHAT, from_user=STUDENT, text='x')
+    return Update(update_id=1, callback_query=CallbackQuery(
+        id='1', from_user=STUDENT, chat_instance='chat', data=data, message=message
+    ))
+
+def test_answer_buttons_work_without_conversation_state():
+    # بعد إعادة التشغيل أو على عامل آخر لا توجد حالة محادثة للطالب
+    update = _answer_update('student_answer_a_0')
+    assert not get_student_conv_handler().check_update(update)
+    assert get_student_answer_handler().check_update(update)
+
+def test_answer_handler_ignores_other_buttons():
+    assert not get_student_answer_handler().check_update(_answer_update('student_history'))